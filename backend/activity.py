@@ -0,0 +1,183 @@
+"""
+Activity time series for /admin/activity.
+
+History rows are counted per hour, day or week bucket and per type (and per
+user when asked) by a GROUP BY in the database: date_trunc() on PostgreSQL,
+strftime()/date() on SQLite. Weeks start on Monday on both.
+
+A bucket is closed once it ended more than ACTIVITY_CLOSE_DELAY seconds ago
+(rows are timestamped when recorded, so this covers the history write-behind
+buffer). Closed buckets are cached per worker for ACTIVITY_CACHE_TTL seconds,
+so a dashboard refreshing the same range only queries the open bucket. Rows
+deleted or archived afterwards stay in cached buckets until they expire.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import MemoryBackend, make_key
+from database import IS_SQLITE
+from models import History
+from settings import load_env
+
+load_env()
+
+ACTIVITY_CLOSE_DELAY = float(os.getenv("ACTIVITY_CLOSE_DELAY", "60"))
+ACTIVITY_CACHE_TTL = float(os.getenv("ACTIVITY_CACHE_TTL", "3600"))
+ACTIVITY_CACHE_ENTRIES = int(os.getenv("ACTIVITY_CACHE_ENTRIES", "10000"))
+ACTIVITY_MAX_BUCKETS = int(os.getenv("ACTIVITY_MAX_BUCKETS", "2000"))
+
+Bucket = Literal["hour", "day", "week"]
+
+STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+DEFAULT_SPANS = {"hour": timedelta(days=1), "day": timedelta(days=30), "week": timedelta(weeks=12)}
+
+# (bucket, start, by_user, user_id, type) -> counts of that closed bucket
+_closed = MemoryBackend(ACTIVITY_CACHE_ENTRIES)
+
+
+def truncate(moment: datetime, bucket: Bucket) -> datetime:
+    """Start of the bucket ``moment`` falls in, as the database computes it."""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == "hour":
+        return moment
+    moment = moment.replace(hour=0)
+    if bucket == "week":
+        moment -= timedelta(days=moment.weekday())
+    return moment
+
+
+def _utc(moment: datetime) -> datetime:
+    # created_at is naive UTC
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _bucket_column(bucket: Bucket):
+    if IS_SQLITE:
+        if bucket == "hour":
+            return func.strftime("%Y-%m-%d %H:00:00", History.created_at)
+        if bucket == "day":
+            return func.date(History.created_at)
+        # The Sunday on or after the day, minus six days
+        return func.date(History.created_at, "weekday 0", "-6 days")
+    # A literal unit, so the select and GROUP BY compile to the same expression
+    return func.date_trunc(literal_column(f"'{bucket}'"), History.created_at)
+
+
+def _as_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+async def _count(db: AsyncSession, bucket: Bucket, start: datetime, end: datetime,
+                 by_user: bool, user_id: int | None, type: str | None) -> dict:
+    """{bucket start: {type: count} or {user_id: {type: count}}} for rows in [start, end)."""
+    column = _bucket_column(bucket).label("bucket")
+    keys = [column, History.type] + ([History.user_id] if by_user else [])
+    query = (
+        select(*keys, func.count())
+        .where(History.created_at >= start, History.created_at < end)
+        .group_by(*keys)
+    )
+    if user_id is not None:
+        query = query.where(History.user_id == user_id)
+    if type is not None:
+        query = query.where(History.type == type)
+
+    counts = {}
+    for row in (await db.execute(query)).all():
+        counts_of = counts.setdefault(_as_datetime(row[0]), {})
+        if by_user:
+            counts_of = counts_of.setdefault(row[2], {})
+        counts_of[row[1] or ""] = row[-1]
+    return counts
+
+
+async def series(db: AsyncSession, bucket: Bucket, start: datetime | None = None, end: datetime | None = None,
+                 by_user: bool = False, user_id: int | None = None, type: str | None = None) -> dict:
+    """History counts per bucket in [start, end), oldest first, with empty buckets included."""
+    now = datetime.utcnow()
+    end = _utc(end) if end is not None else now
+    start = _utc(start) if start is not None else end - DEFAULT_SPANS[bucket]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    step = STEPS[bucket]
+    first = truncate(start, bucket)
+    if (end - first) / step > ACTIVITY_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range spans more than {ACTIVITY_MAX_BUCKETS} {bucket} buckets; use a larger bucket"
+        )
+    starts = []
+    while first < end:
+        starts.append(first)
+        first += step
+
+    # Only whole buckets are cached: one cut by start or end is queried each time
+    closes_before = now - timedelta(seconds=ACTIVITY_CLOSE_DELAY)
+    stamp = time.time()
+    counts = {}
+    closed, open_ = [], []
+    for begin in starts:
+        whole = begin >= start and begin + step <= end
+        if whole and begin + step <= closes_before:
+            closed.append(begin)
+            cached = _closed.get(make_key(bucket, begin.isoformat(), by_user, user_id, type), stamp)
+            if cached is not None:
+                counts[begin] = cached
+        else:
+            open_.append(begin)
+
+    missing = [begin for begin in closed if begin not in counts]
+    if missing:
+        # One query over the span of the missing buckets; every closed bucket in it gets cached
+        fetched = await _count(db, bucket, missing[0], missing[-1] + step, by_user, user_id, type)
+        for begin in closed:
+            if missing[0] <= begin <= missing[-1]:
+                counts[begin] = fetched.get(begin, {})
+                _closed.set(make_key(bucket, begin.isoformat(), by_user, user_id, type), counts[begin],
+                            stamp + ACTIVITY_CACHE_TTL)
+    # A bucket cut by start, and the run at the end of the range
+    runs = []
+    for begin in open_:
+        if runs and runs[-1][-1] + step == begin:
+            runs[-1].append(begin)
+        else:
+            runs.append([begin])
+    for run in runs:
+        counts.update(await _count(db, bucket, max(run[0], start), min(run[-1] + step, end),
+                                   by_user, user_id, type))
+
+    closed_set = set(closed)
+    buckets = []
+    for begin in starts:
+        counts_of = counts.get(begin, {})
+        item = {"start": begin, "closed": begin in closed_set}
+        if by_user:
+            item["users"] = [
+                {"user_id": user, "total": sum(by_type.values()), "by_type": by_type}
+                for user, by_type in sorted(counts_of.items(), key=lambda entry: (entry[0] is None, entry[0] or 0))
+            ]
+            item["total"] = sum(user["total"] for user in item["users"])
+        else:
+            item["total"] = sum(counts_of.values())
+            item["by_type"] = counts_of
+        buckets.append(item)
+
+    return {
+        "bucket": bucket,
+        "start": start,
+        "end": end,
+        "by_user": by_user,
+        "user_id": user_id,
+        "type": type,
+        "buckets": buckets,
+    }
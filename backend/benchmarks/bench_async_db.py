@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark: sync Session vs AsyncSession inside async handlers.
+
+Each simulated request does what /search/query does: look up the user, run a
+history scan, await an upstream call (asyncio.sleep) and insert a History row.
+With the sync session the DB work blocks the event loop, so every concurrent
+upstream wait stalls behind it; with AsyncSession the work overlaps.
+
+Besides throughput and latency, a probe task measures event-loop lag (how late
+a 5 ms sleep wakes up), which is what every other in-flight request on the
+worker pays while a handler blocks. Against a networked Postgres the async
+session also wins on throughput; on a local SQLite file the DB work is mostly
+CPU in-process, so expect the loop-lag numbers to carry the difference.
+
+Run from the backend directory:
+    python -m benchmarks.bench_async_db --requests 400 --concurrency 50
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_async_db
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_async_db.sqlite3")
+
+from sqlalchemy import select, func, insert, delete  # noqa: E402
+from database import Base, engine, SessionLocal, AsyncSessionLocal, async_engine  # noqa: E402
+from models import User, History  # noqa: E402
+
+USERNAME = "bench-user"
+
+
+def seed(rows: int) -> int:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = db.execute(select(User).where(User.username == USERNAME)).scalar_one_or_none()
+        if user is None:
+            user = User(username=USERNAME, hashed_password="x", role="user")
+            db.add(user)
+            db.commit()
+        existing = db.scalar(select(func.count(History.id)).where(History.user_id == user.id))
+        if existing < rows:
+            db.execute(insert(History), [
+                {"user_id": user.id, "type": "search", "query": f"query {i}", "result": f"result text {i}"}
+                for i in range(existing, rows)
+            ])
+            db.commit()
+        return user.id
+
+
+def sync_request(user_id: int):
+    with SessionLocal() as db:
+        db.execute(select(User).where(User.username == USERNAME)).scalar_one()
+        db.scalar(select(func.count(History.id)).where(History.user_id == user_id, History.query.contains("9")))
+        return db
+
+
+async def run_sync(user_id: int, upstream_latency: float):
+    db = sync_request(user_id)
+    await asyncio.sleep(upstream_latency)
+    with db:
+        db.add(History(user_id=user_id, type="search", query="bench", result="bench"))
+        db.commit()
+
+
+async def run_async(user_id: int, upstream_latency: float):
+    async with AsyncSessionLocal() as db:
+        (await db.execute(select(User).where(User.username == USERNAME))).scalar_one()
+        await db.scalar(select(func.count(History.id)).where(History.user_id == user_id, History.query.contains("9")))
+        await db.commit()
+        await asyncio.sleep(upstream_latency)
+        db.add(History(user_id=user_id, type="search", query="bench", result="bench"))
+        await db.commit()
+
+
+def percentile(values: list, pct: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def drive(handler, user_id: int, requests: int, concurrency: int, upstream_latency: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(user_id, upstream_latency)
+            latencies.append(time.perf_counter() - start)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+    latencies.sort()
+    lags.sort()
+    return {
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "loop_lag_p50_ms": round(statistics.median(lags) * 1000, 2),
+        "loop_lag_p99_ms": round(percentile(lags, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(lags[-1] * 1000, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="history rows to seed for the scan")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="simulated upstream call in seconds")
+    args = parser.parse_args()
+
+    user_id = seed(args.rows)
+    results = {}
+    for name, handler in (("sync_session", run_sync), ("async_session", run_async)):
+        results[name] = await drive(handler, user_id, args.requests, args.concurrency, args.upstream_latency)
+        print(f"{name:>14}: {results[name]}")
+
+    with SessionLocal() as db:
+        db.execute(delete(History).where(History.user_id == user_id, History.query == "bench"))
+        db.commit()
+    await async_engine.dispose()
+
+    results["speedup"] = round(results["async_session"]["throughput_rps"] / results["sync_session"]["throughput_rps"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Dashboard query benchmark over a large history table.
+
+Seeds ~1M History rows (one heavy user plus many light ones) and times:
+- the old unpaginated load (every row for the user, no ORDER BY/LIMIT)
+- the first keyset page and a deep keyset page reached by following cursors
+- an OFFSET page at the same depth, for comparison
+each with and without the composite (user_id, created_at) indexes.
+
+Run from the backend directory:
+    python -m benchmarks.bench_dashboard --rows 1000000
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_dashboard
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_dashboard.sqlite3")
+
+from sqlalchemy import select, func, insert, text  # noqa: E402
+from database import Base, engine, SessionLocal  # noqa: E402
+from models import User, History  # noqa: E402
+from migrate_db import HISTORY_INDEXES  # noqa: E402
+from pagination import paginate, split_page  # noqa: E402
+
+BATCH = 20000
+
+
+def seed(rows: int, users: int, heavy_share: float) -> int:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if db.scalar(select(func.count(History.id))) >= rows:
+            return db.scalar(select(User.id).where(User.username == "bench-user-0"))
+        db.execute(insert(User), [
+            {"username": f"bench-user-{i}", "hashed_password": "x", "role": "user"} for i in range(users)
+        ])
+        ids = db.scalars(select(User.id).where(User.username.like("bench-user-%")).order_by(User.id)).all()
+        heavy = ids[0]
+        start = datetime.utcnow() - timedelta(days=365)
+        rng = random.Random(42)
+        print(f"Seeding {rows} history rows...")
+        for offset in range(0, rows, BATCH):
+            db.execute(insert(History), [
+                {
+                    "user_id": heavy if rng.random() < heavy_share else rng.choice(ids),
+                    "type": rng.choice(("search", "image")),
+                    "query": f"query {i}",
+                    "result": f"result body {i} " * 4,
+                    "created_at": start + timedelta(seconds=i * 30),
+                }
+                for i in range(offset, min(offset + BATCH, rows))
+            ])
+            db.commit()
+        return heavy
+
+
+def set_indexes(enabled: bool):
+    with engine.begin() as conn:
+        for name, columns in HISTORY_INDEXES.items():
+            if enabled:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}"))
+            else:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 2)
+
+
+def run_suite(user_id: int, page_size: int, depth: int, repeat: int) -> dict:
+    base = select(History).where(History.user_id == user_id)
+
+    def unpaginated():
+        with SessionLocal() as db:
+            return db.execute(base).scalars().all()
+
+    def keyset(cursor=None):
+        with SessionLocal() as db:
+            rows = db.execute(paginate(base, cursor, page_size)).scalars().all()
+            return split_page(rows, page_size)
+
+    cursor = None
+    for _ in range(depth):
+        _, cursor = keyset(cursor)
+
+    def offset_page():
+        with SessionLocal() as db:
+            return db.execute(
+                base.order_by(History.created_at.desc(), History.id.desc()).offset(depth * page_size).limit(page_size)
+            ).scalars().all()
+
+    return {
+        "unpaginated_ms": timed(unpaginated, max(1, repeat // 5)),
+        "keyset_first_page_ms": timed(keyset, repeat),
+        f"keyset_page_{depth}_ms": timed(lambda: keyset(cursor), repeat),
+        f"offset_page_{depth}_ms": timed(offset_page, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.2, help="fraction of rows owned by the heavy user")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=200, help="page number for the deep-page measurements")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    user_id = seed(args.rows, args.users, args.heavy_share)
+    with SessionLocal() as db:
+        user_rows = db.scalar(select(func.count(History.id)).where(History.user_id == user_id))
+    results = {"rows": args.rows, "heavy_user_rows": user_rows, "page_size": args.page_size}
+    for label, enabled in (("without_indexes", False), ("with_indexes", True)):
+        set_indexes(enabled)
+        results[label] = run_suite(user_id, args.page_size, args.depth, args.repeat)
+        print(f"{label}: {results[label]}")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
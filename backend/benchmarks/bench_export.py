@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+History export benchmark: whole-list JSON vs the streaming export.
+
+Uses the bench_dashboard data set (seeding it if needed) and, for the heavy
+user, measures peak Python memory (tracemalloc), time to first chunk and
+total time of:
+- the old path: load every ORM object, then encode one JSON document
+- the streaming export as NDJSON, CSV and gzipped NDJSON
+
+Run from the backend directory:
+    python -m benchmarks.bench_export
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_export
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_dashboard.sqlite3")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal  # noqa: E402
+from models import History  # noqa: E402
+from benchmarks.bench_dashboard import seed  # noqa: E402
+import export  # noqa: E402
+
+
+async def load_all(user_id: int):
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(History).where(History.user_id == user_id))).scalars().all()
+        yield json.dumps(jsonable_encoder(rows)).encode()
+
+
+def streaming(user_id: int, format: str, gzip: bool):
+    return export.export_response([History.user_id == user_id], "bench", format, gzip).body_iterator
+
+
+async def measure(body) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    async for chunk in body:
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_chunk_ms": round((first or total) * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "peak_mb": round(peak / 2**20, 1),
+        "bytes": size,
+    }
+
+
+async def run(user_id: int) -> dict:
+    return {
+        "load_all_json": await measure(load_all(user_id)),
+        "stream_ndjson": await measure(streaming(user_id, "ndjson", False)),
+        "stream_csv": await measure(streaming(user_id, "csv", False)),
+        "stream_ndjson_gzip": await measure(streaming(user_id, "ndjson", True)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.2)
+    args = parser.parse_args()
+
+    user_id = seed(args.rows, args.users, args.heavy_share)
+    with SessionLocal() as db:
+        user_rows = db.scalar(select(func.count(History.id)).where(History.user_id == user_id))
+    results = {"user_rows": user_rows, "batch_rows": export.EXPORT_BATCH_ROWS, **asyncio.run(run(user_id))}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
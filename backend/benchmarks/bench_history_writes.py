@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+History write benchmark: a commit per request vs the write-behind buffer.
+
+Fires concurrent record() calls the way /search/query does after its upstream
+call returns (a random sleep up to --upstream-latency spreads the arrivals),
+once with write-behind off (one INSERT + COMMIT each) and once with it on
+(rows queued, bulk-inserted per flush), and reports throughput, per-request
+write latency and the number of transactions issued. Requests are spread
+over --users users, so concurrent commits meet on the shared per-day rollup
+rows (rollups.py) rather than on one user's.
+
+Run from the backend directory:
+    python -m benchmarks.bench_history_writes --requests 2000 --concurrency 100
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_history_writes
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_history_writes.sqlite3")
+
+from sqlalchemy import select, delete  # noqa: E402
+from database import Base, engine, SessionLocal, async_engine  # noqa: E402
+from models import User, History  # noqa: E402
+from history_writer import HistoryWriter, HISTORY_FLUSH_SIZE, HISTORY_FLUSH_INTERVAL  # noqa: E402
+from benchmarks.bench_async_db import percentile  # noqa: E402
+import fulltext  # noqa: E402
+import rollups  # noqa: E402
+
+USERNAME = "bench-writer"
+
+
+def setup(users: int) -> list[int]:
+    # Same triggers as production so each row pays for the FTS and rollup upkeep
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        fulltext.install(conn, rebuild=False)
+        rollups.install(conn)
+    ids = []
+    with SessionLocal() as db:
+        for n in range(users):
+            username = USERNAME if n == 0 else f"{USERNAME}-{n}"
+            user = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
+            if user is None:
+                user = User(username=username, hashed_password="x", role="user")
+                db.add(user)
+                db.commit()
+            ids.append(user.id)
+    return ids
+
+
+async def drive(writer: HistoryWriter, user_ids: list[int], requests: int, concurrency: int, upstream_latency: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            await asyncio.sleep(random.uniform(0, upstream_latency))
+            start = time.perf_counter()
+            user_id = user_ids[i % len(user_ids)]
+            await writer.record([{"user_id": user_id, "type": "search", "query": f"bench {i}", "result": "bench result"}])
+            latencies.append(time.perf_counter() - start)
+
+    await writer.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    await writer.stop()  # includes the final flush, so every row is committed
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "write_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "write_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "transactions": writer.flushes if writer.write_behind else requests,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50, help="users the requests are spread over")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="max simulated upstream call in seconds")
+    parser.add_argument("--flush-size", type=int, default=HISTORY_FLUSH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=HISTORY_FLUSH_INTERVAL)
+    args = parser.parse_args()
+
+    user_ids = setup(args.users)
+    results = {}
+    for name, write_behind in (("commit_per_request", False), ("write_behind", True)):
+        writer = HistoryWriter(write_behind, args.flush_size, args.flush_interval)
+        results[name] = await drive(writer, user_ids, args.requests, args.concurrency, args.upstream_latency)
+        print(f"{name:>18}: {results[name]}")
+
+    with SessionLocal() as db:
+        db.execute(delete(History).where(History.user_id.in_(user_ids)))
+        db.commit()
+    await async_engine.dispose()
+
+    results["speedup"] = round(results["write_behind"]["throughput_rps"] / results["commit_per_request"]["throughput_rps"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Import-time profile of the backend: what a cold worker pays before serving.
+
+Runs ``python -X importtime -c "import main"`` --runs times, each in a fresh
+interpreter, and reports the median of:
+- the whole import, timed inside the child
+- self time summed per top-level package (fastapi, sqlalchemy, mcp, ...),
+  which adds up to the total, so it shows where startup time goes
+- each backend module's cumulative time: itself plus whatever it was first
+  to import, in the order the app loads them
+
+Imports done later, on first use (the MCP client, passlib, DB drivers), are
+left out on purpose; --module picks another entry point, e.g. routers.image.
+
+Run from the backend directory:
+    python -m benchmarks.import_time --runs 7
+    python -m benchmarks.import_time --module migrate_db --top 10 --output import.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the import's wall time on stdout; -X importtime writes to stderr
+CHILD = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def is_backend(name: str) -> bool:
+    root = name.split(".")[0]
+    return os.path.exists(os.path.join(BACKEND_DIR, root + ".py")) or os.path.isdir(os.path.join(BACKEND_DIR, root))
+
+
+def profile(module: str) -> tuple[float, list[tuple[str, int, int]]]:
+    """One fresh import: (seconds, [(module, self_us, cumulative_us)] in load order)."""
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite:///bench_import.sqlite3")
+    env.setdefault("SECRET_KEY", "bench")
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(module=module)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if child.returncode != 0:
+        sys.exit(f"import {module} failed:\n{child.stderr[-2000:]}")
+    modules = []
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return float(child.stdout.strip().splitlines()[-1]), modules
+
+
+def median_ms(values: list[int]) -> float:
+    return round(statistics.median(values) / 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import (default: main, the app)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    profile(args.module)  # warm-up: writes bytecode and fills the OS file cache
+    totals, packages, backend = [], {}, {}
+    for _ in range(args.runs):
+        seconds, modules = profile(args.module)
+        totals.append(seconds)
+        per_package = {}
+        for name, self_us, cumulative_us in modules:
+            package = name.split(".")[0]
+            per_package[package] = per_package.get(package, 0) + self_us
+            if is_backend(name):
+                backend.setdefault(name, []).append(cumulative_us)
+        for package, self_us in per_package.items():
+            packages.setdefault(package, []).append(self_us)
+
+    ranked = sorted(packages.items(), key=lambda item: -statistics.median(item[1]))
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "import_ms": round(statistics.median(totals) * 1000, 1),
+        "packages_ms": {package: median_ms(values) for package, values in ranked[:args.top]},
+        # Load order; each module's time includes the third-party imports it triggered first
+        "backend_modules_ms": {name: median_ms(values) for name, values in backend.items()},
+    }
+
+    print(f"import {args.module}: {report['import_ms']} ms (median of {args.runs})")
+    print(f"\n{'package':<28} {'self ms':>9}")
+    for package, ms in report["packages_ms"].items():
+        print(f"{package:<28} {ms:>9}")
+    print(f"\n{'backend module':<28} {'cumulative ms':>14}")
+    for name, ms in report["backend_modules_ms"].items():
+        print(f"{name:<28} {ms:>14}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
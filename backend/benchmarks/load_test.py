@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: the real app against local upstream stand-ins.
+
+Starts benchmarks.mock_upstreams, creates a fresh database (a temporary SQLite
+file unless --database-url is given), starts the backend under uvicorn
+pointed at the mocks, registers --users users plus an admin, and then runs
+--concurrency virtual users for --duration seconds. Each virtual user picks
+its next call from --mix:
+    login        POST /auth/login (password hashing)
+    search       POST /search/query over a vocabulary of --queries queries
+                 (a small vocabulary means more cache hits)
+    image        POST /image/generate with a unique prompt
+    dashboard    GET /dashboard/ (first page)
+    admin_stats  GET /admin/stats
+
+The report is JSON: throughput, error count and p50/p95/p99 latency per
+endpoint and overall, plus the git commit and settings, so runs can be
+diffed across commits. --compare prints the change against an earlier
+report and exits with status 1 when any endpoint's p95 grew by more than
+--max-regression.
+
+Run from the backend directory:
+    python -m benchmarks.load_test --duration 30 --concurrency 50 --output load.json
+    python -m benchmarks.load_test --compare load.json
+    python -m benchmarks.load_test --database-url postgresql://... --workers 4
+Set BCRYPT_ROUNDS etc. in the environment as in production; it is passed on.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.bench_async_db import percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("login", "search", "image", "dashboard", "admin_stats")
+DEFAULT_MIX = "login=1,search=4,image=1,dashboard=6,admin_stats=1"
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r} in --mix; choose from {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{' '.join(process.args)} exited with status {process.returncode}")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise SystemExit(f"Nothing listening on port {port} after {timeout}s")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.statuses = {name: {} for name in ENDPOINTS}
+
+    def add(self, name: str, seconds: float, status: int):
+        self.latencies[name].append(seconds)
+        self.statuses[name][str(status)] = self.statuses[name].get(str(status), 0) + 1
+        if status >= 400:
+            self.errors[name] += 1
+
+    @staticmethod
+    def summary(latencies: list, errors: int, elapsed: float) -> dict:
+        latencies = sorted(latencies)
+        if not latencies:
+            return {"requests": 0}
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {
+            name: {**self.summary(self.latencies[name], self.errors[name], elapsed), "statuses": self.statuses[name]}
+            for name in ENDPOINTS if self.latencies[name]
+        }
+        everything = [value for name in ENDPOINTS for value in self.latencies[name]]
+        overall = self.summary(everything, sum(self.errors.values()), elapsed)
+        return {"overall": overall, "endpoints": endpoints}
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, username: str, password: str, token: str, admin_token: str, args):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        self.args = args
+
+    async def call(self, name: str, rng: random.Random) -> int:
+        if name == "login":
+            response = await self.client.post("/auth/login", data={"username": self.username, "password": self.password})
+        elif name == "search":
+            query = f"benchmark topic {rng.randrange(self.args.queries)}"
+            response = await self.client.post("/search/query", json={"query": query}, headers=self.headers)
+        elif name == "image":
+            response = await self.client.post("/image/generate", json={"prompt": f"benchmark image {uuid.uuid4().hex}"}, headers=self.headers)
+        elif name == "dashboard":
+            response = await self.client.get("/dashboard/", headers=self.headers)
+        else:
+            response = await self.client.get("/admin/stats", headers=self.admin_headers)
+        return response.status_code
+
+
+async def register(client: httpx.AsyncClient, username: str, password: str, role: str = "user") -> str:
+    response = await client.post("/auth/register", json={"username": username, "password": password, "role": role})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_load(base_url: str, args) -> dict:
+    weights = parse_mix(args.mix)
+    names, values = list(weights), list(weights.values())
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        admin_token = await register(client, f"bench-admin-{run_id}", "bench-password", "admin")
+        accounts = []
+        for i in range(args.users):
+            username = f"bench-{run_id}-{i}"
+            accounts.append((username, await register(client, username, "bench-password")))
+
+        recorder = Recorder()
+        deadline = 0.0
+        measuring = False
+
+        async def virtual_user(index: int):
+            username, token = accounts[index % len(accounts)]
+            user = VirtualUser(client, username, "bench-password", token, admin_token, args)
+            rng = random.Random(args.seed + index)
+            while time.monotonic() < deadline:
+                name = rng.choices(names, values)[0]
+                start = time.perf_counter()
+                try:
+                    status = await user.call(name, rng)
+                except httpx.HTTPError:
+                    status = 599  # client-side timeout or connection error
+                if measuring:
+                    recorder.add(name, time.perf_counter() - start, status)
+
+        if args.warmup > 0:
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+        measuring = True
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+        return recorder.report(time.monotonic() - start)
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> bool:
+    """Print p95 and throughput changes per endpoint; False if any p95 regressed too far."""
+    ok = True
+    print(f"{'endpoint':<12} {'p95 before':>11} {'p95 after':>10} {'change':>8} {'rps before':>11} {'rps after':>10}")
+    rows = [("overall", baseline.get("overall", {}), report["overall"])]
+    rows += [(name, baseline["endpoints"].get(name, {}), stats) for name, stats in report["endpoints"].items()]
+    for name, before, after in rows:
+        if not before.get("requests") or not after.get("requests"):
+            continue
+        change = after["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        flag = ""
+        if change > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(
+            f"{name:<12} {before['p95_ms']:>11.1f} {after['p95_ms']:>10.1f} {change:>+8.1%} "
+            f"{before['throughput_rps']:>11.1f} {after['throughput_rps']:>10.1f}{flag}"
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds first (fills caches and pools)")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--users", type=int, default=10, help="accounts the virtual users share")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight pairs")
+    parser.add_argument("--queries", type=int, default=200, help="distinct search queries")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="default: a fresh temporary SQLite file")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tavily-port", type=int, default=8101)
+    parser.add_argument("--flux-port", type=int, default=8102)
+    parser.add_argument("--tavily-latency", type=float, default=0.3)
+    parser.add_argument("--flux-latency", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed p95 growth for --compare")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'load.sqlite3')}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "load-test-secret"),
+        "TAVILY_API_KEY": "load-test",
+        "TAVILY_API_URL": f"http://127.0.0.1:{args.tavily_port}/search",
+        "FLUX_API_KEY": "load-test",
+        "FLUX_API_URL": f"http://127.0.0.1:{args.flux_port}/mcp",
+        "IMAGE_STORE_DIR": os.path.join(workdir, "image_store"),
+        "IMAGE_STORE_ALLOWED_HOSTS": "127.0.0.1",  # the mock serves the generated images
+        "SEARCH_CACHE_PATH": os.path.join(workdir, "search_cache.sqlite3"),
+    }
+    processes = []
+    try:
+        mocks = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.mock_upstreams",
+            "--tavily-port", str(args.tavily_port), "--flux-port", str(args.flux_port),
+            "--tavily-latency", str(args.tavily_latency), "--flux-latency", str(args.flux_latency),
+            "--jitter", str(args.jitter), "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+        ], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+        processes.append(mocks)
+        wait_for_port(args.tavily_port, mocks)
+        wait_for_port(args.flux_port, mocks)
+
+        subprocess.run([sys.executable, "init_db.py"], cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        log = open(os.path.join(workdir, "backend.log"), "w")
+        backend = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+            "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+        ], cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        processes.append(backend)
+        wait_for_port(args.port, backend)
+
+        results = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", args))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": database_url.split("://", 1)[0],
+        "settings": {
+            key: getattr(args, key) for key in (
+                "duration", "concurrency", "users", "mix", "queries", "workers",
+                "tavily_latency", "flux_latency", "jitter", "error_rate", "seed",
+            )
+        },
+        **results,
+    }
+    print(json.dumps(report, indent=2))
+    print(f"Backend log: {os.path.join(workdir, 'backend.log')}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(report, json.load(f), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the upstream APIs, for load tests and benchmarks.
+
+Runs two servers in one process:
+- a Tavily-compatible HTTP API: POST /search returns {"answer", "results"},
+  and GET /img/<name>.png serves a small PNG (the "generated" images)
+- a Flux-compatible MCP server (streamable HTTP at /mcp) whose
+  generateImageUrl tool returns {"imageUrl": ".../img/<name>.png"}
+
+Each upstream sleeps for its configured latency (uniformly jittered by
+--jitter) and fails a configurable share of calls: Tavily with a 502, Flux
+with a tool error. Point the backend at it with:
+    TAVILY_API_URL=http://127.0.0.1:8101/search
+    FLUX_API_URL=http://127.0.0.1:8102/mcp
+
+Run from the backend directory:
+    python -m benchmarks.mock_upstreams --tavily-latency 0.3 --flux-latency 2 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Response
+from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp.exceptions import ToolError
+
+
+def png(name: str, size: int = 256) -> bytes:
+    """Solid-colour PNG whose colour is derived from ``name``."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + hashlib.sha256(name.encode()).digest()[:3] * size
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(row * size)) + chunk(b"IEND", b"")
+
+
+class Upstream:
+    """Latency and failure injection for one mock upstream."""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+
+    async def respond(self) -> bool:
+        """Wait out the simulated latency; False means this call should fail."""
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)))
+        if self._random.random() < self.error_rate:
+            self.failures += 1
+            return False
+        return True
+
+
+def tavily_app(upstream: Upstream) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/search")
+    async def search(body: dict):
+        if not await upstream.respond():
+            raise HTTPException(status_code=502, detail="mock upstream error")
+        query = body.get("query", "")
+        results = [
+            {"title": f"Result {i} for {query}", "url": f"https://example.com/{i}", "content": f"Content {i} about {query}"}
+            for i in range(int(body.get("max_results", 5)))
+        ]
+        return {"query": query, "answer": f"Mock answer about {query}", "results": results}
+
+    @app.get("/img/{name}")
+    async def image(name: str):
+        return Response(png(name), media_type="image/png")
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": upstream.calls, "failures": upstream.failures}
+
+    return app
+
+
+def flux_server(upstream: Upstream, image_base: str) -> FastMCP:
+    server = FastMCP("mock-flux", log_level="WARNING")
+
+    @server.tool()
+    async def generateImageUrl(prompt: str) -> str:
+        if not await upstream.respond():
+            raise ToolError("mock upstream error")
+        name = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+        return json.dumps({"imageUrl": f"{image_base}/img/{name}.png"})
+
+    return server
+
+
+async def serve(args):
+    tavily = Upstream(args.tavily_latency, args.jitter, args.tavily_error_rate, args.seed)
+    flux = Upstream(args.flux_latency, args.jitter, args.flux_error_rate, args.seed + 1)
+    image_base = f"http://{args.host}:{args.tavily_port}"
+    servers = [
+        uvicorn.Server(uvicorn.Config(tavily_app(tavily), host=args.host, port=args.tavily_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(
+            flux_server(flux, image_base).streamable_http_app(), host=args.host, port=args.flux_port, log_level="warning"
+        )),
+    ]
+    print(f"Mock Tavily on {image_base}/search, mock Flux MCP on http://{args.host}:{args.flux_port}/mcp", flush=True)
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tavily-port", type=int, default=8101)
+    parser.add_argument("--flux-port", type=int, default=8102)
+    parser.add_argument("--tavily-latency", type=float, default=0.3, help="seconds per search")
+    parser.add_argument("--flux-latency", type=float, default=2.0, help="seconds per image")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies uniformly by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="default failure share for both upstreams")
+    parser.add_argument("--tavily-error-rate", type=float)
+    parser.add_argument("--flux-error-rate", type=float)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.tavily_error_rate is None:
+        args.tavily_error_rate = args.error_rate
+    if args.flux_error_rate is None:
+        args.flux_error_rate = args.error_rate
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
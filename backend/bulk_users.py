@@ -0,0 +1,182 @@
+"""
+Bulk user administration: import, role changes and deletes.
+
+Every operation answers with one result per input row (import) or user id,
+and works on sets rather than one user at a time:
+- import_users checks which usernames exist with one query per batch of
+  ADMIN_IMPORT_BATCH_SIZE rows, hashes the batch's passwords in parallel
+  (passwords.hash_passwords) and inserts it with one multi-row INSERT,
+  committing per batch
+- change_roles is a single UPDATE ... RETURNING; it bumps token_version of
+  the users whose role changes, which signs them out
+- delete_users removes the users' History with one DELETE and the users
+  with another, in one transaction
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import case, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import dialect_module
+from dependencies import invalidate_principal
+from history_writer import history_writer
+from models import User, History
+from passwords import hash_passwords
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADMIN_BULK_MAX_ROWS = int(os.getenv("ADMIN_BULK_MAX_ROWS", "10000"))
+ADMIN_IMPORT_BATCH_SIZE = int(os.getenv("ADMIN_IMPORT_BATCH_SIZE", "500"))
+
+ROLES = ("user", "admin")
+
+
+def _check_size(count: int):
+    if count > ADMIN_BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {ADMIN_BULK_MAX_ROWS} rows per request")
+
+
+def parse_import(body: bytes, content_type: str) -> list[dict]:
+    """Rows from a JSON list (or {"users": [...]}) or a CSV with a username,password,role header."""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Import must be UTF-8")
+    if "json" in content_type:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        if isinstance(data, dict):
+            data = data.get("users")
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise HTTPException(status_code=400, detail="Expected a list of user objects")
+        rows = data
+    elif "csv" in content_type or "text/plain" in content_type:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not {"username", "password"} <= {name.strip() for name in reader.fieldnames}:
+            raise HTTPException(status_code=400, detail="CSV needs a header row with username and password columns")
+        rows = [{key.strip(): value for key, value in row.items() if key} for row in reader]
+    else:
+        raise HTTPException(status_code=415, detail="Send the import as application/json or text/csv")
+    _check_size(len(rows))
+    return rows
+
+
+def _insert():
+    dialect = dialect_module()
+    # A username registered since the existence check is skipped, not an error for the whole batch
+    return (
+        dialect.insert(User)
+        .on_conflict_do_nothing(index_elements=["username"])
+        .returning(User.id, User.username)
+    )
+
+
+async def import_users(db: AsyncSession, rows: list[dict]) -> dict:
+    results: list[dict | None] = [None] * len(rows)
+    candidates = []  # (row index, username, password, role)
+    seen = set()
+    for i, row in enumerate(rows):
+        username = str(row.get("username") or "").strip()
+        password = str(row.get("password") or "")
+        role = str(row.get("role") or "user").strip()
+        error = None
+        if not username or not password:
+            error = "username and password are required"
+        elif role not in ROLES:
+            error = f"Invalid role {role!r}"
+        elif username in seen:
+            error = "Duplicate username in import"
+        if error:
+            results[i] = {"row": i + 1, "username": username or None, "status": "error", "detail": error}
+            continue
+        seen.add(username)
+        candidates.append((i, username, password, role))
+
+    for start in range(0, len(candidates), ADMIN_IMPORT_BATCH_SIZE):
+        batch = candidates[start:start + ADMIN_IMPORT_BATCH_SIZE]
+        existing = set((await db.execute(
+            select(User.username).where(User.username.in_([username for _, username, _, _ in batch]))
+        )).scalars())
+        new = [candidate for candidate in batch if candidate[1] not in existing]
+        # Hash only the rows that will be inserted; this is where the time goes
+        hashes = await hash_passwords([password for _, _, password, _ in new])
+        created = {}
+        if new:
+            created = {username: id for id, username in (await db.execute(_insert(), [
+                {"username": username, "hashed_password": hashed, "role": role}
+                for (_, username, _, role), hashed in zip(new, hashes)
+            ])).all()}
+            await db.commit()
+        for i, username, _, _ in batch:
+            if username in created:
+                results[i] = {"row": i + 1, "username": username, "status": "created", "id": created[username]}
+            else:
+                results[i] = {"row": i + 1, "username": username, "status": "error", "detail": "Username already exists"}
+
+    return _report(results, "created")
+
+
+async def change_roles(db: AsyncSession, user_ids: list[int], role: str, admin_id: int) -> dict:
+    _check_size(len(user_ids))
+    ids = list(dict.fromkeys(user_ids))
+    targets = [user_id for user_id in ids if user_id != admin_id]
+    updated = {}
+    if targets:
+        updated = dict((await db.execute(
+            update(User).where(User.id.in_(targets)).values(
+                role=role,
+                token_version=case((User.role != role, User.token_version + 1), else_=User.token_version),
+            ).returning(User.id, User.username)
+        )).all())
+        await db.commit()
+    for username in updated.values():
+        invalidate_principal(username)
+    return _report([_outcome(user_id, updated, admin_id, "updated", "Cannot change your own role") for user_id in ids], "updated")
+
+
+async def delete_users(db: AsyncSession, user_ids: list[int], admin_id: int) -> dict:
+    _check_size(len(user_ids))
+    ids = list(dict.fromkeys(user_ids))
+    targets = [user_id for user_id in ids if user_id != admin_id]
+    deleted = {}
+    history_rows = 0
+    if targets:
+        # Rows still buffered for these users must land before the DELETE
+        for user_id in targets:
+            await history_writer.sync_user(user_id)
+        history_rows = (await db.execute(delete(History).where(History.user_id.in_(targets)))).rowcount
+        deleted = dict((await db.execute(
+            delete(User).where(User.id.in_(targets)).returning(User.id, User.username)
+        )).all())
+        await db.commit()
+    for username in deleted.values():
+        invalidate_principal(username)
+    report = _report([_outcome(user_id, deleted, admin_id, "deleted", "Cannot delete your own account") for user_id in ids], "deleted")
+    report["history_deleted"] = history_rows
+    return report
+
+
+def _outcome(user_id: int, done: dict, admin_id: int, status: str, own_account: str) -> dict:
+    if user_id == admin_id:
+        return {"id": user_id, "status": "error", "detail": own_account}
+    if user_id not in done:
+        return {"id": user_id, "status": "error", "detail": "User not found"}
+    return {"id": user_id, "username": done[user_id], "status": status}
+
+
+def _report(results: list[dict], status: str) -> dict:
+    succeeded = sum(1 for result in results if result["status"] == status)
+    return {status: succeeded, "failed": len(results) - succeeded, "results": results}
@@ -0,0 +1,207 @@
+"""
+TTL + LRU result cache for paid upstream calls.
+
+Two backends are available: an in-process OrderedDict ("memory") and a local
+SQLite file ("sqlite") that several workers on the same host can share.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "memory")  # memory, sqlite or none
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.sqlite3")
+
+
+def normalize_query(query: str) -> str:
+    """Lower-case and collapse whitespace so trivially different queries share a key."""
+    return " ".join(query.lower().split())
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, separators=(",", ":")).encode()).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU dict of key -> (value, expires_at)."""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+
+    def get(self, key: str, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, expires_at: float):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+
+class SQLiteBackend:
+    """Shared LRU table in a local SQLite file, evicting by last access time."""
+
+    name = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_last_access ON cache (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per worker thread; calls arrive via asyncio.to_thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, now: float):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, expires_at: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def size(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+class ResultCache:
+    """Async facade over a backend that stores JSON values and counts hits and misses."""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get(self, key: str):
+        if self.backend is None:
+            return None
+        try:
+            raw = await self._call(self.backend.get, key, time.time())
+        except Exception:
+            logger.exception("Cache read failed")
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value):
+        if self.backend is None:
+            return
+        try:
+            await self._call(self.backend.set, key, json.dumps(value), time.time() + self.ttl)
+        except Exception:
+            logger.exception("Cache write failed")
+
+    async def clear(self):
+        if self.backend is not None:
+            await self._call(self.backend.clear)
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend else "none",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": await self._call(self.backend.size) if self.backend else 0,
+            "ttl": self.ttl,
+        }
+
+
+def build_cache(backend: str, ttl: float, max_entries: int, path: str) -> ResultCache:
+    if backend == "memory":
+        return ResultCache(MemoryBackend(max_entries), ttl)
+    if backend == "sqlite":
+        return ResultCache(SQLiteBackend(path, max_entries), ttl)
+    if backend != "none":
+        logger.warning(f"Unknown cache backend '{backend}', caching disabled")
+    return ResultCache(None, ttl)
+
+
+search_cache = build_cache(SEARCH_CACHE_BACKEND, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_PATH)
@@ -0,0 +1,108 @@
+"""
+Conditional GET and response compression helpers.
+
+make_etag() / etag_matches() let list endpoints answer If-None-Match with a
+bare 304 before any serialization. JSONCompressionMiddleware compresses
+finished JSON bodies only: streams (SSE, NDJSON, exports), images and byte
+ranges pass through untouched, unlike Starlette's GZipMiddleware, which
+buffers streams inside the compressor and would gzip 206 responses.
+"""
+
+import gzip
+import os
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from cache import make_key
+from settings import load_env
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+load_env()
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+
+# Lists may change at any time, so clients must revalidate on every use
+REVALIDATE = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag over JSON-serializable parts (use str() for datetimes)."""
+    return '"' + make_key(*parts)[:32] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Response | None:
+    """Tag ``response`` with ``etag``; return a bare 304 to send instead if the client already has it."""
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+class JSONCompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _encoding(self, scope: Scope) -> str | None:
+        accepted = Headers(scope=scope).get("accept-encoding", "")
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = self._encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        held: Message | None = None
+
+        async def send_compressed(message: Message):
+            nonlocal held
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                    held = message  # wait for the body to decide
+                    return
+                await send(message)
+                return
+            if held is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            start, held = held, None
+            body = message.get("body", b"")
+            if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                body = self._compress(body, encoding)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -1,19 +1,129 @@
-from sqlalchemy import create_engine
+"""
+Database engines and sessions, created on first use.
+
+Importing this module builds no engine and loads no driver: get_engine()
+and get_async_engine() create them when first called (engine,
+async_engine, SessionLocal and AsyncSessionLocal remain available as
+module attributes and do the same). add_engine_hook() registers a function
+called with (engine, name) for every engine, e.g. to instrument its pool.
+"""
+
+import importlib
+from functools import lru_cache
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
-import os
+from settings import get_settings
+
+settings = get_settings()
+DATABASE_URL = settings.database_url
 
-load_dotenv()
+def to_async_url(url: str) -> str:
+    """Map a sync driver URL to its asyncio driver (asyncpg / aiosqlite)."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+DIALECT = make_url(ASYNC_DATABASE_URL).get_backend_name()
+
+DB_POOL_SIZE = settings.db_pool_size
+DB_MAX_OVERFLOW = settings.db_max_overflow
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+DB_SSLMODE = settings.db_sslmode
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, connect_args={"sslmode": "require"}, pool_pre_ping=True,  pool_recycle=3600)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+_engine_hooks = []
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL + busy timeout let concurrent local requests write without "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """Sync engine for scripts (init_db, migrations, backfills) and background maintenance."""
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={} if IS_SQLITE else {"sslmode": DB_SSLMODE},
+        pool_pre_ping=True,
+        pool_recycle=3600,
+    )
+    if IS_SQLITE:
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    for hook in _engine_hooks:
+        hook(engine, "sync")
+    return engine
+
+@lru_cache(maxsize=None)
+def get_async_engine():
+    """Async engine used by the API so queries don't block the event loop."""
+    # aiosqlite opens a connection per checkout, so there is no pool to size
+    pool_args = {} if IS_SQLITE else {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args={} if IS_SQLITE else {"ssl": DB_SSLMODE},
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        **pool_args,
+    )
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    for hook in _engine_hooks:
+        hook(async_engine.sync_engine, "async")
+    return async_engine
+
+def add_engine_hook(hook):
+    """Call hook(engine, name) for each engine as it is created, and for any already created."""
+    _engine_hooks.append(hook)
+    if get_engine.cache_info().currsize:
+        hook(get_engine(), "sync")
+    if get_async_engine.cache_info().currsize:
+        hook(get_async_engine().sync_engine, "async")
+
+@lru_cache(maxsize=None)
+def get_sessionmaker():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+@lru_cache(maxsize=None)
+def get_async_sessionmaker():
+    return async_sessionmaker(get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+_LAZY = {
+    "engine": get_engine,
+    "async_engine": get_async_engine,
+    "SessionLocal": get_sessionmaker,
+    "AsyncSessionLocal": get_async_sessionmaker,
+}
+
+def __getattr__(name):
+    # "from database import engine" still works; the engine is built on that first access
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def dialect_module():
+    """sqlalchemy.dialects.sqlite or .postgresql (for insert().on_conflict_do_nothing()), imported on first use."""
+    return importlib.import_module("sqlalchemy.dialects." + ("sqlite" if IS_SQLITE else "postgresql"))
+
+def async_session() -> AsyncSession:
+    """A new AsyncSession, for work outside a request (get_db inside one)."""
+    return get_async_sessionmaker()()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with async_session() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,35 +1,80 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from models import User
-from dotenv import load_dotenv
+from cache import MemoryBackend
+from dataclasses import dataclass
+from settings import get_settings
 import os
+import time
 
-# Load environment variables
-load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY")
+settings = get_settings()
+SECRET_KEY = settings.secret_key
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY not found in .env file")
-ALGORITHM = "HS256"
+ALGORITHM = settings.jwt_algorithm
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by request handlers, detached from any DB session."""
+    id: int
+    username: str
+    role: str
+    token_version: int
+
+# Keyed by token subject (username). Per process: other workers see admin
+# changes after at most PRINCIPAL_CACHE_TTL seconds, except on admin routes,
+# which always check the user against the database (see get_admin_user).
+_principals = MemoryBackend(PRINCIPAL_CACHE_MAX_ENTRIES)
+
+def invalidate_principal(username: str):
+    _principals.delete(username)
+
+async def _load_principal(username: str, db: AsyncSession):
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
+    if not user:
+        invalidate_principal(username)
+        return None
+    principal = Principal(id=user.id, username=user.username, role=user.role, token_version=user.token_version)
+    _principals.set(username, principal, time.time() + PRINCIPAL_CACHE_TTL)
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if not username:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_admin_user(current_user: User = Depends(get_current_user)):
+    token_version = payload.get("ver", 0)
+    principal = _principals.get(username, time.time())
+    # A token newer than the cached principal means another worker changed the user
+    if principal is None or token_version > principal.token_version:
+        principal = await _load_principal(username, db)
+    if not principal:
+        raise HTTPException(status_code=401, detail="User not found")
+    if token_version != principal.token_version:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return principal
+
+async def get_admin_user(current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
-    return current_user
\ No newline at end of file
+    # A demotion or revocation on another worker takes effect at once, not after the cache TTL
+    principal = await _load_principal(current_user.username, db)
+    if not principal:
+        raise HTTPException(status_code=401, detail="User not found")
+    if principal.token_version != current_user.token_version:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    if principal.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return principal
\ No newline at end of file
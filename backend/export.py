@@ -0,0 +1,122 @@
+"""
+Streaming History export as NDJSON or CSV, optionally gzip-compressed.
+
+Rows are read in batches of EXPORT_BATCH_ROWS through a server-side cursor
+(``yield_per``), encoded one batch at a time and handed to a
+StreamingResponse, so memory stays flat however large the export is.
+The generator opens its own session: request-scoped dependencies are torn
+down before a streaming body is sent. Results kept in the result store are
+joined in compressed and unpacked batch by batch.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import zlib
+from typing import Literal
+from urllib.parse import quote
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from database import async_session
+from models import History, StoredResult
+from settings import load_env
+import result_store
+
+load_env()
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+
+ExportFormat = Literal["ndjson", "csv"]
+
+COLUMNS = [History.id, History.user_id, History.type, History.query, History.result, History.meta_data, History.created_at]
+FIELDS = [column.key for column in COLUMNS]
+RESULT = FIELDS.index("result")
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Left out of the plain filename parameter: non-ASCII, controls, quotes, backslashes and path separators
+UNSAFE_FILENAME = re.compile(r'[^\x20-\x7e]|["\\/;]')
+
+
+def content_disposition(filename: str) -> str:
+    """An attachment header for any filename: an ASCII fallback plus the exact UTF-8 name (RFC 6266)."""
+    fallback = UNSAFE_FILENAME.sub("_", filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _ndjson(rows) -> str:
+    lines = []
+    for row in rows:
+        item = dict(zip(FIELDS, row))
+        if item["created_at"] is not None:
+            item["created_at"] = item["created_at"].isoformat()
+        lines.append(json.dumps(item, ensure_ascii=False))
+    return "\n".join(lines) + "\n"
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _header(format: ExportFormat) -> str:
+    return _csv([FIELDS]) if format == "csv" else ""
+
+
+def _unpack(rows) -> list:
+    unpacked = []
+    for *row, codec, body in rows:
+        if body is not None:
+            row[RESULT] = result_store.unpack(codec, body)
+        unpacked.append(row)
+    return unpacked
+
+
+async def _batches(query, format: ExportFormat):
+    encode = _csv if format == "csv" else _ndjson
+    async with async_session() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        async for rows in result.partitions():
+            yield encode(_unpack(rows)).encode()
+
+
+async def _body(query, format: ExportFormat, gzip: bool):
+    header = _header(format).encode()
+    if not gzip:
+        # Send the header straight away so the client sees the first byte before the query runs
+        if header:
+            yield header
+        async for chunk in _batches(query, format):
+            yield chunk
+        return
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    if header:
+        yield compressor.compress(header) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    async for chunk in _batches(query, format):
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_response(filters, filename: str, format: ExportFormat, gzip: bool) -> StreamingResponse:
+    """Stream the History rows matching ``filters`` oldest first as a file download."""
+    query = (
+        select(*COLUMNS, StoredResult.codec, StoredResult.body)
+        .outerjoin(StoredResult, StoredResult.hash == History.result_hash)
+        .where(*filters)
+        .order_by(History.created_at, History.id)
+    )
+    filename = f"{filename}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        _body(query, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
@@ -0,0 +1,155 @@
+"""
+Full-text search over History.query and History.result.
+
+PostgreSQL: a generated, weighted tsvector column (query > result) with a GIN
+index; the database keeps it current on every insert and update.
+SQLite: an external-content FTS5 table mirrored by insert/update/delete
+triggers. Other backends fall back to an unindexed LIKE over both columns.
+
+Results kept in the results table (result_store.py) are indexed once per
+stored body rather than per History row: results.search_vector on
+PostgreSQL, the contentless results_fts table on SQLite. They are filled
+by index_results() when a body is first stored, since only the application
+sees the uncompressed text. A History row matches when its query/inline
+result or its stored result matches. All search terms must then be found
+in one of the two.
+
+install() is idempotent and is run by init_db.py and migrate_db.py.
+"""
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, literal_column, or_, select, text
+
+from database import DIALECT
+from models import History, StoredResult
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+        query, result, content='history', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+        INSERT INTO history_fts(rowid, query, result) VALUES (new.id, new.query, new.result);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+        INSERT INTO history_fts(history_fts, rowid, query, result) VALUES ('delete', old.id, old.query, old.result);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF query, result ON history BEGIN
+        INSERT INTO history_fts(history_fts, rowid, query, result) VALUES ('delete', old.id, old.query, old.result);
+        INSERT INTO history_fts(rowid, query, result) VALUES (new.id, new.query, new.result);
+    END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5(
+        result, content='', tokenize='porter unicode61'
+    )""",
+]
+
+POSTGRES_DDL = [
+    """ALTER TABLE history ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(query, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(result, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_history_search_vector ON history USING GIN (search_vector)",
+    "ALTER TABLE results ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE INDEX IF NOT EXISTS ix_results_search_vector ON results USING GIN (search_vector)",
+]
+
+# Query-side handle on the SQLite FTS5 table (not part of Base.metadata)
+history_fts = Table(
+    "history_fts", MetaData(),
+    Column("rowid", Integer),
+    Column("query", String),
+    Column("result", String),
+    Column("rank"),
+)
+results_fts = Table(
+    "results_fts", MetaData(),
+    Column("rowid", Integer),
+    Column("result", String),
+    Column("rank"),
+)
+search_vector = literal_column("history.search_vector")
+results_vector = literal_column("results.search_vector")
+
+
+def install(conn, rebuild: bool = True):
+    """Create the index structures for conn's dialect; rebuild re-indexes existing SQLite rows."""
+    if conn.dialect.name == "sqlite":
+        for statement in SQLITE_DDL:
+            conn.execute(text(statement))
+        if rebuild:
+            conn.execute(text("INSERT INTO history_fts(history_fts) VALUES ('rebuild')"))
+    elif conn.dialect.name == "postgresql":
+        for statement in POSTGRES_DDL:
+            conn.execute(text(statement))
+
+
+def _fts5_query(keyword: str) -> str:
+    # Quote every term so user input can't hit FTS5 query syntax; terms are ANDed
+    terms = keyword.split()
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _sqlite_match(keyword: str, table: str = "history_fts"):
+    return text(f"{table} MATCH :{table}_query").bindparams(**{f"{table}_query": _fts5_query(keyword)})
+
+
+def _stored_matches(keyword: str):
+    if DIALECT == "postgresql":
+        hashes = select(StoredResult.hash).where(results_vector.op("@@")(func.websearch_to_tsquery("english", keyword)))
+    else:
+        ids = select(results_fts.c.rowid).where(_sqlite_match(keyword, "results_fts"))
+        hashes = select(StoredResult.hash).where(StoredResult.id.in_(ids))
+    return History.result_hash.in_(hashes)
+
+
+def matches(keyword: str):
+    """WHERE clause selecting History rows whose query or result match ``keyword``."""
+    if DIALECT == "postgresql":
+        return or_(search_vector.op("@@")(func.websearch_to_tsquery("english", keyword)), _stored_matches(keyword))
+    if DIALECT == "sqlite":
+        return or_(
+            History.id.in_(select(history_fts.c.rowid).where(_sqlite_match(keyword))),
+            _stored_matches(keyword),
+        )
+    return or_(History.query.contains(keyword), History.result.contains(keyword))
+
+
+def ranked(query, keyword: str):
+    """Restrict a History select to matches of ``keyword``, best match first."""
+    if DIALECT == "postgresql":
+        tsquery = func.websearch_to_tsquery("english", keyword)
+        vector = search_vector.op("||")(func.coalesce(results_vector, text("''::tsvector")))
+        return query.outerjoin(StoredResult, StoredResult.hash == History.result_hash).where(
+            or_(search_vector.op("@@")(tsquery), results_vector.op("@@")(tsquery))
+        ).order_by(func.ts_rank_cd(vector, tsquery).desc(), History.id.desc())
+    if DIALECT == "sqlite":
+        # FTS5 rank is bm25, where lower is better; a row matched by both indexes adds up both
+        history_rank = select(history_fts.c.rank).where(
+            history_fts.c.rowid == History.id, _sqlite_match(keyword)
+        ).scalar_subquery()
+        result_rank = select(results_fts.c.rank).where(
+            results_fts.c.rowid == StoredResult.id, _sqlite_match(keyword, "results_fts")
+        ).scalar_subquery()
+        return query.outerjoin(StoredResult, StoredResult.hash == History.result_hash).where(
+            matches(keyword)
+        ).order_by(func.coalesce(history_rank, 0) + func.coalesce(result_rank, 0), History.id.desc())
+    return query.where(matches(keyword)).order_by(History.created_at.desc(), History.id.desc())
+
+
+async def index_results(db, items: list[tuple[int, str]]):
+    """Index newly stored result bodies, given as (results.id, text)."""
+    if not items:
+        return
+    params = [{"id": id, "text": body} for id, body in items]
+    if DIALECT == "postgresql":
+        await db.execute(text(
+            "UPDATE results SET search_vector = setweight(to_tsvector('english', :text), 'B') WHERE id = :id"
+        ), params)
+    elif DIALECT == "sqlite":
+        await db.execute(text("INSERT INTO results_fts(rowid, result) VALUES (:id, :text)"), params)
+
+
+async def unindex_results(db, items: list[tuple[int, str]]):
+    """Remove result bodies about to be deleted; SQLite's contentless index needs the original text."""
+    if items and DIALECT == "sqlite":
+        await db.execute(text(
+            "INSERT INTO results_fts(results_fts, rowid, result) VALUES ('delete', :id, :text)"
+        ), [{"id": id, "text": body} for id, body in items])
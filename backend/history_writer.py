@@ -0,0 +1,211 @@
+"""
+History writes, optionally buffered (write-behind).
+
+With HISTORY_WRITE_BEHIND off, record() inserts and commits right away as
+the handlers always did. With it on, record() only queues the rows; a
+background task bulk-inserts the queue every HISTORY_FLUSH_INTERVAL seconds
+or as soon as HISTORY_FLUSH_SIZE rows are waiting, and stop() flushes what
+is left on shutdown.
+
+Readers call sync_user() first: if that user has buffered rows, they are
+flushed before the read, so a user always sees their own history. The
+buffer is per process; other workers see the rows within one interval.
+
+The buffer holds at most HISTORY_MAX_PENDING rows; when it is full, record()
+writes directly, so callers slow down instead of memory growing. A batch the
+database rejects for its data (integrity or data errors, e.g. a deleted
+user) is split in halves until the bad rows are isolated; those are appended
+to HISTORY_DEAD_LETTER_FILE and the rest are saved. Other failures keep the
+batch for the next tick, up to HISTORY_FLUSH_RETRIES times in a row; then
+it is dead-lettered as well.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session
+from models import History
+from settings import load_env
+import result_store
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "10000"))
+HISTORY_FLUSH_RETRIES = int(os.getenv("HISTORY_FLUSH_RETRIES", "5"))
+HISTORY_DEAD_LETTER_FILE = os.getenv("HISTORY_DEAD_LETTER_FILE", "history_dead_letter.ndjson")
+
+# Errors caused by the rows themselves; retrying the same rows cannot succeed
+REJECTED = (IntegrityError, DataError)
+
+
+class HistoryWriter:
+    def __init__(self, write_behind: bool, flush_size: int, flush_interval: float,
+                 max_pending: int = HISTORY_MAX_PENDING, flush_retries: int = HISTORY_FLUSH_RETRIES,
+                 dead_letter_file: str = HISTORY_DEAD_LETTER_FILE):
+        self.write_behind = write_behind
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flush_retries = flush_retries
+        self.dead_letter_file = dead_letter_file
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.direct_writes = 0
+        self.dead_letters = 0
+        self._failed_in_a_row = 0
+        self._pending: list[dict] = []
+        self._dirty_users: set[int] = set()  # users with rows not yet committed
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    async def record(self, rows: list[dict], db: AsyncSession | None = None):
+        """Save History rows (dicts of column values), now or on the next flush."""
+        now = datetime.utcnow()
+        rows = [{"created_at": now, **row} for row in rows]
+        if self._task is None:
+            await self._insert(rows, db)
+            return
+        if len(self._pending) + len(rows) > self.max_pending:
+            # Full: the caller waits for its own write rather than growing the buffer
+            self.direct_writes += len(rows)
+            await self._insert(rows, db)
+            return
+        self._pending.extend(rows)
+        self._dirty_users.update(row["user_id"] for row in rows)
+        if len(self._pending) >= self.flush_size:
+            self._wake.set()
+
+    async def sync_user(self, user_id: int):
+        """Flush buffered rows before reading ``user_id``'s history."""
+        if user_id in self._dirty_users:
+            await self.flush()
+
+    async def flush(self):
+        # Shielded so a cancelled caller (say, a disconnected client in sync_user)
+        # can neither abort the INSERT half-way nor drop the rows it took
+        await asyncio.shield(self._flush())
+
+    async def _flush(self):
+        # The lock also makes sync_user wait for a flush already in progress
+        async with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            saved, rejected = [], []
+            try:
+                await self._insert_or_isolate(rows, saved, rejected)
+            except Exception as e:
+                self.failed_flushes += 1
+                self._failed_in_a_row += 1
+                done = {id(row) for row in saved} | {id(row) for row, _ in rejected}
+                unsaved = [row for row in rows if id(row) not in done]
+                if self._failed_in_a_row > self.flush_retries:
+                    logger.exception(f"Flushing {len(unsaved)} history rows failed {self._failed_in_a_row} times")
+                    rejected.extend((row, e) for row in unsaved)
+                    self._failed_in_a_row = 0
+                else:
+                    # Keep the rows and retry on the next tick
+                    logger.exception(f"Flushing {len(unsaved)} history rows failed")
+                    self._pending[:0] = unsaved
+            else:
+                self._failed_in_a_row = 0
+                self.flushes += 1
+            self.flushed_rows += len(saved)
+            self._dead_letter(rejected)
+            self._dirty_users = {row["user_id"] for row in self._pending}
+
+    async def _insert_or_isolate(self, rows: list[dict], saved: list[dict], rejected: list[tuple[dict, Exception]]):
+        """Insert ``rows`` into saved; split a batch rejected for its data until the bad rows are found
+        (into rejected). Other errors propagate, with the rows inserted so far already committed."""
+        try:
+            await self._insert(rows)
+        except REJECTED as e:
+            if len(rows) == 1:
+                rejected.append((rows[0], e))
+                return
+            middle = len(rows) // 2
+            await self._insert_or_isolate(rows[:middle], saved, rejected)
+            await self._insert_or_isolate(rows[middle:], saved, rejected)
+            return
+        saved.extend(rows)
+
+    def _dead_letter(self, rejected: list[tuple[dict, Exception | str]]):
+        if not rejected:
+            return
+        self.dead_letters += len(rejected)
+        logger.error(f"Dead-lettering {len(rejected)} history rows to {self.dead_letter_file}: {rejected[0][1]}")
+        try:
+            with open(self.dead_letter_file, "a") as f:
+                for row, error in rejected:
+                    f.write(json.dumps({"row": row, "error": str(error)}, default=str) + "\n")
+        except OSError:
+            logger.exception(f"Writing dead-lettered history rows failed: {rejected}")
+
+    async def _insert(self, rows: list[dict], db: AsyncSession | None = None):
+        if db is None:
+            async with async_session() as session:
+                await self._insert(rows, session)
+            return
+        # Large results go to the result store; on failure the caller still holds the original rows
+        await db.execute(insert(History), await result_store.store(db, rows))
+        await db.commit()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self):
+        if self.write_behind and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"History write-behind enabled (flush every {self.flush_interval}s or {self.flush_size} rows)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Let the loop finish its current flush rather than cancelling it mid-INSERT
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"{len(self._pending)} buffered history rows could not be saved on shutdown")
+            rows, self._pending = self._pending, []
+            self._dead_letter([(row, "not saved before shutdown") for row in rows])
+
+    def stats(self) -> dict:
+        return {
+            "write_behind": self._task is not None,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "direct_writes": self.direct_writes,
+            "dead_letters": self.dead_letters,
+        }
+
+
+history_writer = HistoryWriter(HISTORY_WRITE_BEHIND, HISTORY_FLUSH_SIZE, HISTORY_FLUSH_INTERVAL)
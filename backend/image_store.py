@@ -0,0 +1,279 @@
+"""
+Content-addressed on-disk store for generated images.
+
+Image URLs returned by Flux are downloaded in the background and kept under
+IMAGE_STORE_DIR:
+    objects/ab/<sha256>       the image bytes, named by their SHA-256
+    thumbs/ab/<sha256>.jpg    JPEG thumbnail, longest side IMAGE_THUMBNAIL_SIZE
+    refs/ab/<sha256 of URL>   JSON {"url", "digest"}: which object a URL was saved as
+
+Objects never change, so they are served with immutable cache headers (see
+routers/images.py). Serving touches a file's mtime; once the store grows past
+IMAGE_STORE_MAX_BYTES the least recently used files are deleted. A URL whose
+object was evicted simply reads as not stored.
+
+Only the generate path schedules downloads, and only from hosts listed in
+IMAGE_STORE_ALLOWED_HOSTS: a History.result can be edited to any URL, so
+reads (resolve_many) never fetch. The shared HTTP client does not follow
+redirects, so an allowed host cannot bounce a fetch elsewhere.
+
+Thumbnails need Pillow; without it only originals are stored.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from urllib.parse import urlsplit
+
+from http_client import get_client
+from settings import load_env
+
+try:
+    from PIL import Image
+except ImportError:  # optional: thumbnails are skipped
+    Image = None
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "image_store")  # empty disables the store
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(1024 ** 3)))
+IMAGE_STORE_MAX_IMAGE_BYTES = int(os.getenv("IMAGE_STORE_MAX_IMAGE_BYTES", str(20 * 1024 ** 2)))
+IMAGE_STORE_DOWNLOADS = int(os.getenv("IMAGE_STORE_DOWNLOADS", "4"))
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+# Comma-separated hosts Flux image URLs may be downloaded from (the default Flux server's image host)
+IMAGE_STORE_ALLOWED_HOSTS = os.getenv("IMAGE_STORE_ALLOWED_HOSTS", "image.pollinations.ai")
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Leading bytes of the formats image generators return
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_media_type(head: bytes) -> str | None:
+    for signature, media_type in SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def parse_hosts(value: str) -> frozenset[str]:
+    return frozenset(host.strip().lower() for host in value.split(",") if host.strip())
+
+
+def _sharded(root: str, name: str, suffix: str = "") -> str:
+    return os.path.join(root, name[:2], name + suffix)
+
+
+class ImageStore:
+    def __init__(self, root: str, max_bytes: int, max_image_bytes: int, downloads: int, thumbnail_size: int,
+                 allowed_hosts: frozenset[str] = frozenset()):
+        self.root = root
+        self.allowed_hosts = allowed_hosts
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self.thumbnail_size = thumbnail_size
+        self.downloads = downloads
+        self.stored = 0
+        self.failed = 0
+        self.evicted = 0
+        self.rejected = 0
+        self._bytes = 0
+        self._size_lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._semaphore = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def object_path(self, digest: str) -> str:
+        return _sharded(os.path.join(self.root, "objects"), digest)
+
+    def thumbnail_path(self, digest: str) -> str:
+        return _sharded(os.path.join(self.root, "thumbs"), digest, ".jpg")
+
+    def _ref_path(self, url: str) -> str:
+        return _sharded(os.path.join(self.root, "refs"), hashlib.sha256(url.encode()).hexdigest())
+
+    def _write(self, path: str, data: bytes) -> int:
+        # Write to a temp file and rename, so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def _thumbnail(self, data: bytes) -> bytes | None:
+        if Image is None:
+            return None
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                out = io.BytesIO()
+                image.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+                return out.getvalue()
+        except Exception:
+            logger.exception("Creating thumbnail failed")
+            return None
+
+    def _save(self, url: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        added = 0
+        if not os.path.exists(self.object_path(digest)):
+            added += self._write(self.object_path(digest), data)
+        if not os.path.exists(self.thumbnail_path(digest)):
+            thumbnail = self._thumbnail(data)
+            if thumbnail is not None:
+                added += self._write(self.thumbnail_path(digest), thumbnail)
+        self._write(self._ref_path(url), json.dumps({"url": url, "digest": digest}).encode())
+        with self._size_lock:
+            self._bytes += added
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _files(self):
+        for kind in ("objects", "thumbs"):
+            for dirpath, _, names in os.walk(os.path.join(self.root, kind)):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        # Drop least recently served files until 90% of the budget is left
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.evicted += 1
+        with self._size_lock:
+            self._bytes = total
+        logger.info(f"Image store evicted down to {total} bytes")
+
+    def _resolve(self, url: str) -> str | None:
+        try:
+            with open(self._ref_path(url), "rb") as f:
+                digest = json.load(f)["digest"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        return digest if os.path.exists(self.object_path(digest)) else None
+
+    async def resolve_many(self, urls: list[str]) -> dict[str, str]:
+        """Map each stored URL to its digest; URLs not in the store are left out (nothing is fetched)."""
+        if not self.enabled or not urls:
+            return {}
+        digests = await asyncio.to_thread(lambda: {url: self._resolve(url) for url in set(urls)})
+        return {url: digest for url, digest in digests.items() if digest}
+
+    def allowed(self, url: str) -> bool:
+        try:
+            parsed = urlsplit(url)
+        except ValueError:
+            return False
+        return parsed.scheme in ("http", "https") and (parsed.hostname or "") in self.allowed_hosts
+
+    def schedule(self, url: str):
+        """Download a Flux image URL into the store in the background (no-op if already in progress)."""
+        if not self.enabled or self._semaphore is None or url in self._inflight:
+            return
+        if not self.allowed(url):
+            self.rejected += 1
+            logger.warning(f"Not storing image {url}: host not in IMAGE_STORE_ALLOWED_HOSTS")
+            return
+        task = asyncio.create_task(self._fetch(url))
+        self._inflight[url] = task
+        task.add_done_callback(lambda t: self._inflight.pop(url, None))
+
+    async def _fetch(self, url: str):
+        async with self._semaphore:
+            try:
+                if await asyncio.to_thread(self._resolve, url):
+                    return
+                chunks = []
+                size = 0
+                async with get_client().stream("GET", url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > self.max_image_bytes:
+                            raise ValueError(f"image larger than {self.max_image_bytes} bytes")
+                        chunks.append(chunk)
+                data = b"".join(chunks)
+                if sniff_media_type(data[:16]) is None:
+                    raise ValueError("response is not a PNG, JPEG, GIF or WebP image")
+                await asyncio.to_thread(self._save, url, data)
+                self.stored += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Storing image {url} failed: {e}")
+
+    def touch(self, path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    async def start(self):
+        if not self.enabled:
+            logger.info("IMAGE_STORE_DIR is empty; image store disabled")
+            return
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self._bytes = await asyncio.to_thread(lambda: sum(size for _, size, _ in self._files()))
+        self._semaphore = asyncio.Semaphore(self.downloads)
+        logger.info(f"Image store at {self.root} holds {self._bytes} bytes")
+
+    async def close(self):
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._semaphore = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "downloading": len(self._inflight),
+            "stored": self.stored,
+            "failed": self.failed,
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "allowed_hosts": sorted(self.allowed_hosts),
+            "thumbnails": Image is not None,
+        }
+
+
+image_store = ImageStore(
+    IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_MAX_IMAGE_BYTES, IMAGE_STORE_DOWNLOADS, IMAGE_THUMBNAIL_SIZE,
+    parse_hosts(IMAGE_STORE_ALLOWED_HOSTS),
+)
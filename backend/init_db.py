@@ -1,5 +1,12 @@
 from database import Base, engine
 from models import User, History
+import fulltext
+import partitions
+import rollups
 
 Base.metadata.create_all(bind=engine)
+with engine.begin() as conn:
+    partitions.install(conn)
+    fulltext.install(conn)
+    rollups.install(conn)
 print("Database initialized")
\ No newline at end of file
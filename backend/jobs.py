@@ -0,0 +1,387 @@
+"""
+Background job queue with priorities, cancellation and a depth limit.
+
+Submitting returns a Job immediately; a fixed pool of worker tasks takes jobs
+highest priority first (FIFO within a priority) and runs them through the
+queue's runner coroutine. Every state change wakes the job's subscribers, so
+callers can poll ``describe()`` or follow ``watch()`` as a stream of states.
+
+A job runs in the worker process that accepted it, but every state change is
+also written to the jobs table, so a status, events or cancel request that
+lands on another worker still finds it: ``get()`` returns a snapshot read
+from the table, ``watch()`` polls it, and ``cancel()`` sets cancel_requested,
+which the owner applies on its next sync. The sync, every poll_interval
+seconds, also refreshes the owner's heartbeat on its unfinished jobs, fails
+other workers' jobs whose heartbeat is older than ``lease`` (their worker
+stopped), and deletes jobs finished more than ``result_ttl`` seconds ago.
+
+The depth limit and stats() are per worker process.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select, update
+
+from database import async_session
+from models import JobRecord
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "30"))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+FINISHED = ("succeeded", "failed", "cancelled")
+UNFINISHED = ("queued", "running")
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    user_id: int
+    prompt: str
+    priority: str
+    seq: int
+    owner: str
+    status: str = "queued"  # queued, running, succeeded, failed, cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    position: Optional[int] = None  # only on snapshots of another worker's job
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def _update(self, **changes):
+        for name, value in changes.items():
+            setattr(self, name, value)
+        # Wake everyone waiting on the old event and hand out a fresh one
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class JobQueue:
+    def __init__(self, name: str, runner, workers: int, max_depth: int, result_ttl: float,
+                 poll_interval: float = JOB_POLL_INTERVAL, lease: float = JOB_LEASE):
+        self.name = name
+        self.runner = runner
+        self.workers = workers
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.completed = {status: 0 for status in FINISHED}
+        self.rejected = 0
+        self.save_errors = 0
+        self._jobs: dict[str, Job] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers: list[asyncio.Task] = []
+        self._sync_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def depth(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    def _is_local(self, job: Job) -> bool:
+        return self._jobs.get(job.id) is job
+
+    async def submit(self, user_id: int, prompt: str, priority: str = "normal") -> Job:
+        """Queue a job and return it at once; raises QueueFull past max_depth queued jobs."""
+        self._expire()
+        if self.depth() >= self.max_depth:
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full")
+        job = Job(id=uuid.uuid4().hex, user_id=user_id, prompt=prompt, priority=priority,
+                  seq=next(self._seq), owner=self.owner)
+        self._jobs[job.id] = job
+        await self._write(insert(JobRecord).values(
+            id=job.id, queue=self.name, owner=self.owner, user_id=user_id, prompt=prompt, priority=priority,
+            seq=job.seq, status=job.status, created_at=job.created_at, heartbeat_at=job.created_at,
+        ))
+        self._queue.put_nowait((PRIORITIES[priority], job.seq, job.id))
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """This worker's job, or a snapshot of another worker's from the jobs table."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return await self._load(job_id)
+        except Exception:
+            logger.exception(f"Loading {self.name} job {job_id} failed")
+            return None
+
+    async def cancel(self, job: Job) -> bool:
+        """Cancel a queued or running job; False if it had already finished.
+
+        Another worker's job is cancelled by its owner within poll_interval seconds.
+        """
+        if not self._is_local(job):
+            done = await self._write(
+                update(JobRecord)
+                .where(JobRecord.id == job.id, JobRecord.status.in_(UNFINISHED))
+                .values(cancel_requested=True)
+            )
+            if done:
+                return True
+            fresh = await self.get(job.id)
+            job.status = fresh.status if fresh is not None else job.status
+            return False
+        if job.finished:
+            return False
+        if job.status == "queued":
+            # The worker skips it when its queue entry comes up
+            await self._finish(job, "cancelled")
+        elif job.task is not None:
+            job.task.cancel()
+        return True
+
+    def position(self, job: Job) -> Optional[int]:
+        if job.status != "queued":
+            return None
+        if not self._is_local(job):
+            return job.position
+        key = (PRIORITIES[job.priority], job.seq)
+        return 1 + sum(
+            1 for other in self._jobs.values()
+            if other.status == "queued" and (PRIORITIES[other.priority], other.seq) < key
+        )
+
+    def describe(self, job: Job) -> dict:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "priority": job.priority,
+            "position": self.position(job),
+            "prompt": job.prompt,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+    async def watch(self, job: Job, keepalive: float):
+        """Yield job descriptions as they change until the job finishes; None on idle ``keepalive``."""
+        if not self._is_local(job):
+            async for state in self._watch_remote(job, keepalive):
+                yield state
+            return
+        last = None
+        while True:
+            changed = job.changed
+            state = self.describe(job)
+            if state != last:
+                yield state
+                last = state
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    async def _watch_remote(self, job: Job, keepalive: float):
+        last, idle = None, 0.0
+        while job is not None:
+            state = self.describe(job)
+            if state != last:
+                yield state
+                last, idle = state, 0.0
+            if job.finished:
+                return
+            await asyncio.sleep(self.poll_interval)
+            idle += self.poll_interval
+            if idle >= keepalive:
+                yield None
+                idle = 0.0
+            # None once the row has expired
+            job = await self.get(job.id)
+
+    async def _load(self, job_id: str) -> Optional[Job]:
+        async with async_session() as db:
+            record = await db.get(JobRecord, job_id)
+            if record is None or record.queue != self.name:
+                return None
+            if record.finished_at is not None and record.finished_at < time.time() - self.result_ttl:
+                return None
+            position = None
+            if record.status == "queued":
+                rank, key = case(PRIORITIES, value=JobRecord.priority), PRIORITIES[record.priority]
+                position = 1 + await db.scalar(select(func.count()).select_from(JobRecord).where(
+                    JobRecord.queue == self.name,
+                    JobRecord.owner == record.owner,
+                    JobRecord.status == "queued",
+                    or_(rank < key, and_(rank == key, JobRecord.seq < record.seq)),
+                ))
+        return Job(
+            id=record.id, user_id=record.user_id, prompt=record.prompt, priority=record.priority,
+            seq=record.seq, owner=record.owner, status=record.status, created_at=record.created_at,
+            started_at=record.started_at, finished_at=record.finished_at, result=record.result,
+            error=record.error, position=position,
+        )
+
+    async def _write(self, statement) -> int:
+        """Run one statement against the jobs table; the row count, or 0 when it failed.
+
+        A failure is logged rather than raised: the job still runs here, other
+        workers just see it late (or not at all).
+        """
+        try:
+            async with async_session() as db:
+                result = await db.execute(statement)
+                await db.commit()
+            return result.rowcount
+        except Exception:
+            self.save_errors += 1
+            logger.exception(f"Saving {self.name} job state failed")
+            return 0
+
+    async def _save(self, job: Job):
+        await self._write(
+            update(JobRecord).where(JobRecord.id == job.id).values(
+                status=job.status, started_at=job.started_at, finished_at=job.finished_at,
+                result=job.result, error=job.error, heartbeat_at=time.time(),
+            )
+        )
+
+    async def _finish(self, job: Job, status: str, **changes):
+        job._update(status=status, finished_at=time.time(), **changes)
+        self.completed[status] += 1
+        await self._save(job)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job.id for job in self._jobs.values() if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: Job):
+        job._update(status="running", started_at=time.time())
+        # Created before saving, so a cancel that arrives meanwhile has a task to cancel
+        job.task = asyncio.create_task(self.runner(job))
+        try:
+            await self._save(job)
+            result = await job.task
+        except asyncio.CancelledError:
+            job.task.cancel()
+            await self._finish(job, "cancelled")
+            if self._closing:
+                raise
+        except Exception as e:
+            logger.warning(f"{self.name} job {job.id} failed: {e}")
+            await self._finish(job, "failed", error=str(getattr(e, "detail", e)))
+        else:
+            await self._finish(job, "succeeded", result=result)
+        finally:
+            job.task = None
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                await self._run(job)
+
+    async def sync(self):
+        """Heartbeat this worker's jobs, apply cancel requests, fail orphaned jobs and delete expired ones."""
+        now = time.time()
+        await self._write(
+            update(JobRecord)
+            .where(JobRecord.owner == self.owner, JobRecord.status.in_(UNFINISHED))
+            .values(heartbeat_at=now)
+        )
+        try:
+            async with async_session() as db:
+                requested = (await db.scalars(select(JobRecord.id).where(
+                    JobRecord.owner == self.owner,
+                    JobRecord.cancel_requested.is_(True),
+                    JobRecord.status.in_(UNFINISHED),
+                ))).all()
+        except Exception:
+            logger.exception(f"Reading {self.name} job cancel requests failed")
+            requested = []
+        for job_id in requested:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                await self.cancel(job)
+        orphaned = await self._write(
+            update(JobRecord)
+            .where(
+                JobRecord.queue == self.name,
+                JobRecord.owner != self.owner,
+                JobRecord.status.in_(UNFINISHED),
+                JobRecord.heartbeat_at < now - self.lease,
+            )
+            .values(status="failed", error="The worker running this job stopped", finished_at=now)
+        )
+        if orphaned:
+            logger.warning(f"Failed {orphaned} {self.name} jobs left behind by a stopped worker")
+        await self._write(
+            delete(JobRecord).where(JobRecord.queue == self.name, JobRecord.finished_at < now - self.result_ttl)
+        )
+        self._expire()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception(f"{self.name} job sync failed")
+
+    async def start(self):
+        self._closing = False
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sync_task = asyncio.create_task(self._sync_loop())
+        logger.info(f"{self.name} job queue started with {self.workers} workers")
+
+    async def close(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        # Cancelling a worker also cancels the job it is running
+        self._closing = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in list(self._jobs.values()):
+            await self.cancel(job)
+        logger.info(f"{self.name} job queue stopped")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.depth(),
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "max_depth": self.max_depth,
+            "rejected": self.rejected,
+            "save_errors": self.save_errors,
+            **self.completed,
+        }
@@ -1,13 +1,51 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-from routers import auth, search, image, dashboard, admin
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from routers import auth, search, image, images, dashboard, admin
+from conditional import JSONCompressionMiddleware
+import database
+import http_client
+import metrics
+from history_writer import history_writer
+from image_store import image_store
+from partitions import partition_maintainer
+from result_store import result_collector
+import mcp_pool
+import passwords
+import logging
 import os
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open long-lived upstream connections once per worker
+    await http_client.start_client()
+    if image.API_KEY:
+        await mcp_pool.start_pool(image.flux_url())
+    else:
+        logger.warning("FLUX_API_KEY not set; Flux MCP session pool not started")
+    await history_writer.start()
+    await image_store.start()
+    await image.image_jobs.start()
+    await partition_maintainer.start(database.get_engine)
+    await result_collector.start()
+    yield
+    await result_collector.close()
+    await partition_maintainer.close()
+    await image.image_jobs.close()
+    await image_store.close()
+    await history_writer.stop()
+    await mcp_pool.close_pool()
+    await http_client.close_client()
+    passwords.shutdown()
+
+# orjson serializes response bodies several times faster than the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# gzip/brotli for large JSON bodies; streams, images and exports pass through
+app.add_middleware(JSONCompressionMiddleware)
 
 # CORS for frontend
 app.add_middleware(
@@ -16,12 +54,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods, including OPTIONS
     allow_headers=["*"],  # Allow all headers, including Authorization
+    expose_headers=["X-Next-Cursor", "ETag"],  # Dashboard pagination cursor and list ETags
 )
 
+# Outermost, so timings include compression and CORS handling
+app.add_middleware(metrics.MetricsMiddleware)
+# Engines are created on first use; instrument each one as it is
+database.add_engine_hook(metrics.instrument_engine)
+
 # Include routers with proper prefixes
 app.include_router(auth.router, prefix="/auth")
 app.include_router(search.router, prefix="/search")
 app.include_router(image.router, prefix="/image")
+app.include_router(images.router, prefix="/images")
 app.include_router(dashboard.router, prefix="/dashboard")
 app.include_router(admin.router, prefix="/admin")
 
@@ -31,7 +76,7 @@ def root():
 
 # Token validation endpoint
 from fastapi.security import OAuth2PasswordBearer
-from dependencies import get_current_user  # Assume this is defined
+from dependencies import get_current_user, get_admin_user  # Assume this is defined
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -46,3 +91,8 @@ async def validate_token(current_user = Depends(get_current_user)):
             "role": current_user.role
         }
     }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(admin_user = Depends(get_admin_user)):
+    """Prometheus text exposition of this worker's metrics (admin only)"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,191 @@
+"""
+Pool of long-lived, initialized MCP client sessions.
+
+Opening a streamable HTTP transport, creating a ClientSession and running
+initialize()/list_tools() costs several round trips, so sessions are opened
+once and reused. Each session is kept open by its own background task (the
+MCP transport must be entered and exited from the same task).
+
+Sessions open on first use unless MCP_CONNECT_ON_STARTUP is set, so a cold
+worker serves other routes without waiting for the handshakes. The MCP SDK,
+slow to import, is likewise imported (off the event loop) by the first
+session to connect.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from functools import lru_cache
+
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))
+MCP_IDLE_TIMEOUT = float(os.getenv("MCP_IDLE_TIMEOUT", "300"))  # seconds before an idle session is re-checked
+MCP_PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT", "5"))
+MCP_CONNECT_ON_STARTUP = os.getenv("MCP_CONNECT_ON_STARTUP", "false").lower() == "true"
+MCP_CLOSE_TIMEOUT = 5.0
+
+
+@lru_cache(maxsize=None)
+def _sdk():
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    return ClientSession, streamablehttp_client
+
+
+class PooledSession:
+    """A single MCP connection with its cached tool list."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = None
+        self.tools = []
+        self.last_used = 0.0
+        self._task = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._error = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def connect(self):
+        self._ready.clear()
+        self._closing.clear()
+        self._error = None
+        self._task = asyncio.create_task(self._run(*await asyncio.to_thread(_sdk)))
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        self.last_used = time.monotonic()
+
+    async def _run(self, client_session, streamablehttp_client):
+        try:
+            async with streamablehttp_client(self.url) as (read_stream, write_stream, _):
+                async with client_session(read_stream, write_stream) as session:
+                    await session.initialize()
+                    tools_result = await session.list_tools()
+                    self.session = session
+                    self.tools = tools_result.tools
+                    logger.info(f"MCP session ready, tools: {[tool.name for tool in self.tools]}")
+                    self._ready.set()
+                    await self._closing.wait()
+        except Exception as e:
+            if not self._ready.is_set():
+                self._error = e
+            else:
+                logger.warning(f"MCP session terminated: {e}")
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(self._task, MCP_CLOSE_TIMEOUT)
+        except (asyncio.TimeoutError, Exception):
+            self._task.cancel()
+        self._task = None
+        self.session = None
+
+    async def ping(self) -> bool:
+        try:
+            await asyncio.wait_for(self.session.send_ping(), MCP_PING_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning(f"MCP session failed health check: {e}")
+            return False
+
+
+class MCPSessionPool:
+    """Fixed-size pool of PooledSession objects handed out one caller at a time."""
+
+    def __init__(self, url: str, size: int = MCP_POOL_SIZE, idle_timeout: float = MCP_IDLE_TIMEOUT):
+        self.url = url
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._sessions = [PooledSession(url) for _ in range(size)]
+        self._idle = asyncio.Queue()
+
+    @property
+    def tools(self):
+        for conn in self._sessions:
+            if conn.tools:
+                return conn.tools
+        return []
+
+    async def start(self, connect: bool = MCP_CONNECT_ON_STARTUP):
+        if connect:
+            results = await asyncio.gather(*(conn.connect() for conn in self._sessions), return_exceptions=True)
+            failed = [r for r in results if isinstance(r, BaseException)]
+            if failed:
+                # Broken sessions are reconnected on first use, so startup does not fail
+                logger.warning(f"{len(failed)} of {self.size} MCP sessions failed to connect: {failed[0]}")
+        for conn in self._sessions:
+            self._idle.put_nowait(conn)
+
+    async def close(self):
+        await asyncio.gather(*(conn.close() for conn in self._sessions), return_exceptions=True)
+
+    async def _ensure_healthy(self, conn: PooledSession):
+        if conn.alive and time.monotonic() - conn.last_used > self.idle_timeout:
+            if not await conn.ping():
+                await conn.close()
+        if not conn.alive:
+            logger.info("Reconnecting MCP session" if conn.last_used else "Opening MCP session")
+            await conn.close()
+            await conn.connect()
+
+    @asynccontextmanager
+    async def acquire(self, wait=nullcontext):
+        """Yield a healthy session; a session whose call fails is reconnected on next use.
+
+        ``wait()`` is entered around the wait for an idle session (see upstream.local_wait).
+        """
+        with wait():
+            conn = await self._idle.get()
+        try:
+            await self._ensure_healthy(conn)
+            yield conn
+        except BaseException:
+            await conn.close()
+            raise
+        finally:
+            conn.last_used = time.monotonic()
+            self._idle.put_nowait(conn)
+
+
+_pool: MCPSessionPool | None = None
+
+
+def get_pool() -> MCPSessionPool | None:
+    return _pool
+
+
+async def start_pool(url: str, size: int = MCP_POOL_SIZE, idle_timeout: float = MCP_IDLE_TIMEOUT,
+                     connect: bool = MCP_CONNECT_ON_STARTUP):
+    global _pool
+    _pool = MCPSessionPool(url, size=size, idle_timeout=idle_timeout)
+    await _pool.start(connect)
+    logger.info(f"MCP session pool started with {size} sessions ({'connected' if connect else 'opened on first use'})")
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logger.info("MCP session pool closed")
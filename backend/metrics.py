@@ -0,0 +1,262 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+MetricsMiddleware times every request by route template (so /dashboard/{id}
+is one series, not one per id) and tracks requests in flight; observe_upstream()
+times the Tavily and Flux calls; instrument_engine() records how long
+SQLAlchemy pool checkouts take and how many connections are checked out.
+render() produces the /metrics body.
+
+Values are per worker process: with several workers, each one reports its
+own series, as with any in-process Prometheus client.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from sqlalchemy import event
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; upstream calls and streamed responses can run well past 10s
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+POOL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self, key: tuple, value) -> list[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            le = 'le="%s"' % _number(bound)
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+        inf = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_labels(self.label_names, key, inf)} {count}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+_collectors = []  # callables run before each render to refresh sampled gauges
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency, until the body is sent", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled", ("method", "route"))
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "Upstream API call latency", ("upstream", "outcome"))
+UPSTREAM_IN_FLIGHT = Gauge("upstream_requests_in_flight", "Upstream API calls in progress", ("upstream",))
+DB_POOL_WAIT = Histogram("db_pool_checkout_seconds", "Time to check a connection out of the pool", ("engine",), POOL_BUCKETS)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out", ("engine",))
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured pool size (queue pools only)", ("engine",))
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond the pool size (queue pools only)", ("engine",))
+
+
+def render() -> str:
+    for collect in _collectors:
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def observe_upstream(upstream: str, excluded=None):
+    """Time one upstream call; an exception counts it as outcome="error".
+
+    ``excluded``, if given, returns seconds to leave out (local waits, see upstream.local_wait).
+    """
+    UPSTREAM_IN_FLIGHT.inc(upstream=upstream)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start - (excluded() if excluded else 0.0)
+        UPSTREAM_DURATION.observe(elapsed, upstream=upstream, outcome=outcome)
+        UPSTREAM_IN_FLIGHT.dec(upstream=upstream)
+
+
+_timed_pools: dict[tuple, type] = {}
+
+
+def _timed_pool_class(pool_class: type, name: str) -> type:
+    # Pool subclasses hand out connections through _do_get, which is where a
+    # checkout blocks on a full pool (or opens a new connection)
+    key = (pool_class, name)
+    if key not in _timed_pools:
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super(timed, self)._do_get()
+            finally:
+                DB_POOL_WAIT.observe(time.perf_counter() - start, engine=name)
+
+        timed = type(f"Timed{pool_class.__name__}", (pool_class,), {"_do_get": _do_get})
+        _timed_pools[key] = timed
+    return _timed_pools[key]
+
+
+def instrument_engine(engine, name: str):
+    """Record checkout time and occupancy for ``engine``'s pool (pass async_engine.sync_engine for async)."""
+    pool = engine.pool
+    if type(pool) in _timed_pools.values():
+        return
+    # Swapping the class keeps the pool's configuration, and pool.recreate()
+    # (engine.dispose) builds the replacement from the same class
+    pool.__class__ = _timed_pool_class(type(pool), name)
+
+    @event.listens_for(pool, "checkout")
+    def _checkout(dbapi_connection, record, proxy):
+        DB_POOL_CHECKED_OUT.inc(engine=name)
+
+    @event.listens_for(pool, "checkin")
+    def _checkin(dbapi_connection, record):
+        DB_POOL_CHECKED_OUT.dec(engine=name)
+
+    def collect():
+        current = engine.pool
+        if hasattr(current, "overflow"):
+            DB_POOL_SIZE.set(current.size(), engine=name)
+            DB_POOL_OVERFLOW.set(max(current.overflow(), 0), engine=name)
+
+    _collectors.append(collect)
+
+
+@lru_cache(maxsize=4096)
+def _route(app, method: str, path: str) -> str:
+    # Match the route template up front so in-flight requests are labelled too
+    # (a method mismatch is a partial match; keep looking for a full one)
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    partial = None
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route(scope.get("app"), method, scope["path"])
+        status = 500  # if the app raises before responding
+
+        async def send_recording(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method=method, route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_recording)
+        finally:
+            HTTP_DURATION.observe(time.perf_counter() - start, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            HTTP_IN_FLIGHT.dec(method=method, route=route)
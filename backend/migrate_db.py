@@ -1,11 +1,112 @@
 #!/usr/bin/env python3
 """
-Database migration script to update History table column name from 'timestamp' to 'created_at'
+Database migration script. Steps are idempotent and safe to re-run:
+- rename History 'timestamp' column to 'created_at'
+- add users.token_version for token revocation
+- add history.updated_at so edits change dashboard ETags
+- add composite (user_id, created_at) indexes on history for dashboard paging
+- partition history by month on PostgreSQL (see partitions.py)
+- install the full-text index over history (tsvector + GIN / FTS5 + triggers)
+- create the activity rollup tables with their history triggers and backfill them
+  (daily rollups from before sharding are rebuilt)
+- move large history results into the deduplicated, compressed results table
+- add results.referenced_at, so the result collector spares recently reused results
+- create the jobs table that shares background job state between workers
 """
 
+import asyncio
 import os
 from sqlalchemy import create_engine, text
 from database import DATABASE_URL
+from models import JobRecord, StoredResult
+import fulltext
+import partitions
+import result_store
+import rollups
+
+def get_column_names(conn, table):
+    if DATABASE_URL.startswith("postgresql://"):
+        result = conn.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = :table"
+        ), {"table": table})
+        return [row[0] for row in result.fetchall()]
+    result = conn.execute(text(f"PRAGMA table_info({table})"))
+    return [row[1] for row in result.fetchall()]
+
+def add_token_version_column(conn):
+    column_names = get_column_names(conn, "users")
+    if not column_names:
+        print("Users table not found - it will be created with the correct schema.")
+    elif "token_version" in column_names:
+        print("Users table already has 'token_version' column.")
+    else:
+        print("Adding 'token_version' column to users...")
+        conn.execute(text("ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"))
+        conn.commit()
+        print("Added 'token_version' column.")
+
+def add_updated_at_column(conn):
+    column_names = get_column_names(conn, "history")
+    if not column_names:
+        print("History table not found - it will be created with the correct schema.")
+    elif "updated_at" in column_names:
+        print("History table already has 'updated_at' column.")
+    else:
+        print("Adding 'updated_at' column to history...")
+        conn.execute(text("ALTER TABLE history ADD COLUMN updated_at TIMESTAMP"))
+        conn.commit()
+        print("Added 'updated_at' column.")
+
+def add_result_hash_column(conn):
+    StoredResult.__table__.create(conn, checkfirst=True)
+    conn.commit()
+    column_names = get_column_names(conn, "history")
+    if not column_names:
+        print("History table not found - it will be created with the correct schema.")
+    elif "result_hash" in column_names:
+        print("History table already has 'result_hash' column.")
+    else:
+        print("Adding 'result_hash' column to history...")
+        conn.execute(text("ALTER TABLE history ADD COLUMN result_hash VARCHAR REFERENCES results (hash)"))
+        conn.commit()
+        print("Added 'result_hash' column.")
+
+def add_referenced_at_column(conn):
+    column_names = get_column_names(conn, "results")
+    if not column_names:
+        print("Results table not found - it will be created with the correct schema.")
+    elif "referenced_at" in column_names:
+        print("Results table already has 'referenced_at' column.")
+    else:
+        print("Adding 'referenced_at' column to results...")
+        conn.execute(text("ALTER TABLE results ADD COLUMN referenced_at TIMESTAMP"))
+        conn.execute(text("UPDATE results SET referenced_at = created_at"))
+        conn.commit()
+        print("Added 'referenced_at' column.")
+
+def add_rollup_shards(conn):
+    column_names = get_column_names(conn, "daily_activity_rollups")
+    if column_names and "shard" not in column_names:
+        # Rebuilt with the shard in its primary key by the backfill that follows
+        print("Dropping unsharded daily_activity_rollups...")
+        conn.execute(text("DROP TABLE daily_activity_rollups"))
+
+HISTORY_INDEXES = {
+    "ix_history_user_created": "history (user_id, created_at)",
+    "ix_history_user_type_created": "history (user_id, type, created_at)",
+    "ix_history_created": "history (created_at)",
+    "ix_history_result_hash": "history (result_hash)",
+}
+
+def add_history_indexes(engine):
+    # CONCURRENTLY avoids locking a large history table against writes on PostgreSQL,
+    # but cannot run inside a transaction, nor on a partitioned table
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        concurrently = "CONCURRENTLY " if DATABASE_URL.startswith("postgresql://") and not partitions.is_partitioned(conn) else ""
+        for name, columns in HISTORY_INDEXES.items():
+            print(f"Ensuring index {name} on {columns}...")
+            conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {columns}"))
+    print("History indexes are in place.")
 
 def migrate_database():
     print(f"Connecting to database: {DATABASE_URL}")
@@ -56,5 +157,76 @@ def migrate_database():
             print("This might be expected if the table doesn't exist yet.")
             print("The correct schema will be created when you first run the application.")
 
+        try:
+            add_token_version_column(conn)
+        except Exception as e:
+            conn.rollback()
+            print(f"Adding token_version failed: {e}")
+
+        try:
+            add_updated_at_column(conn)
+        except Exception as e:
+            conn.rollback()
+            print(f"Adding updated_at failed: {e}")
+
+        try:
+            add_result_hash_column(conn)
+        except Exception as e:
+            conn.rollback()
+            print(f"Adding result_hash failed: {e}")
+
+        try:
+            add_referenced_at_column(conn)
+        except Exception as e:
+            conn.rollback()
+            print(f"Adding referenced_at failed: {e}")
+
+    try:
+        add_history_indexes(engine)
+    except Exception as e:
+        print(f"Creating history indexes failed: {e}")
+
+    try:
+        # Copies history into the new table under an exclusive lock, once
+        print("Partitioning history by month...")
+        with engine.begin() as conn:
+            partitions.install(conn)
+            print(f"{partitions.ensure_partitions(conn)} upcoming partitions in place.")
+    except Exception as e:
+        print(f"Partitioning history failed: {e}")
+
+    try:
+        # On PostgreSQL adding the generated column rewrites the table once
+        print("Installing full-text search index on history...")
+        with engine.begin() as conn:
+            fulltext.install(conn)
+        print("Full-text search index is in place.")
+    except Exception as e:
+        print(f"Installing full-text search failed: {e}")
+
+    try:
+        print("Installing activity rollups and backfilling from history...")
+        with engine.begin() as conn:
+            add_rollup_shards(conn)
+            rollups.install(conn)
+            rollups.backfill(conn)
+        print("Activity rollups are in place.")
+    except Exception as e:
+        print(f"Installing activity rollups failed: {e}")
+
+    try:
+        print("Creating the background jobs table...")
+        with engine.begin() as conn:
+            JobRecord.__table__.create(conn, checkfirst=True)
+    except Exception as e:
+        print(f"Creating the jobs table failed: {e}")
+
+    try:
+        # Batches commit as they go, so an interrupted run resumes where it stopped
+        print("Moving large history results into the result store...")
+        asyncio.run(result_store.run("migrate"))
+    except Exception as e:
+        print(f"Moving history results failed: {e}")
+
 if __name__ == "__main__":
     migrate_database()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, Date, DateTime, Float, ForeignKey, Index, LargeBinary
 from database import Base
 from datetime import datetime
 
@@ -8,6 +8,7 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     role = Column(String, default="user")  # user or admin
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")  # bump to revoke issued tokens
 
 class History(Base):
     __tablename__ = "history"
@@ -15,6 +16,68 @@ class History(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     type = Column(String)  # 'search' or 'image'
     query = Column(String)
-    result = Column(String)  # JSON string for search summary or image URL
+    result = Column(String)  # JSON string for search summary or image URL; NULL when stored in results
+    result_hash = Column(String, ForeignKey("results.hash"), nullable=True)  # see result_store.py
     created_at = Column(DateTime, default=datetime.utcnow)
-    meta_data = Column(String, nullable=True)  # Renamed from metadata
\ No newline at end of file
+    updated_at = Column(DateTime, nullable=True, onupdate=datetime.utcnow)  # last edit; feeds dashboard ETags
+    meta_data = Column(String, nullable=True)  # Renamed from metadata
+
+    # On PostgreSQL the table is partitioned by month on created_at, with
+    # primary key (id, created_at); see partitions.py
+    __table_args__ = (
+        # Serve the dashboard's newest-first keyset pages per user (optionally per type)
+        Index("ix_history_user_created", "user_id", "created_at"),
+        Index("ix_history_user_type_created", "user_id", "type", "created_at"),
+        # Time ranges across all users (admin activity series, see activity.py)
+        Index("ix_history_created", "created_at"),
+        Index("ix_history_result_hash", "result_hash"),
+    )
+
+class StoredResult(Base):
+    """A History.result body stored once, compressed, keyed by its hash (see result_store.py)."""
+    __tablename__ = "results"
+    id = Column(Integer, primary_key=True)  # stable rowid for the SQLite full-text index
+    hash = Column(String, unique=True, nullable=False)  # sha256 of the UTF-8 text
+    codec = Column(String, nullable=False)  # zstd or zlib
+    body = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # uncompressed bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+    referenced_at = Column(DateTime, default=datetime.utcnow)  # last stored or reused; spared by the collector for a while
+
+class UserActivityRollup(Base):
+    """History counts per user and type, kept current by triggers (see rollups.py)."""
+    __tablename__ = "user_activity_rollups"
+    user_id = Column(Integer, primary_key=True)
+    type = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class DailyActivityRollup(Base):
+    """History counts per day and type, kept current by triggers (see rollups.py)."""
+    __tablename__ = "daily_activity_rollups"
+    day = Column(Date, primary_key=True)
+    type = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)  # history.id % rollups.DAILY_SHARDS; readers sum over shards
+    count = Column(Integer, nullable=False, default=0)
+
+class JobRecord(Base):
+    """Shared state of a background job, so any worker can report or cancel it (see jobs.py)."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    queue = Column(String, nullable=False)  # e.g. image
+    owner = Column(String, nullable=False)  # the worker process running the job
+    user_id = Column(Integer, nullable=False, index=True)  # no foreign key: rows expire on their own
+    prompt = Column(String, nullable=False)
+    priority = Column(String, nullable=False)
+    seq = Column(Integer, nullable=False)  # submission order within the owner's queue
+    status = Column(String, nullable=False)
+    cancel_requested = Column(Boolean, nullable=False, default=False)  # set by other workers
+    result = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(Float, nullable=False)  # epoch seconds, as the API reports them
+    started_at = Column(Float, nullable=True)
+    finished_at = Column(Float, nullable=True)
+    heartbeat_at = Column(Float, nullable=False)  # refreshed by the owner while unfinished
+
+    __table_args__ = (
+        Index("ix_jobs_queue_status", "queue", "status"),
+    )
@@ -0,0 +1,51 @@
+"""
+Keyset (cursor) pagination over History ordered newest first by (created_at, id).
+
+A page is fetched with ``WHERE (created_at, id) < (:last_created_at, :last_id)``
+instead of OFFSET, so page N costs the same as page 1 when the
+(user_id, created_at) index is present. Cursors are opaque to clients.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+from models import History
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(query, cursor: str | None, limit: int):
+    """Order a History select newest first, start after ``cursor`` and fetch one extra row."""
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        # The plain created_at bound keeps the predicate index-friendly on every backend
+        query = query.where(
+            History.created_at <= created_at,
+            tuple_(History.created_at, History.id) < tuple_(created_at, id),
+        )
+    return query.order_by(History.created_at.desc(), History.id.desc()).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> tuple[list, str | None]:
+    """Trim the extra row fetched by paginate() and build the next cursor from the last item."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
@@ -0,0 +1,358 @@
+"""
+Monthly partitioning of history on PostgreSQL, and archival of old months.
+
+history is range-partitioned on created_at into one table per calendar
+month (history_pYYYY_MM), plus history_default for rows outside every
+range. Queries with a created_at bound (dashboard date filters, export
+windows) only scan the matching months. The primary key becomes
+(id, created_at). The indexes, full-text column and rollup triggers are
+declared on the parent and cloned onto each partition.
+
+- install() turns a plain history table into a partitioned one in a single
+  transaction. It copies the rows into a new partitioned table and swaps it
+  in. The table is locked while rows are copied. It does nothing if history
+  is already partitioned, and is run by init_db.py and migrate_db.py before
+  the full-text and rollup installs.
+- ensure_partitions() creates partitions from the current month to
+  HISTORY_PARTITIONS_AHEAD months ahead.
+- archive() handles partitions that ended more than HISTORY_RETENTION_MONTHS
+  ago. It writes each one to HISTORY_ARCHIVE_DIR/history-YYYY-MM.ndjson.gz,
+  then drops it, with stored results written out as text. Archived rows
+  still count in the activity rollups.
+  list_archives() and read_archive() serve them to admins.
+
+PartitionMaintainer runs ensure_partitions() and archive() at startup and
+then every HISTORY_MAINTENANCE_INTERVAL seconds. An advisory lock makes
+sure only one worker does this. SQLite has no partitioning; there the
+maintainer does not run, and install() is a no-op.
+
+    python partitions.py install|ensure|archive|list
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.schema import AddConstraint
+
+from database import DIALECT
+from models import History
+from settings import load_env
+import result_store
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", "3"))
+HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "0"))  # 0 keeps every month
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive")
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "3600"))
+
+ARCHIVE_BATCH_ROWS = 5000
+LOCK_KEY = 0x68697374  # pg advisory lock held by the worker doing maintenance
+
+DEFAULT_PARTITION = "history_default"
+PARTITION_NAME = re.compile(r"^history_p(\d{4})_(\d{2})$")
+ARCHIVE_NAME = re.compile(r"^history-(\d{4}-\d{2})\.ndjson\.gz$")
+
+
+def _add_months(month: date, n: int) -> date:
+    years, index = divmod(month.month - 1 + n, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def _this_month() -> date:
+    return datetime.utcnow().date().replace(day=1)
+
+
+def partition_name(month: date) -> str:
+    return f"history_p{month:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('history')")) == "p"
+
+
+def partitions(conn) -> list[tuple[date, str]]:
+    """(month, table name) of every monthly partition, oldest first."""
+    names = conn.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('history')"
+    ))
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append((date(int(match[1]), int(match[2]), 1), name))
+    return sorted(months)
+
+
+def _create_partition(conn, month: date, parent: str = "history") -> bool:
+    name = partition_name(month)
+    try:
+        # A savepoint, so one conflicting month doesn't abort the caller's transaction
+        with conn.begin_nested():
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+            ))
+        return True
+    except Exception as e:
+        # Typically rows for that month already sit in history_default
+        logger.warning(f"Creating partition {name} failed: {e}")
+        return False
+
+
+def ensure_partitions(conn, ahead: int = HISTORY_PARTITIONS_AHEAD) -> int:
+    """Create the partitions from this month to ``ahead`` months out; returns how many exist."""
+    if not is_partitioned(conn):
+        return 0
+    month = _this_month()
+    return sum(_create_partition(conn, _add_months(month, n)) for n in range(ahead + 1))
+
+
+def _data_columns(conn) -> list[str]:
+    # Everything but generated columns (the full-text search_vector), which can't be inserted
+    return list(conn.scalars(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = 'history' AND table_schema = current_schema() AND is_generated = 'NEVER' "
+        "ORDER BY ordinal_position"
+    )))
+
+
+def install(conn):
+    """Convert a plain PostgreSQL history table into a monthly partitioned one (idempotent)."""
+    if conn.dialect.name != "postgresql" or is_partitioned(conn):
+        return
+    conn.execute(text("LOCK TABLE history IN ACCESS EXCLUSIVE MODE"))
+    columns = ", ".join(_data_columns(conn))
+    # Columns, defaults (the id sequence) and generated columns; keys and indexes are added after the copy
+    conn.execute(text(
+        "CREATE TABLE history_partitioned (LIKE history INCLUDING DEFAULTS INCLUDING GENERATED) "
+        "PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text("UPDATE history SET created_at = coalesce(updated_at, now() AT TIME ZONE 'utc') WHERE created_at IS NULL"))
+    conn.execute(text("ALTER TABLE history_partitioned ALTER COLUMN created_at SET NOT NULL"))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF history_partitioned DEFAULT"))
+
+    oldest = conn.scalar(text("SELECT min(created_at) FROM history"))
+    month = oldest.date().replace(day=1) if oldest else _this_month()
+    last = _add_months(_this_month(), HISTORY_PARTITIONS_AHEAD)
+    while month <= last:
+        _create_partition(conn, month, parent="history_partitioned")
+        month = _add_months(month, 1)
+
+    copied = conn.execute(text(
+        f"INSERT INTO history_partitioned ({columns}) SELECT {columns} FROM history"
+    )).rowcount
+    # Keep the id sequence when the old table (its owner) is dropped
+    conn.execute(text("ALTER SEQUENCE IF EXISTS history_id_seq OWNED BY history_partitioned.id"))
+    conn.execute(text("DROP TABLE history"))
+    conn.execute(text("ALTER TABLE history_partitioned RENAME TO history"))
+
+    # A unique key on a partitioned table has to include the partition column
+    conn.execute(text("ALTER TABLE history ADD CONSTRAINT history_pkey PRIMARY KEY (id, created_at)"))
+    for constraint in History.__table__.foreign_key_constraints:
+        conn.execute(AddConstraint(constraint))
+    for index in History.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    logger.info(f"Partitioned history by month ({copied} rows copied)")
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(HISTORY_ARCHIVE_DIR, f"history-{month}.ndjson.gz")
+
+
+def _write_archive(conn, name: str, month: date) -> int:
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(f"{month:%Y-%m}")
+    # Archives are self-contained: stored results are written out as text
+    columns = [column for column in _data_columns(conn) if column != "result_hash"]
+    rows = 0
+    result = conn.execute(text(
+        f"SELECT {', '.join('h.' + column for column in columns)}, r.codec, r.body FROM {name} h "
+        f"LEFT JOIN results r ON r.hash = h.result_hash ORDER BY h.created_at, h.id"
+    ).execution_options(yield_per=ARCHIVE_BATCH_ROWS))
+    # Written under a temporary name, so a crash never leaves a truncated archive behind
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+        for batch in result.partitions():
+            for *row, codec, body in batch:
+                item = dict(zip(columns, row))
+                if body is not None:
+                    item["result"] = result_store.unpack(codec, body)
+                for key in ("created_at", "updated_at"):
+                    if item.get(key) is not None:
+                        item[key] = item[key].isoformat()
+                file.write(json.dumps(item, ensure_ascii=False) + "\n")
+            rows += len(batch)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+    return rows
+
+
+def archive(conn, retention_months: int = HISTORY_RETENTION_MONTHS) -> list[dict]:
+    """Write out and drop partitions that ended ``retention_months`` or more ago; commits per partition."""
+    if retention_months <= 0 or not is_partitioned(conn):
+        return []
+    cutoff = _add_months(_this_month(), -retention_months)
+    expired = [(month, name) for month, name in partitions(conn) if _add_months(month, 1) <= cutoff]
+    conn.commit()
+    archived = []
+    for month, name in expired:
+        with conn.begin():
+            rows = _write_archive(conn, name, month)
+            # The file is complete before the rows go; a failure here keeps both
+            conn.execute(text(f"ALTER TABLE history DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        logger.info(f"Archived {rows} history rows for {month:%Y-%m} to {archive_path(f'{month:%Y-%m}')}")
+        archived.append({"month": f"{month:%Y-%m}", "rows": rows})
+    return archived
+
+
+def list_archives() -> list[dict]:
+    if not os.path.isdir(HISTORY_ARCHIVE_DIR):
+        return []
+    archives = []
+    for entry in sorted(os.scandir(HISTORY_ARCHIVE_DIR), key=lambda entry: entry.name):
+        match = ARCHIVE_NAME.match(entry.name)
+        if match:
+            stat = entry.stat()
+            archives.append({
+                "month": match[1],
+                "bytes": stat.st_size,
+                "archived_at": datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            })
+    return archives
+
+
+def read_archive(month: str, user_id: int | None = None, type: str | None = None,
+                 keyword: str | None = None, skip: int = 0, limit: int = 100) -> list[dict] | None:
+    """Rows of one archived month matching the filters, oldest first; None if there is no archive."""
+    path = archive_path(month)
+    if not os.path.exists(path):
+        return None
+    keyword = keyword.lower() if keyword else None
+    rows = []
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            item = json.loads(line)
+            if user_id is not None and item["user_id"] != user_id:
+                continue
+            if type is not None and item["type"] != type:
+                continue
+            if keyword and keyword not in f"{item['query'] or ''}\n{item['result'] or ''}".lower():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            rows.append(item)
+            if len(rows) >= limit:
+                break
+    return rows
+
+
+def maintain(engine) -> dict:
+    """Create upcoming partitions and archive expired ones, unless another worker is already at it."""
+    with engine.connect() as conn:
+        if not is_partitioned(conn) or not conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": LOCK_KEY}):
+            conn.rollback()
+            return {"ran": False}
+        conn.commit()
+        try:
+            with conn.begin():
+                created = ensure_partitions(conn)
+            archived = archive(conn)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+    return {"ran": True, "partitions_ensured": created, "archived": archived}
+
+
+class PartitionMaintainer:
+    def __init__(self, interval: float = HISTORY_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.runs = 0
+        self.archived_months = 0
+        self.last_run = None
+        self.last_error = None
+        self._task = None
+
+    async def _run(self, get_engine):
+        while True:
+            try:
+                # The sync engine (and its driver) is built here, off the event loop, on the first tick
+                result = await asyncio.to_thread(lambda: maintain(get_engine()))
+                if result["ran"]:
+                    self.runs += 1
+                    self.archived_months += len(result["archived"])
+                    self.last_run = datetime.utcnow().isoformat()
+                if result["ran"] and result["archived"]:
+                    # Results only the archived rows referenced are in the archive files now
+                    await result_store.collect_garbage()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("History partition maintenance failed")
+            await asyncio.sleep(self.interval)
+
+    async def start(self, get_engine):
+        """Run maintenance on the engine returned by ``get_engine()`` (PostgreSQL only)."""
+        if DIALECT != "postgresql" or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(get_engine))
+        logger.info(f"History partition maintenance every {self.interval}s (retention: {HISTORY_RETENTION_MONTHS or 'unlimited'} months)")
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "retention_months": HISTORY_RETENTION_MONTHS,
+            "runs": self.runs,
+            "archived_months": self.archived_months,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1:]
+    if command not in (["install"], ["ensure"], ["archive"], ["list"]):
+        sys.exit("usage: python partitions.py install|ensure|archive|list")
+    from database import engine
+    if command == ["install"]:
+        with engine.begin() as conn:
+            install(conn)
+    elif command == ["ensure"]:
+        with engine.begin() as conn:
+            print(f"{ensure_partitions(conn)} partitions in place")
+    elif command == ["archive"]:
+        with engine.connect() as conn:
+            for item in archive(conn):
+                print(f"Archived {item['month']}: {item['rows']} rows")
+    else:
+        with engine.connect() as conn:
+            for month, name in partitions(conn):
+                print(f"{name}: {conn.scalar(text(f'SELECT count(*) FROM {name}'))} rows")
+        for item in list_archives():
+            print(f"archive {item['month']}: {item['bytes']} bytes")
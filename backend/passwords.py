@@ -0,0 +1,112 @@
+"""
+Password hashing and verification on a bounded worker pool.
+
+bcrypt is deliberately CPU-heavy, so it runs on a dedicated thread pool (the
+bcrypt C extension releases the GIL) instead of on the event loop. The pool
+size caps how many hashes run at once; extra requests queue and are counted
+in queue_depth.
+
+Bulk imports hash on a second pool (hash_passwords), so thousands of queued
+import hashes never sit in front of a login. Threads are enough for both:
+with the GIL released, bcrypt runs on every core without a process pool.
+
+passlib and the bcrypt backend are loaded on the first hash or verify, not
+at import, which keeps them off a cold worker's startup path.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_BULK_HASH_WORKERS = int(os.getenv("PASSWORD_BULK_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    from passlib.context import CryptContext
+
+    # Hashes made with a different cost report needs_update, which drives rehash-on-login
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_bulk_executor = ThreadPoolExecutor(max_workers=PASSWORD_BULK_HASH_WORKERS, thread_name_prefix="password-hash-bulk")
+_lock = threading.Lock()
+_submitted = 0
+_running = 0
+_completed = 0
+_bulk_hashed = 0
+
+
+def _tracked(fn, *args):
+    global _running, _completed
+    with _lock:
+        _running += 1
+    try:
+        return fn(*args)
+    finally:
+        with _lock:
+            _running -= 1
+            _completed += 1
+
+
+async def _run(fn, *args):
+    global _submitted
+    with _lock:
+        _submitted += 1
+    return await asyncio.get_running_loop().run_in_executor(_executor, _tracked, fn, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context().hash, password)
+
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hash many passwords in parallel on the bulk pool, in input order."""
+    global _bulk_hashed
+    loop = asyncio.get_running_loop()
+    context = pwd_context()
+    hashes = await asyncio.gather(*(loop.run_in_executor(_bulk_executor, context.hash, p) for p in passwords))
+    with _lock:
+        _bulk_hashed += len(hashes)
+    return list(hashes)
+
+
+async def verify_password(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await _run(pwd_context().verify_and_update, password, hashed_password)
+
+
+def stats() -> dict:
+    with _lock:
+        in_progress = _running
+        queue_depth = _submitted - _completed - _running
+        completed = _completed
+        bulk_hashed = _bulk_hashed
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "in_progress": in_progress,
+        "queue_depth": queue_depth,
+        "completed": completed,
+        "bulk_workers": PASSWORD_BULK_HASH_WORKERS,
+        "bulk_hashed": bulk_hashed,
+    }
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _bulk_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,388 @@
+"""
+Deduplicated, compressed storage for History.result.
+
+Results of at least RESULT_STORE_MIN_BYTES characters are written once to
+the results table. They are keyed by the SHA-256 of their text and
+compressed with zstd (if the zstandard package is installed) or zlib.
+The History row keeps result NULL and points to the stored body through
+result_hash, so a Tavily answer given to many users (often straight from
+the search cache) is stored once. Shorter results, such as image URLs,
+stay inline, because a hash plus compression would not make them smaller.
+
+Bodies are fetched and decompressed only when a response includes them
+(fetch() and result_of()). The most recently used ones are kept in an LRU
+of RESULT_CACHE_ENTRIES; a hash always names the same text, so these
+entries never go stale.
+
+Deleting, editing or archiving History rows can leave stored results that
+nothing references. The result collector deletes them every
+RESULT_GC_INTERVAL seconds, whatever the database. A row being recorded may
+point to a result before it commits, which the collector cannot see, so
+results stored or reused in the last RESULT_GC_GRACE seconds are spared:
+store() refreshes referenced_at on the results it reuses. On PostgreSQL,
+that update also locks the row, so a collector already deleting it waits
+for the insert and then finds it recent.
+
+Only one worker runs the collector. It is the one holding a PostgreSQL
+advisory lock on a connection it keeps open, or a lock file next to a
+SQLite database. The other workers try to take over on every tick, so
+collection moves on if that worker stops.
+
+    python result_store.py migrate   # move existing inline results into the table
+    python result_store.py report    # space used and saved
+    python result_store.py gc        # delete stored results no History row references
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, exists, func, make_url, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker collects
+    fcntl = None
+
+import fulltext
+from cache import MemoryBackend
+from database import DATABASE_URL, DIALECT, async_session, dialect_module, get_async_engine
+from models import History, StoredResult
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESULT_STORE_MIN_BYTES = int(os.getenv("RESULT_STORE_MIN_BYTES", "256"))
+RESULT_CODEC = os.getenv("RESULT_CODEC", "zstd" if zstandard is not None else "zlib")
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "1024"))
+RESULT_GC_INTERVAL = float(os.getenv("RESULT_GC_INTERVAL", "3600"))  # 0 turns the collector off
+RESULT_GC_GRACE = float(os.getenv("RESULT_GC_GRACE", "600"))
+GC_LOCK_KEY = 0x72657375  # pg advisory lock held by the worker running the collector
+RESULT_MIGRATE_BATCH = 1000
+
+if RESULT_CODEC == "zstd" and zstandard is None:
+    logger.warning("RESULT_CODEC=zstd but the zstandard package is not installed; using zlib")
+    RESULT_CODEC = "zlib"
+
+# Decompressed bodies by hash
+_bodies = MemoryBackend(RESULT_CACHE_ENTRIES)
+FOREVER = float("inf")
+
+
+def _compress(data: bytes) -> bytes:
+    if RESULT_CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 9)
+
+
+def unpack(codec: str, body: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("A stored result is zstd-compressed; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(body).decode()
+    return zlib.decompress(body).decode()
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _pack(bodies: dict[str, str]) -> list[dict]:
+    packed = []
+    for hash, text in bodies.items():
+        data = text.encode()
+        packed.append({"hash": hash, "codec": RESULT_CODEC, "body": _compress(data), "size": len(data)})
+    return packed
+
+
+def _insert():
+    dialect = dialect_module()
+    # A body stored by someone else since is fine: same hash, same text
+    return (
+        dialect.insert(StoredResult)
+        .on_conflict_do_nothing(index_elements=["hash"])
+        .returning(StoredResult.id, StoredResult.hash)
+    )
+
+
+async def store(db: AsyncSession, rows: list[dict]) -> list[dict]:
+    """History row dicts with large results moved into the results table (input is left as is)."""
+    out = []
+    bodies = {}
+    for row in rows:
+        text = row.get("result")
+        if text is not None and len(text) >= RESULT_STORE_MIN_BYTES:
+            hash = digest(text)
+            bodies[hash] = text
+            row = {**row, "result": None, "result_hash": hash}
+        else:
+            row = {**row, "result_hash": None}
+        out.append(row)
+    if not bodies:
+        return out
+    # Keep reused results out of the collector's reach until this transaction commits;
+    # one touched in the first half of the grace period is left alone
+    now = datetime.utcnow()
+    await db.execute(
+        update(StoredResult)
+        .where(StoredResult.hash.in_(bodies), StoredResult.referenced_at < now - timedelta(seconds=RESULT_GC_GRACE / 2))
+        .values(referenced_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    # Compressing a large batch would hold up the event loop
+    packed = await asyncio.to_thread(_pack, bodies) if len(bodies) > 8 else _pack(bodies)
+    created = (await db.execute(_insert(), packed)).all()
+    await fulltext.index_results(db, [(id, bodies[hash]) for id, hash in created])
+    return out
+
+
+async def fetch(db: AsyncSession, items: list, known: dict[str, str] | None = None) -> dict[str, str]:
+    """Bodies of the stored results ``items`` (History rows) point to, by hash, plus ``known``."""
+    bodies = dict(known or {})
+    missing = set()
+    for item in items:
+        hash = item.result_hash
+        if hash is None or hash in bodies:
+            continue
+        cached = _bodies.get(hash, 0)
+        if cached is not None:
+            bodies[hash] = cached
+        else:
+            missing.add(hash)
+    if missing:
+        rows = (await db.execute(
+            select(StoredResult.hash, StoredResult.codec, StoredResult.body).where(StoredResult.hash.in_(missing))
+        )).all()
+        for hash, codec, body in rows:
+            bodies[hash] = unpack(codec, body)
+            _bodies.set(hash, bodies[hash], FOREVER)
+    return bodies
+
+
+def result_of(item, bodies: dict[str, str]) -> str | None:
+    """The result text of a History row, given the bodies from fetch()."""
+    if item.result_hash is None:
+        return item.result
+    return bodies.get(item.result_hash)
+
+
+async def migrate(batch_rows: int = RESULT_MIGRATE_BATCH) -> int:
+    """Move existing large inline results into the results table; commits per batch."""
+    moved = 0
+    last_id = 0
+    async with async_session() as db:
+        while True:
+            rows = (await db.execute(
+                select(History.id, History.result)
+                .where(History.id > last_id, History.result_hash.is_(None), func.length(History.result) >= RESULT_STORE_MIN_BYTES)
+                .order_by(History.id)
+                .limit(batch_rows)
+            )).all()
+            if not rows:
+                return moved
+            stored = await store(db, [{"id": id, "result": result} for id, result in rows])
+            # The full-text triggers re-index each row without its (now stored) result
+            await db.execute(update(History), [
+                {"id": row["id"], "result": None, "result_hash": row["result_hash"]} for row in stored
+            ])
+            await db.commit()
+            moved += len(rows)
+            last_id = rows[-1].id
+            logger.info(f"Moved {moved} history results into the result store")
+
+
+async def collect_garbage(batch_rows: int = RESULT_MIGRATE_BATCH, grace: float = RESULT_GC_GRACE) -> int:
+    """Delete stored results that no History row references, unless stored or reused in the last ``grace`` seconds."""
+    deleted = 0
+    unreferenced = and_(
+        StoredResult.referenced_at < datetime.utcnow() - timedelta(seconds=grace),
+        ~exists().where(History.result_hash == StoredResult.hash),
+    )
+    async with async_session() as db:
+        while True:
+            ids = (await db.scalars(select(StoredResult.id).where(unreferenced).limit(batch_rows))).all()
+            if not ids:
+                return deleted
+            # Checked again: a row recorded meanwhile may point to one of them
+            rows = (await db.execute(
+                delete(StoredResult).where(StoredResult.id.in_(ids), unreferenced)
+                .returning(StoredResult.id, StoredResult.codec, StoredResult.body)
+            )).all()
+            await fulltext.unindex_results(db, [(id, unpack(codec, body)) for id, codec, body in rows])
+            await db.commit()
+            deleted += len(rows)
+
+
+class ResultCollector:
+    def __init__(self, interval: float = RESULT_GC_INTERVAL, grace: float = RESULT_GC_GRACE):
+        self.interval = interval
+        self.grace = grace
+        self.runs = 0
+        self.deleted = 0
+        self.last_run = None
+        self.last_error = None
+        self._task = None
+        self._lock_conn = None  # PostgreSQL: the connection holding GC_LOCK_KEY
+        self._lock_file = None  # SQLite: the open, locked lock file
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_conn is not None or self._lock_file is not None
+
+    async def _elect(self) -> bool:
+        """Whether this worker runs the collector: take or keep its lock."""
+        if DIALECT == "postgresql":
+            if self._lock_conn is not None:
+                try:
+                    # A session lock lasts as long as its connection
+                    await self._lock_conn.exec_driver_sql("SELECT 1")
+                    await self._lock_conn.commit()
+                    return True
+                except Exception:
+                    logger.warning("Lost the connection holding the result collector lock")
+                    await self._release()
+            conn = await get_async_engine().connect()
+            try:
+                locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": GC_LOCK_KEY})
+                await conn.commit()
+            except BaseException:
+                await conn.close()
+                raise
+            if not locked:
+                await conn.close()
+                return False
+            self._lock_conn = conn
+            return True
+        path = make_url(DATABASE_URL).database
+        if fcntl is None or not path or path == ":memory:":
+            return True
+        if self._lock_file is None:
+            lock_file = open(path + ".gc-lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+        return True
+
+    async def _release(self):
+        if self._lock_conn is not None:
+            # Closing the underlying connection drops the lock, whatever state it is in
+            conn, self._lock_conn = self._lock_conn, None
+            try:
+                await conn.invalidate()
+                await conn.close()
+            except Exception:
+                logger.exception("Closing the result collector lock connection failed")
+        if self._lock_file is not None:
+            self._lock_file.close()  # releases the flock
+            self._lock_file = None
+
+    async def collect(self) -> bool:
+        """One collection, if this worker holds the collector lock; False if another one does."""
+        try:
+            if not await self._elect():
+                return False
+            self.deleted += await collect_garbage(grace=self.grace)
+            self.runs += 1
+            self.last_run = datetime.utcnow().isoformat()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            logger.exception("Stored result garbage collection failed")
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.collect()
+
+    async def start(self):
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Unreferenced stored results collected every {self.interval}s by one worker")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._release()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "leader": self.leader,
+            "interval": self.interval,
+            "grace": self.grace,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+result_collector = ResultCollector()
+
+
+async def report(db: AsyncSession) -> dict:
+    """Space taken by stored results against what the rows referencing them would take inline."""
+    stored, unique_bytes, stored_bytes = (await db.execute(
+        select(func.count(StoredResult.id), func.coalesce(func.sum(StoredResult.size), 0),
+               func.coalesce(func.sum(func.length(StoredResult.body)), 0))
+    )).one()
+    referencing, logical_bytes = (await db.execute(
+        select(func.count(History.id), func.coalesce(func.sum(StoredResult.size), 0))
+        .join(StoredResult, StoredResult.hash == History.result_hash)
+    )).one()
+    inline = await db.scalar(select(func.count(History.id)).where(History.result_hash.is_(None)))
+    return {
+        "codec": RESULT_CODEC,
+        "min_bytes": RESULT_STORE_MIN_BYTES,
+        "stored_results": stored,
+        "referencing_rows": referencing,
+        "inline_rows": inline,
+        "logical_bytes": logical_bytes,  # the referencing rows' results, uncompressed
+        "unique_bytes": unique_bytes,  # after deduplication
+        "stored_bytes": stored_bytes,  # after compression
+        "saved_bytes": logical_bytes - stored_bytes,
+        "dedup_ratio": round(logical_bytes / unique_bytes, 2) if unique_bytes else None,
+        "compression_ratio": round(unique_bytes / stored_bytes, 2) if stored_bytes else None,
+    }
+
+
+def print_report(stats: dict):
+    for key, value in stats.items():
+        print(f"{key:>18}: {value}")
+
+
+async def run(command: str):
+    """Run a command-line action (migrate, gc or report) and print the report."""
+    if command == "migrate":
+        print(f"Moved {await migrate()} history results into the result store")
+    elif command == "gc":
+        print(f"Deleted {await collect_garbage()} unreferenced results")
+    async with async_session() as db:
+        print_report(await report(db))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["migrate"], ["report"], ["gc"]):
+        sys.exit("usage: python result_store.py migrate|report|gc")
+    asyncio.run(run(sys.argv[1]))
@@ -0,0 +1,208 @@
+"""
+Incrementally maintained history counts for /admin/stats.
+
+user_activity_rollups holds counts per (user_id, type) and
+daily_activity_rollups per (day, type). Row-level triggers on history add one
+to the matching rows on insert and take one away on delete (dropping rows
+that reach zero), so stats read a few thousand rows instead of scanning
+history. SQLite uses UPSERT triggers, PostgreSQL a plpgsql trigger function.
+History rows without a user are not counted.
+
+The trigger's row lock is held until the inserting transaction commits.
+With one row per (day, type), every concurrent commit of the day would queue
+on it. Each day and type therefore has DAILY_SHARDS rows, picked by
+history.id, and readers add them up. Per-user rows are not sharded: only
+one user's own concurrent requests queue on them. Changing DAILY_SHARDS
+needs a backfill, because deletes find their shard the same way.
+
+install() is idempotent and is run by init_db.py and migrate_db.py;
+``python rollups.py backfill`` rebuilds the counts from existing history.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import desc, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import MemoryBackend
+from models import DailyActivityRollup, User, UserActivityRollup
+from settings import load_env
+
+load_env()
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "10"))
+DAILY_SHARDS = 16
+
+TABLES = [UserActivityRollup.__table__, DailyActivityRollup.__table__]
+
+
+def _keys(day: str) -> dict:
+    # Rollup table -> key column -> expression over the history row named "{row}"
+    return {
+        "user_activity_rollups": {"user_id": "{row}.user_id", "type": "coalesce({row}.type, '')"},
+        "daily_activity_rollups": {"day": day, "type": "coalesce({row}.type, '')", "shard": f"{{row}}.id % {DAILY_SHARDS}"},
+    }
+
+
+def _increment(table: str, keys: dict, row: str) -> str:
+    columns = ", ".join(keys)
+    values = ", ".join(expr.format(row=row) for expr in keys.values())
+    return (
+        f"INSERT INTO {table} ({columns}, count) VALUES ({values}, 1) "
+        f"ON CONFLICT ({columns}) DO UPDATE SET count = {table}.count + 1;"
+    )
+
+
+def _decrement(table: str, keys: dict, row: str) -> str:
+    match = " AND ".join(f"{column} = {expr.format(row=row)}" for column, expr in keys.items())
+    return (
+        f"UPDATE {table} SET count = count - 1 WHERE {match}; "
+        f"DELETE FROM {table} WHERE {match} AND count <= 0;"
+    )
+
+
+def _sqlite_ddl() -> list:
+    keys = _keys("date({row}.created_at)")
+    increments = "\n".join(_increment(table, k, "new") for table, k in keys.items())
+    decrements = "\n".join(_decrement(table, k, "old") for table, k in keys.items())
+    # Drop first so a re-install picks up changed trigger bodies, as on PostgreSQL
+    return [
+        "DROP TRIGGER IF EXISTS history_rollup_ai",
+        "DROP TRIGGER IF EXISTS history_rollup_ad",
+        f"""CREATE TRIGGER history_rollup_ai AFTER INSERT ON history
+            WHEN new.user_id IS NOT NULL BEGIN
+            {increments}
+        END""",
+        f"""CREATE TRIGGER history_rollup_ad AFTER DELETE ON history
+            WHEN old.user_id IS NOT NULL BEGIN
+            {decrements}
+        END""",
+    ]
+
+
+def _postgres_ddl() -> list:
+    keys = _keys("{row}.created_at::date")
+    increments = "\n".join(_increment(table, k, "NEW") for table, k in keys.items())
+    decrements = "\n".join(_decrement(table, k, "OLD") for table, k in keys.items())
+    return [
+        f"""CREATE OR REPLACE FUNCTION history_rollup() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NEW.user_id IS NOT NULL THEN
+                    {increments}
+                END IF;
+                RETURN NEW;
+            END IF;
+            IF OLD.user_id IS NOT NULL THEN
+                {decrements}
+            END IF;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS history_rollup_trg ON history",
+        """CREATE TRIGGER history_rollup_trg AFTER INSERT OR DELETE ON history
+            FOR EACH ROW EXECUTE FUNCTION history_rollup()""",
+    ]
+
+
+def install(conn):
+    """Create the rollup tables and the history triggers that maintain them."""
+    for table in TABLES:
+        table.create(conn, checkfirst=True)
+    if conn.dialect.name == "sqlite":
+        for statement in _sqlite_ddl():
+            conn.execute(text(statement))
+    elif conn.dialect.name == "postgresql":
+        for statement in _postgres_ddl():
+            conn.execute(text(statement))
+
+
+def backfill(conn):
+    """Recompute every rollup row from history inside the caller's transaction."""
+    if conn.dialect.name == "postgresql":
+        # Hold off writers so no insert is counted by both the trigger and the rebuild
+        conn.execute(text("LOCK TABLE history IN SHARE MODE"))
+        day = "{row}.created_at::date"
+    elif conn.dialect.name == "sqlite":
+        day = "date({row}.created_at)"
+    else:
+        day = "CAST({row}.created_at AS DATE)"
+    for table, keys in _keys(day).items():
+        exprs = ", ".join(expr.format(row="history") for expr in keys.values())
+        conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text(
+            f"INSERT INTO {table} ({', '.join(keys)}, count) "
+            f"SELECT {exprs}, COUNT(*) FROM history WHERE user_id IS NOT NULL GROUP BY {exprs}"
+        ))
+
+
+# Single entry; every worker serves stats at most STATS_CACHE_TTL seconds old
+_stats = MemoryBackend(1)
+
+
+async def system_stats(db: AsyncSession) -> dict:
+    """User and activity totals for /admin/stats, read from the rollups."""
+    cached = _stats.get("stats", time.time())
+    if cached is not None:
+        return cached
+
+    roles = dict((await db.execute(
+        select(User.role, func.count(User.id)).group_by(User.role)
+    )).all())
+    total_users = sum(roles.values())
+    admin_users = roles.get("admin", 0)
+
+    by_type = dict((await db.execute(
+        select(DailyActivityRollup.type, func.sum(DailyActivityRollup.count)).group_by(DailyActivityRollup.type)
+    )).all())
+    total_searches = by_type.get("search", 0)
+    total_images = by_type.get("image", 0)
+
+    # Day granularity: counts everything from the start of the day a week ago
+    week_ago = (datetime.utcnow() - timedelta(days=7)).date()
+    recent_activities = await db.scalar(
+        select(func.coalesce(func.sum(DailyActivityRollup.count), 0)).where(DailyActivityRollup.day >= week_ago)
+    )
+
+    activity_count = func.sum(UserActivityRollup.count)
+    most_active = (await db.execute(
+        select(User.username, activity_count.label("activity_count"))
+        .select_from(UserActivityRollup)
+        .join(User, User.id == UserActivityRollup.user_id)
+        .group_by(User.id, User.username)
+        .order_by(desc(activity_count))
+        .limit(5)
+    )).all()
+
+    stats = {
+        "users": {
+            "total": total_users,
+            "admin": admin_users,
+            "regular": total_users - admin_users
+        },
+        "activities": {
+            "total": total_searches + total_images,
+            "searches": total_searches,
+            "images": total_images,
+            "recent_week": recent_activities
+        },
+        "most_active_users": [
+            {"username": username, "activity_count": count}
+            for username, count in most_active
+        ]
+    }
+    _stats.set("stats", stats, time.time() + STATS_CACHE_TTL)
+    return stats
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python rollups.py backfill")
+    from database import engine
+    with engine.begin() as conn:
+        install(conn)
+        backfill(conn)
+    print("Activity rollups rebuilt")
@@ -1,47 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import select, delete, desc
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, History
-from schemas import UserResponse, UserCreate
+from schemas import UserResponse, UserCreate, UserHistoryResponse, BulkRoleChange, BulkUserDelete
 from database import get_db
-from dependencies import get_admin_user, get_current_user
-from passlib.context import CryptContext
+from dependencies import get_admin_user, get_current_user, invalidate_principal, Principal
+from cache import search_cache
+from singleflight import search_flight, image_flight
+from export import ExportFormat, export_response
+from routers.image import image_jobs, flux_upstream
+from routers.search import tavily_upstream
+from routers.dashboard import page_etag, history_item
+from conditional import make_etag, not_modified
+from history_writer import history_writer
+from image_store import image_store
+from passwords import hash_password
+from partitions import partition_maintainer
+import activity
+import passwords
+import partitions
+import result_store
+import rollups
+import bulk_users
 from typing import Optional, List
+from datetime import datetime
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import os
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @router.get("/users", response_model=List[UserResponse])
 async def get_all_users(
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     role_filter: Optional[str] = Query(None, description="Filter by role (user/admin)")
 ):
     """Get all users (admin only)"""
-    query = db.query(User)
+    query = select(User)
     
     if role_filter:
-        query = query.filter(User.role == role_filter)
+        query = query.where(User.role == role_filter)
     
-    users = query.offset(skip).limit(limit).all()
+    users = (await db.execute(query.order_by(User.id).offset(skip).limit(limit))).scalars().all()
+    cached = not_modified(request, response, make_etag([[u.id, u.username, u.role] for u in users]))
+    if cached:
+        return cached
     return users
 
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user_by_id(
     user_id: int,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get specific user by ID (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -49,17 +72,17 @@ async def get_user_by_id(
 @router.post("/users", response_model=UserResponse)
 async def create_user(
     user_data: UserCreate,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new user (admin only)"""
     # Check if username already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    existing_user = (await db.execute(select(User).where(User.username == user_data.username))).scalar_one_or_none()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     # Hash password and create user
-    hashed_password = pwd_context.hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     new_user = User(
         username=user_data.username,
         hashed_password=hashed_password,
@@ -67,31 +90,66 @@ async def create_user(
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     logger.info(f"Admin {admin_user.username} created new user: {new_user.username}")
     return new_user
 
+@router.post("/users/import")
+async def bulk_import_users(
+    request: Request,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Create users from a CSV (username,password,role header) or JSON list body, with a result per row (admin only)"""
+    rows = bulk_users.parse_import(await request.body(), request.headers.get("content-type", ""))
+    report = await bulk_users.import_users(db, rows)
+    logger.info(f"Admin {admin_user.username} imported {report['created']} users ({report['failed']} failed)")
+    return report
+
+@router.post("/users/bulk/role")
+async def bulk_change_roles(
+    change: BulkRoleChange,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Set the role of many users in one statement, with a result per user (admin only)"""
+    report = await bulk_users.change_roles(db, change.user_ids, change.role, admin_user.id)
+    logger.info(f"Admin {admin_user.username} changed {report['updated']} users to role {change.role}")
+    return report
+
+@router.post("/users/bulk/delete")
+async def bulk_delete_users(
+    request: BulkUserDelete,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete many users and their history, with a result per user (admin only)"""
+    report = await bulk_users.delete_users(db, request.user_ids, admin_user.id)
+    logger.info(f"Admin {admin_user.username} deleted {report['deleted']} users and {report['history_deleted']} history rows")
+    return report
+
 @router.put("/users/{user_id}", response_model=UserResponse)
 async def update_user(
     user_id: int,
     update_data: dict,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update user information (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    old_username = user.username
     
     # Update allowed fields
     if "username" in update_data:
         # Check if new username already exists (but not for the current user)
-        existing = db.query(User).filter(
+        existing = (await db.execute(select(User).where(
             User.username == update_data["username"], 
             User.id != user_id
-        ).first()
+        ))).scalar_one_or_none()
         if existing:
             raise HTTPException(status_code=400, detail="Username already exists")
         user.username = update_data["username"]
@@ -99,13 +157,20 @@ async def update_user(
     if "role" in update_data:
         if update_data["role"] not in ["user", "admin"]:
             raise HTTPException(status_code=400, detail="Invalid role")
-        user.role = update_data["role"]
+        if update_data["role"] != user.role:
+            # Tokens carry the role they were issued with
+            user.role = update_data["role"]
+            user.token_version += 1
     
     if "password" in update_data:
-        user.hashed_password = pwd_context.hash(update_data["password"])
+        user.hashed_password = await hash_password(update_data["password"])
+        # A password reset signs the user out everywhere
+        user.token_version += 1
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_principal(old_username)
+    invalidate_principal(user.username)
     
     logger.info(f"Admin {admin_user.username} updated user: {user.username}")
     return user
@@ -113,11 +178,11 @@ async def update_user(
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: int,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a user (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -125,100 +190,99 @@ async def delete_user(
     if user.id == admin_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
-    # Delete user's history first (cascade)
-    db.query(History).filter(History.user_id == user_id).delete()
+    # Delete user's history first (cascade), including rows still buffered
+    await history_writer.sync_user(user_id)
+    await db.execute(delete(History).where(History.user_id == user_id))
     
     # Delete the user
     username = user.username
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
+    invalidate_principal(username)
     
     logger.info(f"Admin {admin_user.username} deleted user: {username}")
     return {"detail": f"User {username} deleted successfully"}
 
 @router.get("/stats")
 async def get_system_stats(
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get system statistics (admin only)"""
-    
-    # Basic counts
-    total_users = db.query(func.count(User.id)).scalar()
-    admin_users = db.query(func.count(User.id)).filter(User.role == "admin").scalar()
-    regular_users = total_users - admin_users
-    
-    total_searches = db.query(func.count(History.id)).filter(History.type == "search").scalar()
-    total_images = db.query(func.count(History.id)).filter(History.type == "image").scalar()
-    total_activities = total_searches + total_images
-    
-    # Recent activity (last 7 days)
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    recent_activities = db.query(func.count(History.id)).filter(
-        History.created_at >= week_ago
-    ).scalar()
-    
-    # Most active users (top 5 by activity count)
-    most_active = db.query(
-        User.username,
-        func.count(History.id).label('activity_count')
-    ).join(History, User.id == History.user_id)\
-    .group_by(User.id, User.username)\
-    .order_by(desc(func.count(History.id)))\
-    .limit(5).all()
-    
-    return {
-        "users": {
-            "total": total_users,
-            "admin": admin_users,
-            "regular": regular_users
-        },
-        "activities": {
-            "total": total_activities,
-            "searches": total_searches,
-            "images": total_images,
-            "recent_week": recent_activities
-        },
-        "most_active_users": [
-            {"username": username, "activity_count": count} 
-            for username, count in most_active
-        ]
-    }
+    return await rollups.system_stats(db)
 
-@router.get("/users/{user_id}/history")
+@router.get("/activity")
+async def get_activity_series(
+    bucket: activity.Bucket = "day",
+    start: Optional[datetime] = Query(None, description="Defaults to a day, 30 days or 12 weeks before end"),
+    end: Optional[datetime] = Query(None, description="Defaults to now"),
+    by_user: bool = Query(False, description="Split each bucket by user"),
+    user_id: Optional[int] = None,
+    type: Optional[str] = Query(None, description="search or image"),
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get history counts per hour, day or week and type over a time range (admin only)"""
+    return await activity.series(db, bucket, start, end, by_user, user_id, type)
+
+@router.get("/users/{user_id}/history", response_model=UserHistoryResponse)
 async def get_user_history(
     user_id: int,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
     limit: int = Query(50, ge=1, le=200)
 ):
     """Get history for a specific user (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    await history_writer.sync_user(user_id)
     
-    history = db.query(History).filter(
+    history = (await db.execute(select(History).where(
         History.user_id == user_id
-    ).order_by(desc(History.created_at)).limit(limit).all()
+    ).order_by(desc(History.created_at)).limit(limit))).scalars().all()
     
+    cached = not_modified(request, response, page_etag(history, user.username, user.role))
+    if cached:
+        return cached
+    bodies = await result_store.fetch(db, history)
     return {
-        "user": {"id": user.id, "username": user.username, "role": user.role},
-        "history": history,
+        "user": user,
+        "history": [history_item(item, bodies) for item in history],
         "total_count": len(history)
     }
 
+@router.get("/users/{user_id}/history/export")
+async def export_user_history(
+    user_id: int,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    format: ExportFormat = "ndjson",
+    gzip: bool = False
+):
+    """Stream a user's full history (oldest first) as NDJSON or CSV (admin only)"""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await history_writer.sync_user(user_id)
+    
+    logger.info(f"Admin {admin_user.username} exported history of user: {user.username}")
+    return export_response([History.user_id == user_id], f"history-{user.username}", format, gzip)
+
 @router.put("/users/{user_id}/role")
 async def change_user_role(
     user_id: int,
     new_role: dict,
-    admin_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Change user role (admin only)"""
     if "role" not in new_role or new_role["role"] not in ["user", "admin"]:
         raise HTTPException(status_code=400, detail="Invalid role. Must be 'user' or 'admin'")
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -227,9 +291,108 @@ async def change_user_role(
         raise HTTPException(status_code=400, detail="Cannot change your own role")
     
     old_role = user.role
-    user.role = new_role["role"]
-    db.commit()
-    db.refresh(user)
+    if user.role != new_role["role"]:
+        # Tokens carry the role they were issued with
+        user.role = new_role["role"]
+        user.token_version += 1
+    await db.commit()
+    await db.refresh(user)
+    invalidate_principal(user.username)
     
     logger.info(f"Admin {admin_user.username} changed user {user.username} role from {old_role} to {user.role}")
     return {"detail": f"User {user.username} role changed from {old_role} to {user.role}"}
+
+@router.post("/users/{user_id}/revoke-tokens")
+async def revoke_user_tokens(
+    user_id: int,
+    admin_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Invalidate every token issued to a user (admin only)"""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    user.token_version += 1
+    await db.commit()
+    invalidate_principal(user.username)
+    
+    logger.info(f"Admin {admin_user.username} revoked tokens for user: {user.username}")
+    return {"detail": f"Tokens for user {user.username} revoked"}
+
+@router.get("/cache/stats")
+async def get_cache_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get search result cache and request coalescing counters (admin only)"""
+    return {
+        "search": await search_cache.stats(),
+        "coalescing": {"search": search_flight.stats(), "image": image_flight.stats()}
+    }
+
+@router.delete("/cache")
+async def clear_cache(admin_user: Principal = Depends(get_admin_user)):
+    """Drop all cached search results (admin only)"""
+    await search_cache.clear()
+    logger.info(f"Admin {admin_user.username} cleared the search cache")
+    return {"detail": "Search cache cleared"}
+
+@router.get("/image-jobs/stats")
+async def get_image_job_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get image job queue depth, running jobs and outcome counters (admin only)"""
+    return image_jobs.stats()
+
+@router.get("/history-writer/stats")
+async def get_history_writer_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get history write-behind buffer and flush counters (admin only)"""
+    return history_writer.stats()
+
+@router.get("/image-store/stats")
+async def get_image_store_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get local image store size, downloads and eviction counters (admin only)"""
+    return image_store.stats()
+
+@router.get("/password-hashing/stats")
+async def get_password_hashing_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get password hashing pool concurrency and queue depth (admin only)"""
+    return passwords.stats()
+
+@router.get("/upstreams/stats")
+async def get_upstream_stats(admin_user: Principal = Depends(get_admin_user)):
+    """Get circuit breaker state, retry and hedging counters per upstream API (admin only)"""
+    return {"tavily": tavily_upstream.stats(), "flux": flux_upstream.stats()}
+
+@router.get("/results/stats")
+async def get_result_store_stats(admin_user: Principal = Depends(get_admin_user), db: AsyncSession = Depends(get_db)):
+    """Get stored result counts, the space saved by deduplication and compression, and collector status (admin only)"""
+    return {**await result_store.report(db), "collector": result_store.result_collector.stats()}
+
+@router.get("/history/archives")
+async def get_history_archives(admin_user: Principal = Depends(get_admin_user)):
+    """List archived history months and partition maintenance status (admin only)"""
+    return {"maintenance": partition_maintainer.stats(), "archives": await asyncio.to_thread(partitions.list_archives)}
+
+@router.get("/history/archives/{month}")
+async def query_history_archive(
+    month: str = Path(..., pattern=r"^\d{4}-\d{2}$", description="Archived month, YYYY-MM"),
+    user_id: Optional[int] = None,
+    type: Optional[str] = Query(None, description="search or image"),
+    keyword: Optional[str] = Query(None, description="Case-insensitive substring of query or result"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    admin_user: Principal = Depends(get_admin_user)
+):
+    """Query history rows of an archived month, oldest first (admin only)"""
+    rows = await asyncio.to_thread(partitions.read_archive, month, user_id, type, keyword, skip, limit)
+    if rows is None:
+        raise HTTPException(status_code=404, detail=f"No history archive for {month}")
+    return {"month": month, "rows": rows}
+
+@router.get("/history/archives/{month}/download")
+async def download_history_archive(
+    month: str = Path(..., pattern=r"^\d{4}-\d{2}$"),
+    admin_user: Principal = Depends(get_admin_user)
+):
+    """Download an archived history month as gzipped NDJSON (admin only)"""
+    path = partitions.archive_path(month)
+    if not await asyncio.to_thread(os.path.exists, path):
+        raise HTTPException(status_code=404, detail=f"No history archive for {month}")
+    return FileResponse(path, media_type="application/gzip", filename=os.path.basename(path))
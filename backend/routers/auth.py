@@ -1,41 +1,59 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
 from schemas import UserCreate, Token
 from database import get_db
-from passlib.context import CryptContext
+from passwords import hash_password, verify_password
 from jose import jwt
-from dotenv import load_dotenv
-import os
+from settings import get_settings
+from datetime import datetime, timezone
 
-# Load environment variables
-load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY")
+settings = get_settings()
+SECRET_KEY = settings.secret_key
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY not found in .env file")
-ALGORITHM = "HS256"
+ALGORITHM = settings.jwt_algorithm
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def create_access_token(user: User) -> str:
+    # "ver" lets get_current_user reject tokens revoked by a token_version bump
+    payload = {
+        "sub": user.username,
+        "role": user.role,
+        "ver": user.token_version,
+        "iat": int(datetime.now(timezone.utc).timestamp()),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 @router.post("/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = (await db.execute(select(User).where(User.username == user.username))).scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = User(username=user.username, hashed_password=hashed_password, role=user.role)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    token = jwt.encode({"sub": user.username, "role": user.role}, SECRET_KEY, algorithm=ALGORITHM)
+    await db.commit()
+    await db.refresh(db_user)
+    token = create_access_token(db_user)
     return {"access_token": token, "token_type": "bearer"}
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(User).where(User.username == form_data.username))).scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    # End the read transaction so the pooled connection isn't held while bcrypt runs
+    await db.commit()
+    valid, new_hash = await verify_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = jwt.encode({"sub": user.username, "role": user.role}, SECRET_KEY, algorithm=ALGORITHM)
+    if new_hash:
+        # Stored hash used an older bcrypt cost; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
+    token = create_access_token(user)
     return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,58 +1,162 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from schemas import HistoryResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import DashboardItem
 from models import History
 from database import get_db
 from dependencies import get_current_user
+from pagination import paginate, split_page
+from export import ExportFormat, export_response
+from history_writer import history_writer
+from image_store import image_store
+from conditional import make_etag, not_modified
+import fulltext
+import result_store
+from settings import load_env
 import logging
+import os
+from datetime import datetime, timezone
 from typing import Optional
 
+load_env()
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
+DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "50"))
+DASHBOARD_MAX_PAGE_SIZE = int(os.getenv("DASHBOARD_MAX_PAGE_SIZE", "200"))
+
+async def thumbnail_digests(items: list, bodies: dict[str, str]) -> dict[str, str]:
+  """Stored image digest per image URL among ``items``; read-only, URLs not in the store are never fetched"""
+  urls = [result_store.result_of(item, bodies) for item in items if item.type == "image"]
+  return await image_store.resolve_many([url for url in urls if url])
+
+def page_etag(items: list, *extra) -> str:
+  # Row ids and edit times cover new, edited and deleted entries on this page
+  return make_etag([[item.id, str(item.created_at), str(item.updated_at)] for item in items], *extra)
+
+def history_item(item, bodies: dict[str, str]) -> dict:
+  """Serialize a History row with its result text (see result_store.fetch)"""
+  columns = [column.key for column in History.__table__.columns]
+  return {**{column: getattr(item, column) for column in columns}, "result": result_store.result_of(item, bodies)}
+
+def with_thumbnails(items: list, digests: dict[str, str], bodies: dict[str, str]) -> list[dict]:
+  """Serialize History rows, adding thumbnail_url for images already in the local store"""
+  serialized = [history_item(item, bodies) for item in items]
+  for item in serialized:
+    item["thumbnail_url"] = f"/images/{digests[item['result']]}/thumbnail" if item["result"] in digests else None
+  return serialized
+
+def naive_utc(moment: datetime) -> datetime:
+  # created_at is stored as naive UTC
+  if moment.tzinfo is not None:
+    moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+  return moment
 
-@router.get("/")
+def history_filters(user_id: int, type, keyword, date_start: Optional[datetime], date_end: Optional[datetime]) -> list:
+  filters = [History.user_id == user_id]
+  if type:
+    filters.append(History.type == type)
+  if keyword and keyword.strip():
+    filters.append(fulltext.matches(keyword))
+  if date_start:
+    filters.append(History.created_at >= naive_utc(date_start))
+  if date_end:
+    filters.append(History.created_at <= naive_utc(date_end))
+  return filters
+
+@router.get("/", response_model=list[DashboardItem])
 async def get_dashboard(
+  request: Request,
+  response: Response,
   user=Depends(get_current_user),
-  db: Session = Depends(get_db),
+  db: AsyncSession = Depends(get_db),
   type: Optional[str] = None,
   keyword: Optional[str] = None,
-  date_start: Optional[str] = None,
-  date_end: Optional[str] = None
+  date_start: Optional[datetime] = Query(None, description="ISO date or datetime (UTC unless an offset is given)"),
+  date_end: Optional[datetime] = Query(None, description="ISO date or datetime, inclusive"),
+  limit: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=DASHBOARD_MAX_PAGE_SIZE),
+  cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header")
 ):
-  query = db.query(History).filter(History.user_id == user.id)
+  """Newest-first page of the user's history; X-Next-Cursor holds the cursor for the next page.
+  Send the page's ETag back as If-None-Match to get a 304 while it is unchanged."""
+  await history_writer.sync_user(user.id)
+  query = select(History).where(*history_filters(user.id, type, keyword, date_start, date_end))
+  rows = (await db.execute(paginate(query, cursor, limit))).scalars().all()
+  items, next_cursor = split_page(rows, limit)
+  # Only image URLs are needed up front; other stored results are skipped on a 304
+  bodies = await result_store.fetch(db, [item for item in items if item.type == "image"])
+  digests = await thumbnail_digests(items, bodies)
+  if next_cursor:
+    response.headers["X-Next-Cursor"] = next_cursor
+  cached = not_modified(request, response, page_etag(items, sorted(digests.values()), next_cursor))
+  if cached:
+    return cached
+  return with_thumbnails(items, digests, await result_store.fetch(db, items, bodies))
+
+@router.get("/search", response_model=list[DashboardItem])
+async def search_dashboard(
+  q: str = Query(..., min_length=1, description="Words to find in queries and results"),
+  user=Depends(get_current_user),
+  db: AsyncSession = Depends(get_db),
+  type: Optional[str] = None,
+  limit: int = Query(20, ge=1, le=DASHBOARD_MAX_PAGE_SIZE)
+):
+  """Full-text search over the user's history, best match first"""
+  if not q.strip():
+    raise HTTPException(status_code=400, detail="Search text is required")
+  await history_writer.sync_user(user.id)
+  query = select(History).where(History.user_id == user.id)
   if type:
-    query = query.filter(History.type == type)
-  if keyword:
-    query = query.filter(History.query.contains(keyword) or History.result.contains(keyword))
-  if date_start:
-    query = query.filter(History.created_at >= date_start)
-  if date_end:
-    query = query.filter(History.created_at <= date_end)
-  return query.all()
+    query = query.where(History.type == type)
+  query = fulltext.ranked(query, q).limit(limit)
+  items = (await db.execute(query)).scalars().all()
+  bodies = await result_store.fetch(db, items)
+  return with_thumbnails(items, await thumbnail_digests(items, bodies), bodies)
+
+@router.get("/export")
+async def export_dashboard(
+  user=Depends(get_current_user),
+  format: ExportFormat = "ndjson",
+  gzip: bool = False,
+  type: Optional[str] = None,
+  keyword: Optional[str] = None,
+  date_start: Optional[datetime] = Query(None, description="ISO date or datetime (UTC unless an offset is given)"),
+  date_end: Optional[datetime] = Query(None, description="ISO date or datetime, inclusive")
+):
+  """Stream the user's full history (oldest first) as NDJSON or CSV, optionally gzipped"""
+  await history_writer.sync_user(user.id)
+  filters = history_filters(user.id, type, keyword, date_start, date_end)
+  return export_response(filters, f"history-{user.username}", format, gzip)
 
-@router.put("/{id}")
-async def update_dashboard(id: int, update_data: dict, user=Depends(get_current_user), db: Session = Depends(get_db)):
-  history = db.query(History).filter(History.id == id, History.user_id == user.id).first()
+@router.put("/{id}", response_model=DashboardItem)
+async def update_dashboard(id: int, update_data: dict, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+  await history_writer.sync_user(user.id)
+  history = (await db.execute(select(History).where(History.id == id, History.user_id == user.id))).scalar_one_or_none()
   if not history:
     raise HTTPException(status_code=404, detail="Entry not found")
   
   if 'query' in update_data:
     history.query = update_data['query']
   if 'result' in update_data:
+    # Edited text is kept inline; `python result_store.py migrate` moves it later
     history.result = update_data['result']
+    history.result_hash = None
     
-  db.commit()
-  db.refresh(history)
-  return history
+  await db.commit()
+  await db.refresh(history)
+  # Serialized as the listing does, so the entry can replace the listed one as is
+  bodies = await result_store.fetch(db, [history])
+  return with_thumbnails([history], await thumbnail_digests([history], bodies), bodies)[0]
 
 @router.delete("/{id}")
-async def delete_dashboard(id: int, user=Depends(get_current_user), db: Session = Depends(get_db)):
-  history = db.query(History).filter(History.id == id, History.user_id == user.id).first()
+async def delete_dashboard(id: int, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+  await history_writer.sync_user(user.id)
+  history = (await db.execute(select(History).where(History.id == id, History.user_id == user.id))).scalar_one_or_none()
   if not history:
     raise HTTPException(status_code=404, detail="Entry not found")
-  db.delete(history)
-  db.commit()
+  await db.delete(history)
+  await db.commit()
   return {"detail": "Entry deleted"}
\ No newline at end of file
@@ -1,91 +1,166 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from schemas import ImageRequest, HistoryResponse
-from models import History
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import ImageRequest, ImageJobRequest, HistoryResponse
 from database import get_db
 from dependencies import get_current_user
-import mcp
-from mcp.client.streamable_http import streamablehttp_client
+from jobs import JobQueue, QueueFull
+from mcp_pool import get_pool
+from cache import normalize_query, make_key
+from singleflight import image_flight
+from history_writer import history_writer
+from image_store import image_store
+from upstream import Upstream, CircuitOpen, DeadlineExceeded, local_wait
+import math
 import os
 import logging
-from dotenv import load_dotenv
+from settings import get_settings, load_env
 import json
 
-load_dotenv()
+load_env()
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-FLUX_API_URL = "https://server.smithery.ai/@falahg/flux-imagegen-mcp-server/mcp"
-API_KEY = os.getenv("FLUX_API_KEY")  # Fallback to example key
+FLUX_API_URL = get_settings().flux_api_url
+API_KEY = get_settings().flux_api_key
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "4"))
+IMAGE_JOB_MAX_QUEUE = int(os.getenv("IMAGE_JOB_MAX_QUEUE", "100"))
+IMAGE_JOB_RESULT_TTL = float(os.getenv("IMAGE_JOB_RESULT_TTL", "3600"))
+IMAGE_JOB_SSE_KEEPALIVE = float(os.getenv("IMAGE_JOB_SSE_KEEPALIVE", "15"))
+FLUX_DEADLINE = float(os.getenv("FLUX_DEADLINE", "90"))
+FLUX_RETRIES = int(os.getenv("FLUX_RETRIES", "1"))
+FLUX_HEDGE = os.getenv("FLUX_HEDGE", "false").lower() == "true"
 
-async def generate_image(prompt: str):
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="FLUX_API_KEY not found in .env file")
+def _flux_retryable(e: Exception) -> bool:
+    """Session and transport failures; a tool error or a bad answer is returned as is"""
+    return not isinstance(e, HTTPException)
+
+# A hedged image costs a second generation, so hedging is opt-in
+flux_upstream = Upstream("flux", FLUX_DEADLINE, FLUX_RETRIES, _flux_retryable, hedge=FLUX_HEDGE)
 
-    url = f"{FLUX_API_URL}?api_key={API_KEY}"
-    logger.info(f"Connecting to Flux MCP at {url}")
+def flux_url() -> str:
+    return f"{FLUX_API_URL}?api_key={API_KEY}"
+
+async def _call_flux(prompt: str):
+    pool = get_pool()
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Flux MCP session pool is not running")
 
     try:
-        async with streamablehttp_client(url) as (read_stream, write_stream, _):
-            logger.info("streamablehttp_client started")
-            async with mcp.ClientSession(read_stream, write_stream) as session:
-                logger.info("MCP session created")
-                await session.initialize()
-                logger.info("Session initialized")
-                tools_result = await session.list_tools()
-                logger.info(f"Available tools: {[tool.name for tool in tools_result.tools]}")
-
-                if not tools_result.tools:
-                    raise HTTPException(status_code=500, detail="No tools available from Flux MCP")
+        # Use the tool named 'generateImageUrl' based on log
+        tool_name = "generateImageUrl"
 
-                # Use the tool named 'generateImageUrl' based on log
-                tool_name = "generateImageUrl"
-                result = await session.call_tool(
+        async def call():
+            # Only the MCP round trip runs while holding a pooled session; waiting for one
+            # is not charged to Flux's latency or breaker
+            async with pool.acquire(local_wait) as conn:
+                if not conn.tools:
+                    raise HTTPException(status_code=500, detail="No tools available from Flux MCP")
+                return await conn.session.call_tool(
                     name=tool_name,
                     arguments={"prompt": prompt}
                 )
-                logger.info(f"Response from {tool_name}: {result}")
-
-                if not result or result.isError:
-                    raise HTTPException(status_code=500, detail=f"No valid response from {tool_name}: {result.error if result.isError else 'No result'}")
-
-                # Parse the JSON string from TextContent
-                if result.content and len(result.content) > 0 and hasattr(result.content[0], 'text'):
-                    json_str = result.content[0].text
-                    try:
-                        data = json.loads(json_str)
-                        image_url = data.get("imageUrl")
-                        if not image_url:
-                            raise HTTPException(status_code=500, detail=f"No imageUrl in response from {tool_name}: {data}")
-                        return image_url
-                    except json.JSONDecodeError as e:
-                        raise HTTPException(status_code=500, detail=f"Failed to parse JSON response: {str(e)}")
-                else:
-                    raise HTTPException(status_code=500, detail=f"No valid content in response from {tool_name}")
 
+        result = await flux_upstream.call(call)
+        logger.info(f"Response from {tool_name}: {result}")
+
+        if not result or result.isError:
+            error = result.content[0].text if result and result.content and hasattr(result.content[0], 'text') else 'No result'
+            raise HTTPException(status_code=500, detail=f"No valid response from {tool_name}: {error}")
+
+        # Parse the JSON string from TextContent
+        if result.content and len(result.content) > 0 and hasattr(result.content[0], 'text'):
+            json_str = result.content[0].text
+            try:
+                data = json.loads(json_str)
+                image_url = data.get("imageUrl")
+                if not image_url:
+                    raise HTTPException(status_code=500, detail=f"No imageUrl in response from {tool_name}: {data}")
+                return image_url
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=500, detail=f"Failed to parse JSON response: {str(e)}")
+        else:
+            raise HTTPException(status_code=500, detail=f"No valid content in response from {tool_name}")
+
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=f"Image generation failed: {e}", headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Image generation failed: {e}")
     except Exception as e:
         logger.exception("Exception occurred in generate_image")
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
 
+async def generate_image(prompt: str):
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="FLUX_API_KEY not found in .env file")
+
+    # Identical prompts already in flight share one upstream call
+    image_url = await image_flight.do(make_key("flux", normalize_query(prompt)), lambda: _call_flux(prompt))
+    # Keep a local copy and thumbnail; the upstream link may expire. This is the only place images
+    # are fetched, and only URLs on IMAGE_STORE_ALLOWED_HOSTS are (History rows can be edited)
+    image_store.schedule(image_url)
+    return image_url
+
 @router.post("/generate")
-async def generate_image_endpoint(request: ImageRequest, user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def generate_image_endpoint(request: ImageRequest, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     try:
         result = await generate_image(request.prompt)
-        history = History(
-            user_id=user.id,
-            type="image",
-            query=request.prompt,
-            result=result,
-        )
-        db.add(history)
-        db.commit()
-        db.refresh(history)
+        await history_writer.record([{"user_id": user.id, "type": "image", "query": request.prompt, "result": result}], db)
         return {"image_url": result}
     except HTTPException as e:
         raise e
     except Exception as e:
         logger.error(f"Error in generate_image_endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+
+async def _run_image_job(job):
+    result = await generate_image(job.prompt)
+    await history_writer.record([{"user_id": job.user_id, "type": "image", "query": job.prompt, "result": result}])
+    return result
+
+image_jobs = JobQueue("image", _run_image_job, IMAGE_JOB_WORKERS, IMAGE_JOB_MAX_QUEUE, IMAGE_JOB_RESULT_TTL)
+
+async def _get_job(job_id: str, user):
+    job = await image_jobs.get(job_id)
+    if job is None or (job.user_id != user.id and user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs", status_code=202)
+async def submit_image_job(request: ImageJobRequest, user=Depends(get_current_user)):
+    """Queue an image generation and return its job id without waiting for Flux"""
+    try:
+        job = await image_jobs.submit(user.id, request.prompt, request.priority)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Image queue is full, try again later", headers={"Retry-After": "5"})
+    return image_jobs.describe(job)
+
+@router.get("/jobs/{job_id}")
+async def get_image_job(job_id: str, user=Depends(get_current_user)):
+    """Current status of an image job; result holds the image URL once it has succeeded"""
+    return image_jobs.describe(await _get_job(job_id, user))
+
+@router.delete("/jobs/{job_id}")
+async def cancel_image_job(job_id: str, user=Depends(get_current_user)):
+    """Cancel a queued or running image job"""
+    job = await _get_job(job_id, user)
+    if not await image_jobs.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return {"detail": "Job cancelled"}
+
+@router.get("/jobs/{job_id}/events")
+async def image_job_events(job_id: str, user=Depends(get_current_user)):
+    """Server-Sent Events stream of job status changes, closed once the job finishes"""
+    job = await _get_job(job_id, user)
+
+    async def events():
+        async for state in image_jobs.watch(job, IMAGE_JOB_SSE_KEEPALIVE):
+            if state is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
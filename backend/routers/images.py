@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from image_store import image_store, sniff_media_type, DIGEST_RE
+from conditional import etag_matches
+import asyncio
+import logging
+import os
+import re
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Content-addressed bytes never change under a URL
+IMMUTABLE = "public, max-age=31536000, immutable"
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _stat(path: str):
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(16)
+    except FileNotFoundError:
+        return None
+    image_store.touch(path)
+    return size, sniff_media_type(head) or "application/octet-stream"
+
+def _read(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+async def _serve(request: Request, path: str, etag: str):
+    stat = await asyncio.to_thread(_stat, path)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    size, media_type = stat
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    # Single byte ranges only; anything else gets the whole file, as RFC 9110 allows
+    match = RANGE_RE.match(request.headers.get("range", ""))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        if start >= size or start > end:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        data = await asyncio.to_thread(_read, path, start, end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(content=data, status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+def _check_digest(digest: str):
+    if not DIGEST_RE.match(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+@router.get("/{digest}")
+async def get_image(digest: str, request: Request):
+    """Stored image by content digest; digests are unguessable, so no token is needed for <img>"""
+    _check_digest(digest)
+    return await _serve(request, image_store.object_path(digest), f'"{digest}"')
+
+@router.get("/{digest}/thumbnail")
+async def get_thumbnail(digest: str, request: Request):
+    """Downscaled JPEG of a stored image, or the original when no thumbnail was made"""
+    _check_digest(digest)
+    path = image_store.thumbnail_path(digest)
+    if await asyncio.to_thread(os.path.exists, path):
+        return await _serve(request, path, f'"{digest}-thumb"')
+    return await _serve(request, image_store.object_path(digest), f'"{digest}"')
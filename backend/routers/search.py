@@ -1,67 +1,176 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from schemas import SearchRequest, HistoryResponse
-from models import History
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import SearchRequest, BatchSearchRequest, HistoryResponse
 from database import get_db
 from dependencies import get_current_user
+from http_client import get_client
+from cache import search_cache, normalize_query, make_key
+from singleflight import search_flight
+from history_writer import history_writer
+from upstream import Upstream, CircuitOpen, DeadlineExceeded, local_wait
+import asyncio
 import httpx
+import json
+import math
 import os
 import logging
-from dotenv import load_dotenv
+from settings import get_settings, load_env
 
-load_dotenv()
+load_env()
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-TAVILY_API_URL = "https://api.tavily.com/search"
-API_KEY = os.getenv("TAVILY_API_KEY")
+TAVILY_API_URL = get_settings().tavily_api_url
+API_KEY = get_settings().tavily_api_key
+SEARCH_BATCH_CONCURRENCY = int(os.getenv("SEARCH_BATCH_CONCURRENCY", "5"))
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "50"))
+TAVILY_DEADLINE = float(os.getenv("TAVILY_DEADLINE", "15"))
+TAVILY_RETRIES = int(os.getenv("TAVILY_RETRIES", "2"))
+TAVILY_HEDGE = os.getenv("TAVILY_HEDGE", "false").lower() == "true"
 
-async def query_tavily(query: str):
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="TAVILY_API_KEY not found in .env file")
+def _tavily_retryable(e: Exception) -> bool:
+    """Network errors, timeouts, 429 and 5xx; other 4xx would fail again"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+# Searches are idempotent, so they may be hedged
+tavily_upstream = Upstream("tavily", TAVILY_DEADLINE, TAVILY_RETRIES, _tavily_retryable, hedge=TAVILY_HEDGE)
+
+# Running batches; a batch finishes and saves its history even if the client disconnects
+_batches: set[asyncio.Task] = set()
 
+async def _call_tavily(query: str, search_depth: str, max_results: int):
     payload = {
         "api_key": API_KEY,
         "query": query,
-        "search_depth": "basic",
-        "max_results": 5,
+        "search_depth": search_depth,
+        "max_results": max_results,
         "include_answer": True
     }
     logger.info(f"Querying Tavily API with payload: {payload}")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(TAVILY_API_URL, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            logger.info(f"Tavily API response: {data}")
-            return data.get("answer") or data.get("results", [{}])[0].get("content", "No summary available")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error from Tavily API: {e.response.text}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"Search failed: {e.response.text}")
-        except Exception as e:
-            logger.exception("Exception occurred in query_tavily")
-            raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    async def post():
+        # Until httpx connects or sends, the request is waiting for a pooled connection; that
+        # wait (and a PoolTimeout) is not charged to Tavily's latency or breaker
+        with local_wait() as wait:
+            async def trace(event_name, info):
+                wait.end()
+
+            response = await get_client().post(TAVILY_API_URL, json=payload, extensions={"trace": trace})
+        response.raise_for_status()
+        return response
+
+    try:
+        response = await tavily_upstream.call(post)
+        data = response.json()
+        logger.info(f"Tavily API response: {data}")
+        return data.get("answer") or data.get("results", [{}])[0].get("content", "No summary available")
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=f"Search failed: {e}", headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Search failed: {e}")
+    except httpx.PoolTimeout:
+        raise HTTPException(status_code=503, detail="Search failed: too many searches in progress", headers={"Retry-After": "1"})
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error from Tavily API: {e.response.text}")
+        raise HTTPException(status_code=e.response.status_code, detail=f"Search failed: {e.response.text}")
+    except Exception as e:
+        logger.exception("Exception occurred in query_tavily")
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+async def query_tavily(query: str, search_depth: str = "basic", max_results: int = 5, bypass_cache: bool = False):
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="TAVILY_API_KEY not found in .env file")
+
+    cache_key = make_key("tavily", normalize_query(query), search_depth, max_results)
+    if not bypass_cache:
+        cached = await search_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Search cache hit for query: {query}")
+            return cached
+
+    # Identical queries already in flight share one upstream call
+    summary = await search_flight.do(cache_key, lambda: _call_tavily(query, search_depth, max_results))
+
+    # A bypassed lookup still refreshes the cached entry
+    await search_cache.set(cache_key, summary)
+    return summary
 
 @router.post("/query")
-async def search_query(request: SearchRequest, user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def search_query(request: SearchRequest, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     try:
-        result = await query_tavily(request.query)
-        history = History(
-            user_id=user.id,
-            type="search",
-            query=request.query,
-            result=result,
+        result = await query_tavily(
+            request.query,
+            search_depth=request.search_depth,
+            max_results=request.max_results,
+            bypass_cache=request.bypass_cache,
         )
-        db.add(history)
-        db.commit()
-        db.refresh(history)
+        await history_writer.record([{"user_id": user.id, "type": "search", "query": request.query, "result": result}], db)
         return {"result": result}
     except HTTPException as e:
         raise e
     except Exception as e:
         logger.error(f"Error in search_query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+async def _search_one(index: int, query: str, request: BatchSearchRequest, semaphore: asyncio.Semaphore, out: asyncio.Queue):
+    async with semaphore:
+        try:
+            result = await query_tavily(
+                query,
+                search_depth=request.search_depth,
+                max_results=request.max_results,
+                bypass_cache=request.bypass_cache,
+            )
+            item = {"index": index, "query": query, "result": result}
+        except HTTPException as e:
+            item = {"index": index, "query": query, "error": e.detail, "status_code": e.status_code}
+        except Exception as e:
+            logger.exception("Exception occurred in batch search")
+            item = {"index": index, "query": query, "error": f"Search failed: {str(e)}", "status_code": 500}
+    out.put_nowait(item)
+    return item
+
+async def _run_batch(user_id: int, request: BatchSearchRequest, out: asyncio.Queue):
+    semaphore = asyncio.Semaphore(SEARCH_BATCH_CONCURRENCY)
+    items = await asyncio.gather(*(
+        _search_one(index, query, request, semaphore, out) for index, query in enumerate(request.queries)
+    ))
+    rows = [
+        {"user_id": user_id, "type": "search", "query": item["query"], "result": item["result"]}
+        for item in items if "result" in item
+    ]
+    saved = 0
+    if rows:
+        try:
+            # One multi-row INSERT for the whole batch
+            await history_writer.record(rows)
+            saved = len(rows)
+        except Exception:
+            logger.exception("Saving batch search history failed")
+    out.put_nowait({"done": True, "succeeded": len(rows), "failed": len(items) - len(rows), "saved": saved})
+
+@router.post("/batch")
+async def search_batch(request: BatchSearchRequest, user=Depends(get_current_user)):
+    """Run several searches concurrently and stream NDJSON lines as each one finishes"""
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch")
+
+    out: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(_run_batch(user.id, request, out))
+    _batches.add(task)
+    task.add_done_callback(_batches.discard)
+
+    async def lines():
+        while True:
+            item = await out.get()
+            yield json.dumps(item) + "\n"
+            if item.get("done"):
+                return
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
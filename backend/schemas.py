@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import Literal
 
 class UserCreate(BaseModel):
     username: str
@@ -11,7 +12,14 @@ class UserResponse(BaseModel):
     username: str
     role: str
     class Config:
-        orm_mode = True  # Enables SQLAlchemy ORM compatibility
+        from_attributes = True  # Enables SQLAlchemy ORM compatibility
+
+class BulkRoleChange(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1)
+    role: Literal["user", "admin"]
+
+class BulkUserDelete(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1)
 
 class Token(BaseModel):
     access_token: str
@@ -19,10 +27,22 @@ class Token(BaseModel):
 
 class SearchRequest(BaseModel):
     query: str
+    search_depth: Literal["basic", "advanced"] = "basic"
+    max_results: int = Field(5, ge=1, le=20)
+    bypass_cache: bool = False  # Skip the cached result and refresh it
+
+class BatchSearchRequest(BaseModel):
+    queries: list[str] = Field(..., min_length=1)
+    search_depth: Literal["basic", "advanced"] = "basic"
+    max_results: int = Field(5, ge=1, le=20)
+    bypass_cache: bool = False
 
 class ImageRequest(BaseModel):
     prompt: str
 
+class ImageJobRequest(ImageRequest):
+    priority: Literal["high", "normal", "low"] = "normal"
+
 class HistoryBase(BaseModel):
     type: str
     query: str
@@ -35,6 +55,15 @@ class HistoryCreate(HistoryBase):
 class HistoryResponse(HistoryBase):
     id: int
     user_id: int
-    timestamp: datetime
+    created_at: datetime
+    updated_at: datetime | None = None
     class Config:
-        orm_mode = True
\ No newline at end of file
+        from_attributes = True
+
+class DashboardItem(HistoryResponse):
+    thumbnail_url: str | None = None  # set once the image is in the local store
+
+class UserHistoryResponse(BaseModel):
+    user: UserResponse
+    history: list[HistoryResponse]
+    total_count: int
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Production launcher: several uvicorn worker processes sharing one socket.
+
+    python serve.py                        # WEB_CONCURRENCY workers (default: one per CPU) on :8000
+    python serve.py --workers 8 --port 8080
+
+- Uses uvloop and httptools when installed (uvicorn[standard]).
+- Imports the app once before any worker starts. A bad .env or an import
+  error then fails here, once, not in every worker. Workers still import
+  the app themselves: uvicorn spawns rather than forks them, because the app
+  holds thread pools and connection pools that must not be shared.
+- Splits DB_MAX_CONNECTIONS (this app's share of the database's connection
+  limit) into a per-worker DB_POOL_SIZE and DB_MAX_OVERFLOW, unless those
+  are set explicitly.
+- On SIGTERM or SIGINT, stops accepting connections and gives in-flight
+  requests up to --graceful-timeout seconds. It then runs the app's
+  shutdown (flushes buffered history, closes pools) and exits. A worker
+  that dies or hangs is replaced.
+- Workers log straight to the inherited stdout/stderr, with their pid on
+  each line. No pipes sit in between, so nothing can block on a full one.
+"""
+
+import argparse
+import copy
+import importlib.util
+import os
+import sys
+
+from settings import load_env
+
+load_env()
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "60"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+
+def pool_settings(workers: int) -> dict[str, str]:
+    """Per-worker pool size and overflow that keep all workers within DB_MAX_CONNECTIONS."""
+    per_worker = max(2, DB_MAX_CONNECTIONS // workers)
+    pool_size = (per_worker + 1) // 2
+    return {"DB_POOL_SIZE": str(pool_size), "DB_MAX_OVERFLOW": str(per_worker - pool_size)}
+
+
+def log_config(level: str) -> dict:
+    from uvicorn.config import LOGGING_CONFIG
+
+    config = copy.deepcopy(LOGGING_CONFIG)
+    config["formatters"]["default"]["fmt"] = "%(asctime)s [%(process)d] %(levelprefix)s %(name)s: %(message)s"
+    config["formatters"]["access"]["fmt"] = (
+        '%(asctime)s [%(process)d] %(levelprefix)s %(client_addr)s - "%(request_line)s" %(status_code)s'
+    )
+    # The app's own loggers go through the same handler and format
+    config["root"] = {"handlers": ["default"], "level": level.upper()}
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT, help="seconds to drain on shutdown")
+    parser.add_argument("--keep-alive", type=int, default=5, help="idle keep-alive timeout in seconds")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+
+    for name, value in pool_settings(args.workers).items():
+        os.environ.setdefault(name, value)
+
+    # Fail fast on configuration or import errors (workers inherit the environment set above)
+    sys.path.insert(0, BACKEND_DIR)
+    import main as app_module  # noqa: F401
+    from database import IS_SQLITE
+
+    import uvicorn
+
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "auto"
+    http = "httptools" if importlib.util.find_spec("httptools") else "auto"
+    pool = "no pool (SQLite)" if IS_SQLITE else f"db pool {os.environ['DB_POOL_SIZE']}+{os.environ['DB_MAX_OVERFLOW']} per worker"
+    print(f"Starting {args.workers} workers on {args.host}:{args.port} (loop={loop}, http={http}, {pool})", flush=True)
+    uvicorn.run(
+        "main:app",
+        app_dir=BACKEND_DIR,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        log_config=log_config(args.log_level),
+        log_level=args.log_level,
+        access_log=not args.no_access_log,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Process-wide settings, read once.
+
+load_env() reads .env into the environment the first time it is called;
+modules call it before reading their own tuning variables with os.getenv.
+get_settings() returns the shared connection and credential settings
+(database, JWT secret, upstream API keys) as one cached Settings object.
+Both read the environment on first use, so a launcher such as serve.py can
+set variables before the app is imported.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+@lru_cache(maxsize=None)
+def load_env():
+    """Load .env into os.environ once per process (set variables win)."""
+    load_dotenv()
+
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: str | None
+    db_sslmode: str  # PostgreSQL only: disable, allow, prefer, require, verify-ca or verify-full
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_timeout: float
+    secret_key: str | None
+    jwt_algorithm: str
+    tavily_api_url: str
+    tavily_api_key: str | None
+    flux_api_url: str
+    flux_api_key: str | None
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    load_env()
+    return Settings(
+        database_url=os.getenv("DATABASE_URL"),
+        db_sslmode=os.getenv("DB_SSLMODE", "require"),
+        # Connections per worker process; serve.py splits DB_MAX_CONNECTIONS across workers
+        db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        db_pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        secret_key=os.getenv("SECRET_KEY"),
+        jwt_algorithm="HS256",
+        tavily_api_url=os.getenv("TAVILY_API_URL", "https://api.tavily.com/search"),
+        tavily_api_key=os.getenv("TAVILY_API_KEY"),
+        flux_api_url=os.getenv("FLUX_API_URL", "https://server.smithery.ai/@falahg/flux-imagegen-mcp-server/mcp"),
+        flux_api_key=os.getenv("FLUX_API_KEY"),
+    )
@@ -0,0 +1,53 @@
+"""
+Single-flight coalescing of identical in-flight upstream calls.
+
+Concurrent callers with the same key await one shared task and receive its
+result or its exception. Nothing is kept once the call finishes, so this never
+serves stale data; it only caps upstream fan-out during bursts.
+"""
+
+import asyncio
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn):
+        """Run ``fn()`` once per key at a time and share the outcome with all waiters."""
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"Coalesced {self.name} call onto in-flight request")
+        else:
+            self.executed += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        # shield: a caller that disconnects must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
+
+
+search_flight = SingleFlight("search")
+image_flight = SingleFlight("image")
@@ -0,0 +1,116 @@
+"""
+Shared test setup: a throwaway database and the app.
+
+Tests run on a new SQLite file, or on TEST_DATABASE_URL when it is set
+(e.g. a scratch PostgreSQL database, whose tables are dropped first). The
+schema, full-text index and rollup triggers are installed once per session;
+each test registers its own users, so tests can share the database and the
+running app. The stand_in fixture runs the local Flux MCP and Tavily
+stand-ins (benchmarks/mock_upstreams.py).
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/test.sqlite3"
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def engine():
+    import database
+    import fulltext
+    import models  # noqa: F401  (registers the tables)
+    import partitions
+    import rollups
+
+    engine = database.get_engine()
+    database.Base.metadata.drop_all(engine)
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        partitions.install(conn)
+        fulltext.install(conn)
+        rollups.install(conn)
+    return engine
+
+
+@pytest.fixture(scope="session")
+def client(engine):
+    """The app with its lifespan running; started once, as shutdown stops the password hash pools."""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def register(client):
+    """register(role="user") -> a new user with .id, .username and auth .headers."""
+    def register(role: str = "user") -> SimpleNamespace:
+        username = f"{role}-{uuid.uuid4().hex[:12]}"
+        response = client.post("/auth/register", json={"username": username, "password": "pw", "role": role})
+        assert response.status_code == 200, response.text
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        user = client.get("/auth/validate", headers=headers).json()["user"]
+        return SimpleNamespace(id=user["id"], username=username, headers=headers)
+
+    return register
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StandIn:
+    def __init__(self):
+        self.flux_port = free_port()
+        self.tavily_port = free_port()
+        self.url = f"http://127.0.0.1:{self.flux_port}/mcp"
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.mock_upstreams",
+            "--flux-port", str(self.flux_port), "--tavily-port", str(self.tavily_port),
+            "--flux-latency", "0", "--tavily-latency", "0", "--jitter", "0",
+        ], cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("mock upstreams exited")
+            with socket.socket() as sock:
+                if sock.connect_ex(("127.0.0.1", self.flux_port)) == 0:
+                    return
+            time.sleep(0.1)
+        raise RuntimeError("mock Flux MCP server did not start")
+
+    def stop(self):
+        if self.process is not None:
+            # Killed rather than terminated: uvicorn would wait for the pool's open streams
+            self.process.kill()
+            self.process.wait(10)
+            self.process = None
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,54 @@
+"""Role changes revoke the user's tokens; admin routes see a demotion at once."""
+
+from sqlalchemy import update
+
+from models import User
+
+
+def login(client, user) -> dict:
+    response = client.post("/auth/login", data={"username": user.username, "password": "pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def status(client, headers) -> int:
+    return client.get("/auth/validate", headers=headers).status_code
+
+
+def test_role_change_revokes_tokens(client, register):
+    admin, user = register("admin"), register()
+
+    response = client.put(f"/admin/users/{user.id}/role", headers=admin.headers, json={"role": "admin"})
+    assert response.status_code == 200, response.text
+    assert status(client, user.headers) == 401
+    promoted = login(client, user)
+    assert client.get("/admin/image-jobs/stats", headers=promoted).status_code == 200
+
+    # Setting the same role again changes nothing
+    client.put(f"/admin/users/{user.id}/role", headers=admin.headers, json={"role": "admin"})
+    assert status(client, promoted) == 200
+
+    response = client.put(f"/admin/users/{user.id}", headers=admin.headers, json={"role": "user"})
+    assert response.status_code == 200, response.text
+    assert status(client, promoted) == 401
+    assert client.get("/admin/image-jobs/stats", headers=login(client, user)).status_code == 403
+
+
+def test_bulk_role_change_revokes_only_changed_users(client, register):
+    admin, changed, unchanged = register("admin"), register(), register("admin")
+
+    response = client.post("/admin/users/bulk/role", headers=admin.headers,
+                           json={"user_ids": [changed.id, unchanged.id], "role": "admin"})
+    assert response.json()["updated"] == 2, response.text
+    assert status(client, changed.headers) == 401
+    assert status(client, unchanged.headers) == 200
+
+
+def test_admin_routes_see_a_demotion_by_another_worker(client, engine, register):
+    admin = register("admin")
+    assert client.get("/admin/image-jobs/stats", headers=admin.headers).status_code == 200  # principal cached
+
+    # What another worker's role change leaves behind: the database changed, this cache did not
+    with engine.begin() as conn:
+        conn.execute(update(User).where(User.id == admin.id).values(role="user", token_version=User.token_version + 1))
+    assert client.get("/admin/image-jobs/stats", headers=admin.headers).status_code == 401
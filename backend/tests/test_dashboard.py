@@ -0,0 +1,71 @@
+"""Dashboard listing, export filters and edits, through the endpoints."""
+
+from datetime import datetime
+
+from sqlalchemy import insert
+
+import result_store
+from database import async_session
+from models import History
+
+
+def add_history(engine, user_id: int, *created: datetime) -> list[int]:
+    with engine.begin() as conn:
+        return [
+            conn.execute(insert(History).values(
+                user_id=user_id, type="search", query=f"query {moment:%d}", result="answer", created_at=moment,
+            )).inserted_primary_key[0]
+            for moment in created
+        ]
+
+
+def test_date_filters(client, engine, register):
+    user = register()
+    first, second, third = add_history(
+        engine, user.id, datetime(2024, 1, 1, 12), datetime(2024, 1, 2, 12), datetime(2024, 1, 3, 12),
+    )
+
+    # What the dashboard sends: a day, and the end of a day
+    response = client.get("/dashboard/", headers=user.headers,
+                          params={"date_start": "2024-01-02", "date_end": "2024-01-02T23:59:59"})
+    assert response.status_code == 200, response.text
+    assert [item["id"] for item in response.json()] == [second]
+
+    # An offset is converted to UTC: 2024-01-02T14:00+02:00 is noon UTC
+    response = client.get("/dashboard/", headers=user.headers, params={"date_start": "2024-01-02T14:00:00+02:00"})
+    assert [item["id"] for item in response.json()] == [third, second]
+
+    response = client.get("/dashboard/export", headers=user.headers, params={"date_end": "2024-01-01T23:59:59"})
+    assert response.status_code == 200, response.text
+    assert f'"id": {first},' in response.text and f'"id": {second},' not in response.text
+
+
+def test_invalid_date_is_rejected(client, register):
+    user = register()
+    for path in ("/dashboard/", "/dashboard/export"):
+        response = client.get(path, headers=user.headers, params={"date_start": "last tuesday"})
+        assert response.status_code == 422
+
+
+def test_update_returns_the_entry_as_listed(client, register):
+    user = register()
+    stored = "A long answer kept in the result store. " * 10
+
+    async def record():
+        async with async_session() as db:
+            await db.execute(insert(History), await result_store.store(db, [
+                {"user_id": user.id, "type": "search", "query": "old", "result": stored},
+            ]))
+            await db.commit()
+
+    client.portal.call(record)
+    (entry,) = client.get("/dashboard/", headers=user.headers).json()
+
+    # Only the query changes: the result still comes from the store
+    response = client.put(f"/dashboard/{entry['id']}", headers=user.headers, json={"query": "new"})
+    assert response.status_code == 200, response.text
+    updated = response.json()
+    assert "result_hash" not in updated
+    assert updated["query"] == "new" and updated["result"] == stored
+    (listed,) = client.get("/dashboard/", headers=user.headers).json()
+    assert updated == listed
@@ -0,0 +1,60 @@
+"""
+Full-text index upkeep: rows written, edited or deleted in the database are
+found (or no longer found) by /dashboard/search straight away.
+
+Rows are changed with plain SQL, so only the database keeps the index
+current: the SQLite triggers, or the generated column on PostgreSQL.
+"""
+
+from sqlalchemy import delete, insert, update
+
+import result_store
+from database import async_session
+from models import History
+
+
+def found(client, user, words: str) -> list[int]:
+    response = client.get("/dashboard/search", headers=user.headers, params={"q": words})
+    assert response.status_code == 200, response.text
+    return [item["id"] for item in response.json()]
+
+
+def test_index_follows_inserts_updates_and_deletes(client, engine, register):
+    user = register()
+    with engine.begin() as conn:
+        penguins, kettles = (
+            conn.execute(insert(History).values(user_id=user.id, type="search", query=query, result=result)).inserted_primary_key[0]
+            for query, result in [("how do penguins swim", "they paddle with flippers"), ("descale a kettle", "vinegar")]
+        )
+
+    assert found(client, user, "penguin") == [penguins]  # stemmed
+    assert found(client, user, "flippers") == [penguins]  # the result is indexed too
+    assert found(client, user, "vinegar kettle") == [kettles]
+    assert found(client, user, "penguin vinegar") == []  # every word must match
+
+    with engine.begin() as conn:
+        conn.execute(update(History).where(History.id == penguins).values(query="how do seals swim"))
+    assert found(client, user, "penguin") == []
+    assert found(client, user, "seals") == [penguins]
+
+    with engine.begin() as conn:
+        conn.execute(delete(History).where(History.id == kettles))
+    assert found(client, user, "kettle") == []
+
+
+def test_stored_results_are_found(client, register):
+    user = register()
+    text = "The wandering albatross has the longest wingspan of any living bird. " * 5
+    assert len(text) >= result_store.RESULT_STORE_MIN_BYTES
+
+    async def record():
+        async with async_session() as db:
+            await db.execute(insert(History), await result_store.store(db, [
+                {"user_id": user.id, "type": "search", "query": "largest seabird", "result": text},
+            ]))
+            await db.commit()
+
+    client.portal.call(record)
+    ids = found(client, user, "albatross wingspan")
+    assert len(ids) == 1
+    assert found(client, user, "seabird") == ids
@@ -0,0 +1,147 @@
+"""
+Write-behind History buffer: flushing, its size bound, and batches the
+database rejects or cannot take.
+
+Writers run on the app's event loop (client.portal), where the async
+engine lives.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from history_writer import HistoryWriter
+from models import History
+
+
+def saved(engine, user_id: int) -> list[str]:
+    with engine.connect() as conn:
+        return conn.scalars(select(History.query).where(History.user_id == user_id).order_by(History.id)).all()
+
+
+def row(user_id: int, query: str, **extra) -> dict:
+    return {"user_id": user_id, "type": "search", "query": query, "result": "answer", **extra}
+
+
+def make_writer(tmp_path, **kwargs) -> HistoryWriter:
+    # Flushes are driven by the tests: the interval never passes
+    return HistoryWriter(True, flush_size=1000, flush_interval=3600,
+                         dead_letter_file=str(tmp_path / "dead.ndjson"), **kwargs)
+
+
+def dead_letters(tmp_path) -> list[dict]:
+    path = tmp_path / "dead.ndjson"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_rows_are_buffered_until_flushed(client, engine, register, tmp_path):
+    user, writer = register(), make_writer(tmp_path)
+
+    async def run():
+        await writer.start()
+        await writer.record([row(user.id, "one"), row(user.id, "two")])
+        assert saved(engine, user.id) == []
+        await writer.sync_user(user.id)
+        assert saved(engine, user.id) == ["one", "two"]
+        await writer.record([row(user.id, "three")])
+        await writer.stop()  # flushes what is left
+
+    client.portal.call(run)
+    assert saved(engine, user.id) == ["one", "two", "three"]
+    assert writer.stats()["pending"] == 0 and writer.flushed_rows == 3
+
+
+def test_cancelled_sync_user_still_saves_the_rows(client, engine, register, tmp_path):
+    user, writer = register(), make_writer(tmp_path)
+
+    async def run():
+        await writer.start()
+        await writer.record([row(user.id, "kept")])
+        reader = asyncio.create_task(writer.sync_user(user.id))
+        await asyncio.sleep(0)
+        reader.cancel()  # e.g. the client disconnected mid-read
+        await asyncio.gather(reader, return_exceptions=True)
+        await writer.flush()
+        assert saved(engine, user.id) == ["kept"]
+        await writer.stop()
+
+    client.portal.call(run)
+    assert writer.flushed_rows == 1
+
+
+def test_full_buffer_writes_directly(client, engine, register, tmp_path):
+    user, writer = register(), make_writer(tmp_path, max_pending=2)
+
+    async def run():
+        await writer.start()
+        await writer.record([row(user.id, "a"), row(user.id, "b")])
+        await writer.record([row(user.id, "c")])
+        assert saved(engine, user.id) == ["c"]
+        assert writer.stats()["pending"] == 2
+        await writer.stop()
+
+    client.portal.call(run)
+    assert sorted(saved(engine, user.id)) == ["a", "b", "c"]
+    assert writer.direct_writes == 1
+
+
+def test_rejected_row_is_dead_lettered_and_the_rest_saved(client, engine, register, tmp_path):
+    user, writer = register(), make_writer(tmp_path)
+    created = datetime(2024, 5, 1, 12)
+
+    async def run():
+        await writer.record([row(user.id, "existing", created_at=created)])  # written directly
+        with engine.connect() as conn:
+            existing = conn.scalar(select(func.max(History.id)).where(History.user_id == user.id))
+        await writer.start()
+        good = [row(user.id, f"good {i}") for i in range(6)]
+        poison = row(user.id, "poison", id=existing, created_at=created)  # duplicate primary key
+        await writer.record(good[:3] + [poison] + good[3:])
+        await writer.flush()
+        await writer.stop()
+
+    client.portal.call(run)
+    assert saved(engine, user.id) == ["existing"] + [f"good {i}" for i in range(6)]
+    letters = dead_letters(tmp_path)
+    assert [letter["row"]["query"] for letter in letters] == ["poison"]
+    assert writer.dead_letters == 1 and writer.stats()["pending"] == 0
+
+
+def test_failing_flush_is_retried_then_dead_lettered(client, engine, register, tmp_path, monkeypatch):
+    user, writer = register(), make_writer(tmp_path, flush_retries=2)
+    insert = writer._insert
+    outage = {"left": 0}
+
+    async def flaky_insert(rows, db=None):
+        if outage["left"]:
+            outage["left"] -= 1
+            raise OperationalError("INSERT INTO history", {}, ConnectionError("database is down"))
+        await insert(rows, db)
+
+    monkeypatch.setattr(writer, "_insert", flaky_insert)
+
+    async def run():
+        await writer.start()
+        # A short outage: the rows wait in the buffer and are saved once it is over
+        outage["left"] = 2
+        await writer.record([row(user.id, "survives")])
+        for _ in range(3):
+            await writer.flush()
+        assert saved(engine, user.id) == ["survives"]
+
+        # A long one: after flush_retries retries the batch is dead-lettered, freeing the buffer
+        outage["left"] = 10
+        await writer.record([row(user.id, "lost")])
+        for _ in range(3):
+            await writer.flush()
+        assert writer.stats()["pending"] == 0
+        outage["left"] = 0
+        await writer.stop()
+
+    client.portal.call(run)
+    assert saved(engine, user.id) == ["survives"]
+    assert [letter["row"]["query"] for letter in dead_letters(tmp_path)] == ["lost"]
+    assert writer.failed_flushes == 5
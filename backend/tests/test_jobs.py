@@ -0,0 +1,170 @@
+"""
+Image job queue: the endpoints against the Flux stand-in, queue order and
+limits, and job state shared between workers through the jobs table.
+
+Two JobQueue instances with the same name stand in for two worker
+processes. Queues run on the app's event loop (client.portal), where the
+async engine lives.
+"""
+
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import select
+
+import mcp_pool
+from jobs import JobQueue, QueueFull
+from models import History
+from routers import image
+
+
+async def until(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def seen_by(queue: JobQueue, job_id: str, status: str):
+    """Wait until ``queue`` reads ``status`` for the job from the table (the owner saves it just after)."""
+    deadline = time.monotonic() + 10
+    while (job := await queue.get(job_id)).status != status:
+        assert time.monotonic() < deadline, job
+        await asyncio.sleep(0.01)
+    return job
+
+
+class Gated:
+    """A runner that records the prompts it starts and waits for .gate to open."""
+
+    def __init__(self):
+        self.started = []
+        self.gate = asyncio.Event()
+
+    async def __call__(self, job):
+        self.started.append(job.prompt)
+        await self.gate.wait()
+        return job.prompt.upper()
+
+
+def test_image_job_endpoints(client, engine, register, stand_in, monkeypatch):
+    monkeypatch.setattr(image, "API_KEY", "test")
+    monkeypatch.setattr(image, "FLUX_API_URL", stand_in.url)
+    client.portal.call(mcp_pool.start_pool, image.flux_url())
+    try:
+        user, other = register(), register()
+        response = client.post("/image/jobs", headers=user.headers, json={"prompt": "a red fox", "priority": "high"})
+        assert response.status_code == 202, response.text
+        job_id = response.json()["job_id"]
+
+        deadline = time.monotonic() + 10
+        while (state := client.get(f"/image/jobs/{job_id}", headers=user.headers).json())["status"] != "succeeded":
+            assert state["status"] in ("queued", "running") and time.monotonic() < deadline, state
+            time.sleep(0.05)
+        assert state["result"].endswith(".png") and state["priority"] == "high"
+
+        events = client.get(f"/image/jobs/{job_id}/events", headers=user.headers)
+        assert events.headers["content-type"].startswith("text/event-stream")
+        assert "event: succeeded\n" in events.text
+
+        assert client.get(f"/image/jobs/{job_id}", headers=other.headers).status_code == 404
+        assert client.delete(f"/image/jobs/{job_id}", headers=user.headers).status_code == 409
+    finally:
+        client.portal.call(mcp_pool.close_pool)
+
+    with engine.connect() as conn:
+        saved = conn.execute(select(History.type, History.query, History.result).where(History.user_id == user.id)).all()
+    assert saved == [("image", "a red fox", state["result"])]
+
+
+def test_priority_order_cancellation_and_depth_limit(client):
+    async def run():
+        runner = Gated()
+        queue = JobQueue("test-order", runner, workers=1, max_depth=3, result_ttl=60, poll_interval=0.05)
+        await queue.start()
+        try:
+            first = await queue.submit(1, "first")
+            await until(lambda: first.status == "running")
+            low = await queue.submit(1, "low", "low")
+            normal = await queue.submit(1, "normal")
+            high = await queue.submit(1, "high", "high")
+            assert [queue.position(job) for job in (high, normal, low)] == [1, 2, 3]
+            with pytest.raises(QueueFull):
+                await queue.submit(1, "one too many")
+
+            assert await queue.cancel(normal)
+            assert await queue.cancel(first)
+            await until(lambda: first.finished)
+            assert (first.status, normal.status) == ("cancelled", "cancelled")
+            assert not await queue.cancel(first)
+
+            runner.gate.set()
+            await until(lambda: low.finished)
+            assert runner.started == ["first", "high", "low"]
+            assert (high.result, low.result) == ("HIGH", "LOW")
+            assert queue.stats()["succeeded"] == 2 and queue.stats()["rejected"] == 1
+        finally:
+            await queue.close()
+
+    client.portal.call(run)
+
+
+def test_another_worker_sees_and_cancels_a_job(client):
+    async def run():
+        runner = Gated()
+        owner = JobQueue("test-shared", runner, workers=1, max_depth=10, result_ttl=60, poll_interval=0.05)
+        other = JobQueue("test-shared", runner, workers=1, max_depth=10, result_ttl=60, poll_interval=0.05)
+        await owner.start()
+        await other.start()
+        try:
+            running = await owner.submit(1, "running")
+            queued = await owner.submit(1, "queued")
+            seen = await seen_by(other, running.id, "running")
+            assert seen is not running and other.describe(seen)["status"] == "running"
+            assert other.describe(await other.get(queued.id))["position"] == 1
+            assert await other.get("no-such-job") is None
+
+            states = []
+
+            async def follow():
+                async for state in other.watch(seen, keepalive=10):
+                    states.append(state["status"])
+
+            watcher = asyncio.create_task(follow())
+            await until(lambda: states == ["running"])
+            assert await other.cancel(seen)
+            # The owner applies the request on its next sync
+            await until(lambda: running.status == "cancelled")
+            await asyncio.wait_for(watcher, 5)
+            assert states == ["running", "cancelled"]
+            assert not await other.cancel(seen) and seen.status == "cancelled"
+
+            runner.gate.set()
+            assert (await seen_by(other, queued.id, "succeeded")).result == "QUEUED"
+        finally:
+            await other.close()
+            await owner.close()
+
+    client.portal.call(run)
+
+
+def test_jobs_of_a_stopped_worker_fail_and_expire(client):
+    async def run():
+        # Never started: its jobs stay queued without a heartbeat, as if the worker had died
+        stopped = JobQueue("test-stopped", Gated(), workers=1, max_depth=10, result_ttl=60)
+        survivor = JobQueue("test-stopped", Gated(), workers=1, max_depth=10, result_ttl=0.2, lease=0.1)
+        job = await stopped.submit(1, "orphan")
+
+        await survivor.sync()
+        assert (await survivor.get(job.id)).status == "queued"  # still within its lease
+        await asyncio.sleep(0.15)
+        await survivor.sync()
+        failed = await survivor.get(job.id)
+        assert failed.status == "failed" and "stopped" in failed.error
+
+        await asyncio.sleep(0.25)
+        await survivor.sync()
+        assert await survivor.get(job.id) is None
+
+    client.portal.call(run)
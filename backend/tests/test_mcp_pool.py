@@ -0,0 +1,81 @@
+"""
+MCP session pool against the local Flux stand-in (benchmarks/mock_upstreams.py).
+
+The stand-in runs in a subprocess so it can be stopped and restarted on the
+same port. ClientSession.initialize/list_tools are counted to tell a reused
+session from a new one.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import mcp_pool
+
+
+@pytest.fixture
+def handshakes(monkeypatch):
+    """Counts of ClientSession.initialize and list_tools calls."""
+    counts = {"initialize": 0, "list_tools": 0}
+    client_session, _ = mcp_pool._sdk()
+    for name in counts:
+        original = getattr(client_session, name)
+
+        async def counted(self, *args, _original=original, _name=name, **kwargs):
+            counts[_name] += 1
+            return await _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(client_session, name, counted)
+    return counts
+
+
+async def generate(pool: mcp_pool.MCPSessionPool, prompt: str) -> str:
+    async with pool.acquire() as conn:
+        result = await conn.session.call_tool(name="generateImageUrl", arguments={"prompt": prompt})
+    assert not result.isError
+    return json.loads(result.content[0].text)["imageUrl"]
+
+
+def test_second_call_reuses_session(stand_in, handshakes):
+    async def run():
+        pool = await mcp_pool.start_pool(stand_in.url, size=1)
+        try:
+            assert handshakes == {"initialize": 0, "list_tools": 0}  # opened on first use
+            first = await generate(pool, "a cat")
+            second = await generate(pool, "a dog")
+        finally:
+            await mcp_pool.close_pool()
+        assert first != second
+        assert handshakes == {"initialize": 1, "list_tools": 1}
+
+    asyncio.run(run())
+
+
+def test_reconnects_after_server_restart(stand_in, handshakes):
+    async def run():
+        # An idle timeout of 0 health-checks the session before every use
+        pool = await mcp_pool.start_pool(stand_in.url, size=1, idle_timeout=0)
+        try:
+            await generate(pool, "before restart")
+            stand_in.stop()
+            stand_in.start()
+            assert await generate(pool, "after restart")
+        finally:
+            await mcp_pool.close_pool()
+        assert handshakes["initialize"] == 2
+
+    asyncio.run(run())
+
+
+def test_close_pool_shuts_down_cleanly(stand_in):
+    async def run():
+        pool = await mcp_pool.start_pool(stand_in.url, size=2, connect=True)
+        sessions = list(pool._sessions)
+        assert all(conn.alive for conn in sessions)
+        await asyncio.wait_for(mcp_pool.close_pool(), 10)
+        assert mcp_pool.get_pool() is None
+        assert not any(conn.alive or conn._task for conn in sessions)
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+"""Dashboard keyset cursors: encoding, rejection of bad ones, and paging across equal timestamps."""
+
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert
+
+from models import History
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    moment = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    cursor = encode_cursor(moment, 42)
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor  # URL-safe, unpadded
+    assert decode_cursor(cursor) == (moment, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor(datetime(2024, 1, 1), 1)[:-3], "WzFd"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as rejected:
+        decode_cursor(cursor)
+    assert rejected.value.status_code == 400
+
+
+def test_pages_cover_rows_with_equal_timestamps(client, engine, register):
+    user = register()
+    same, earlier = datetime(2024, 3, 1, 12), datetime(2024, 3, 1, 11)
+    with engine.begin() as conn:
+        for created_at in [same] * 5 + [earlier] * 2:
+            conn.execute(insert(History).values(user_id=user.id, type="search", query="q", result="r", created_at=created_at))
+
+    pages, cursor = [], None
+    while True:
+        response = client.get("/dashboard/", headers=user.headers, params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        pages.append([(item["created_at"], item["id"]) for item in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    rows = [row for page in pages for row in page]
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert len(set(rows)) == 7
+    # Newest first, ties broken by id, descending
+    assert rows == sorted(rows, reverse=True)
+
+    assert client.get("/dashboard/", headers=user.headers, params={"cursor": "garbage"}).status_code == 400
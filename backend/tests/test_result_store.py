@@ -0,0 +1,115 @@
+"""
+Stored result collection: the grace period that protects rows still being
+written, and the lock that keeps the collector to one worker.
+
+Run on the app's event loop (client.portal), where the async engine lives.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+import result_store
+from database import async_session
+from models import History, StoredResult
+from result_store import ResultCollector, collect_garbage
+
+
+def body(name: str) -> str:
+    return f"{name} " * result_store.RESULT_STORE_MIN_BYTES
+
+
+async def record(user_id: int, text: str, commit: bool = True):
+    """Insert one History row the way history_writer does; returns the open session if not committed."""
+    db = async_session()
+    await db.execute(insert(History), await result_store.store(db, [
+        {"user_id": user_id, "type": "search", "query": "q", "result": text},
+    ]))
+    if not commit:
+        return db
+    await db.commit()
+    await db.close()
+
+
+def stored(engine, text: str):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(StoredResult.id, StoredResult.referenced_at).where(StoredResult.hash == result_store.digest(text))
+        ).first()
+
+
+def orphan(engine, user_id: int, text: str, age: timedelta):
+    """Leave ``text`` stored with no row referencing it, last referenced ``age`` ago."""
+    with engine.begin() as conn:
+        conn.execute(delete(History).where(History.result_hash == result_store.digest(text)))
+        conn.execute(update(StoredResult).where(StoredResult.hash == result_store.digest(text))
+                     .values(referenced_at=datetime.utcnow() - age))
+
+
+def test_recently_referenced_results_are_spared(client, engine, register):
+    user = register()
+    recent, old = body("recent"), body("old")
+
+    async def run():
+        await record(user.id, recent)
+        await record(user.id, old)
+
+    client.portal.call(run)
+    orphan(engine, user.id, recent, timedelta(seconds=10))
+    orphan(engine, user.id, old, timedelta(hours=1))
+
+    assert client.portal.call(collect_garbage, 1000, 60) >= 1
+    assert stored(engine, recent) is not None
+    assert stored(engine, old) is None
+
+
+def test_reusing_a_result_refreshes_it(client, engine, register):
+    user = register()
+    text = body("reused")
+    client.portal.call(record, user.id, text)
+    orphan(engine, user.id, text, timedelta(hours=1))
+
+    client.portal.call(record, user.id, text)
+    assert datetime.utcnow() - stored(engine, text).referenced_at < timedelta(minutes=1)
+
+
+def test_collector_spares_a_result_an_uncommitted_row_reuses(client, engine, register):
+    user = register()
+    text = body("in flight")
+    client.portal.call(record, user.id, text)
+    orphan(engine, user.id, text, timedelta(hours=1))
+
+    async def run():
+        db = await record(user.id, text, commit=False)
+        try:
+            # The collector sees an old, unreferenced result, and waits on the writer to delete it
+            collecting = asyncio.create_task(collect_garbage(grace=60))
+            await asyncio.sleep(0.3)
+            await db.commit()
+        finally:
+            await db.close()
+        await collecting
+
+    client.portal.call(run)
+    with engine.connect() as conn:
+        hashes = conn.scalars(select(History.result_hash).where(History.user_id == user.id)).all()
+    assert hashes == [result_store.digest(text)]
+    assert stored(engine, text) is not None
+
+
+def test_one_collector_at_a_time(client):
+    async def run():
+        first, second = ResultCollector(), ResultCollector()
+        try:
+            assert await first.collect()
+            assert not await second.collect()
+            assert first.stats()["leader"] and not second.stats()["leader"]
+            # Another worker takes over once the first one stops
+            await first.close()
+            assert await second.collect()
+        finally:
+            await first.close()
+            await second.close()
+
+    client.portal.call(run)
@@ -0,0 +1,75 @@
+"""Activity rollups: the history triggers keep the counts right on insert and delete."""
+
+from datetime import date, datetime
+
+from sqlalchemy import delete, func, insert, select
+
+import rollups
+from models import DailyActivityRollup, History, UserActivityRollup
+
+# Days no other test writes to
+FIRST, SECOND = datetime(1999, 1, 1, 10), datetime(1999, 1, 2, 10)
+
+
+def add(engine, user_id: int, *rows: tuple[str, datetime]) -> list[int]:
+    with engine.begin() as conn:
+        return [
+            conn.execute(insert(History).values(user_id=user_id, type=type, query="q", result="r", created_at=created_at)).inserted_primary_key[0]
+            for type, created_at in rows
+        ]
+
+
+def per_user(engine, user_id: int) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(
+            select(UserActivityRollup.type, UserActivityRollup.count).where(UserActivityRollup.user_id == user_id)
+        ).all())
+
+
+def per_day(engine) -> dict:
+    with engine.connect() as conn:
+        return {
+            (day, type): count for day, type, count in conn.execute(
+                select(DailyActivityRollup.day, DailyActivityRollup.type, func.sum(DailyActivityRollup.count))
+                .where(DailyActivityRollup.day.in_([FIRST.date(), SECOND.date()]))
+                .group_by(DailyActivityRollup.day, DailyActivityRollup.type)
+            ).all()
+        }
+
+
+def test_counts_follow_inserts_and_deletes(client, engine, register):
+    user = register()
+    ids = add(engine, user.id, *[("search", FIRST)] * 5, ("image", FIRST), ("search", SECOND))
+
+    assert per_user(engine, user.id) == {"search": 6, "image": 1}
+    assert per_day(engine) == {(date(1999, 1, 1), "search"): 5, (date(1999, 1, 1), "image"): 1, (date(1999, 1, 2), "search"): 1}
+    with engine.connect() as conn:
+        shards = conn.scalar(select(func.count()).select_from(DailyActivityRollup).where(
+            DailyActivityRollup.day == FIRST.date(), DailyActivityRollup.type == "search",
+        ))
+    assert shards == 5  # consecutive ids land on different shards
+
+    with engine.begin() as conn:
+        conn.execute(delete(History).where(History.id.in_(ids[:2] + ids[5:])))
+    assert per_user(engine, user.id) == {"search": 3}
+    assert per_day(engine) == {(date(1999, 1, 1), "search"): 3}
+
+    with engine.begin() as conn:
+        conn.execute(delete(History).where(History.user_id == user.id))
+    # Rows that reach zero are dropped
+    assert per_user(engine, user.id) == {}
+    assert per_day(engine) == {}
+
+
+def test_backfill_matches_the_triggers(client, engine, register):
+    user = register()
+    add(engine, user.id, *[("search", FIRST)] * 3, ("image", SECOND), ("image", SECOND))
+    counted = per_user(engine, user.id), per_day(engine)
+
+    with engine.begin() as conn:
+        rollups.backfill(conn)
+    assert (per_user(engine, user.id), per_day(engine)) == counted
+
+    with engine.begin() as conn:
+        conn.execute(delete(History).where(History.user_id == user.id))
+    assert per_day(engine) == {}
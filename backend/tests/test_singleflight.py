@@ -0,0 +1,101 @@
+"""SingleFlight: sharing one call between concurrent callers, and cancellation."""
+
+import asyncio
+import gc
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Call:
+    """A shared call that finishes (or raises) once .release is set, counting its runs."""
+
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.runs = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return f"result {self.runs}"
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        flight, call = SingleFlight("test"), Call()
+        callers = [asyncio.create_task(flight.do("key", call)) for _ in range(5)]
+        other = asyncio.create_task(flight.do("other key", Call()))
+        await asyncio.sleep(0)
+        assert flight.stats() == {"executed": 2, "coalesced": 4, "in_flight": 2}
+
+        call.release.set()
+        assert await asyncio.gather(*callers) == ["result 1"] * 5
+        assert call.runs == 1 and flight.stats()["in_flight"] == 1
+        other.cancel()
+
+        # Nothing is kept once the call is done
+        call.release = asyncio.Event()
+        call.release.set()
+        assert await flight.do("key", call) == "result 2"
+
+    asyncio.run(run())
+
+
+def test_errors_reach_every_caller():
+    async def run():
+        flight, call = SingleFlight("test"), Call(LookupError("upstream failed"))
+        callers = [asyncio.create_task(flight.do("key", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        call.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [type(result) for result in results] == [LookupError] * 3
+        assert call.runs == 1
+
+    asyncio.run(run())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_call():
+    async def run():
+        flight, call = SingleFlight("test"), Call()
+        leaving = asyncio.create_task(flight.do("key", call))
+        staying = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        call.release.set()
+        assert await staying == "result 1"
+        assert not call.cancelled
+
+    asyncio.run(run())
+
+
+def test_call_finishes_when_every_caller_is_gone():
+    async def run():
+        unhandled = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        flight, call = SingleFlight("test"), Call(LookupError("nobody is listening"))
+        caller = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0)
+
+        assert flight.stats()["in_flight"] == 1  # still running for the next caller with this key
+        call.release.set()
+        await asyncio.sleep(0.01)
+        assert flight.stats()["in_flight"] == 0
+        assert not call.cancelled and call.runs == 1
+        gc.collect()  # a never-retrieved exception is reported when its task is collected
+        assert unhandled == []
+
+    asyncio.run(run())
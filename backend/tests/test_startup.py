@@ -0,0 +1,29 @@
+"""Worker startup stays cheap: the app's lifespan builds no database engine."""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+SCRIPT = """
+import asyncio
+import database
+import main
+
+async def run():
+    async with main.lifespan(main.app):
+        print(database.get_engine.cache_info().currsize, database.get_async_engine.cache_info().currsize)
+
+asyncio.run(run())
+"""
+
+
+def test_lifespan_builds_no_engine(tmp_path):
+    # A fresh process: the test session has built both engines already
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path}/startup.sqlite3", "FLUX_API_KEY": "",
+           "IMAGE_STORE_DIR": str(tmp_path / "images")}
+    done = subprocess.run([sys.executable, "-c", SCRIPT], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60)
+    assert done.returncode == 0, done.stderr
+    assert done.stdout.split() == ["0", "0"]
@@ -0,0 +1,184 @@
+"""
+Upstream.call: circuit breaker, hedging, deadlines and local waits.
+
+Each test drives its own Upstream with stand-in attempt functions, so no
+network is involved.
+"""
+
+import asyncio
+
+import pytest
+
+import upstream
+from upstream import CLOSED, HALF_OPEN, OPEN, CircuitOpen, DeadlineExceeded, Upstream, local_wait
+
+
+def make(**kwargs) -> Upstream:
+    options = dict(deadline=2, retries=0, retryable=lambda e: True, breaker_threshold=3, breaker_reset=0.2)
+    options.update(kwargs)
+    return Upstream("test", **options)
+
+
+class Flaky:
+    """An attempt function that fails while .failing is set, counting its calls."""
+
+    def __init__(self, failing: bool = True, latency: float = 0.0):
+        self.failing = failing
+        self.latency = latency
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.failing:
+            raise ConnectionError("upstream down")
+        return "ok"
+
+
+def test_breaker_opens_after_consecutive_failures():
+    async def run():
+        api, fn = make(), Flaky()
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                await api.call(fn)
+        assert api.state == OPEN
+        with pytest.raises(CircuitOpen) as rejected:
+            await api.call(fn)
+        assert fn.calls == 3  # failed fast, without an attempt
+        assert 0 < rejected.value.retry_after <= 0.2
+        assert api.stats()["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker():
+    async def run():
+        api, fn = make(), Flaky()
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                await api.call(fn)
+        await asyncio.sleep(0.25)
+
+        # One probe at a time; a failed probe opens the breaker again at once
+        with pytest.raises(ConnectionError):
+            await api.call(fn)
+        assert api.state == OPEN and api.opened == 2
+        await asyncio.sleep(0.25)
+
+        fn.failing, fn.latency = False, 0.05
+        probe = asyncio.create_task(api.call(fn))
+        await asyncio.sleep(0.01)
+        assert api.state == HALF_OPEN
+        with pytest.raises(CircuitOpen):
+            await api.call(fn)  # while the probe is out
+        assert await probe == "ok"
+        assert api.state == CLOSED
+        assert await api.call(fn) == "ok"
+
+    asyncio.run(run())
+
+
+def test_hedged_attempt_wins_when_the_first_is_slow(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_HEDGE_MIN_SAMPLES", 5)
+
+    async def run():
+        api = make(hedge=True)
+        fast = Flaky(failing=False, latency=0.01)
+        for _ in range(10):
+            await api.call(fast)  # p95 is now about 10ms
+
+        started, cancelled = [], []
+
+        async def slow_then_fast():
+            started.append(len(started))
+            try:
+                await asyncio.sleep(1 if len(started) == 1 else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return len(started)
+
+        assert await api.call(slow_then_fast) == 2
+        await asyncio.sleep(0)
+        assert (api.hedges, api.hedge_wins) == (1, 1)
+        assert cancelled == [True]  # the slow attempt was cancelled
+
+    asyncio.run(run())
+
+
+def test_no_hedge_without_enough_samples():
+    async def run():
+        api, fn = make(hedge=True), Flaky(failing=False, latency=0.01)
+        assert await api.call(fn) == "ok"
+        assert api.hedges == 0 and fn.calls == 1
+
+    asyncio.run(run())
+
+
+def test_deadline_expiry_counts_against_the_upstream():
+    async def run():
+        api = make(deadline=0.05)
+        with pytest.raises(DeadlineExceeded):
+            await api.call(Flaky(failing=False, latency=1))
+        assert api.failures == 1
+
+    asyncio.run(run())
+
+
+def test_timeout_error_raised_by_fn_is_not_a_deadline():
+    async def run():
+        api = make(retries=1, retryable=lambda e: isinstance(e, TimeoutError))
+        calls = []
+
+        async def times_out():
+            calls.append(1)
+            raise TimeoutError("read timed out")
+
+        with pytest.raises(TimeoutError) as raised:
+            await api.call(times_out)
+        assert not isinstance(raised.value, DeadlineExceeded)
+        assert len(calls) == 2 and api.retried == 1
+
+    asyncio.run(run())
+
+
+def test_local_wait_is_not_charged_to_the_upstream():
+    async def run():
+        api = make(deadline=0.1)
+        free = asyncio.Event()
+
+        async def waits_for_a_session():
+            with local_wait():
+                await free.wait()
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        # The deadline passes while waiting: no upstream failure is recorded
+        with pytest.raises(DeadlineExceeded):
+            await api.call(waits_for_a_session)
+        assert api.failures == 0 and api.state == CLOSED
+
+        asyncio.get_running_loop().call_later(0.05, free.set)
+        assert await api.call(waits_for_a_session) == "ok"
+        assert max(api._latencies) < 0.04  # the 50ms wait is left out
+
+    asyncio.run(run())
+
+
+def test_error_while_waiting_is_not_retried_or_counted():
+    async def run():
+        api = make(retries=2)
+        calls = []
+
+        async def pool_times_out():
+            calls.append(1)
+            with local_wait():
+                raise LookupError("no free connection")
+
+        for _ in range(5):
+            with pytest.raises(LookupError):
+                await api.call(pool_times_out)
+        assert len(calls) == 5
+        assert api.failures == 0 and api.state == CLOSED
+
+    asyncio.run(run())
@@ -0,0 +1,312 @@
+"""
+Resilient calls to the paid upstream APIs (Tavily, Flux).
+
+Upstream.call(fn) runs ``fn()`` (one attempt) under:
+- a deadline for the whole call, retries included; an attempt that is still
+  running when it passes is cancelled and DeadlineExceeded is raised
+- retries with full-jitter exponential backoff, for errors the upstream's
+  ``retryable`` function accepts, and only while the remaining time can
+  still fit the backoff plus a typical (median) attempt
+- a circuit breaker: after UPSTREAM_BREAKER_THRESHOLD consecutive failed
+  attempts the upstream is considered down and calls fail at once with
+  CircuitOpen for UPSTREAM_BREAKER_RESET seconds; then a single probe call
+  decides whether it closes again
+- optional hedging: when an attempt has run longer than the recent p95
+  latency, a second identical attempt is started and the first to succeed
+  wins (the other is cancelled). Only for idempotent calls; it costs up to
+  one extra upstream call for the slowest ~5% of requests.
+
+Waiting for a local resource inside ``fn`` (a pooled MCP session, a free
+connection in the HTTP pool) is marked with local_wait(). That time is left
+out of the latency samples and metrics, and a failure or deadline while
+waiting says nothing about the upstream: it is neither retried nor counted
+by the breaker. The deadline itself still covers the wait.
+
+State is per worker process. Counters are exported through metrics.py and
+Upstream.stats() (/admin/upstreams/stats).
+"""
+
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+
+from metrics import Counter, Gauge, observe_upstream
+from settings import load_env
+
+load_env()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.2"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "2"))
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.95"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+UPSTREAM_LATENCY_WINDOW = 200  # recent successful attempts kept for the median and p95
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge("upstream_breaker_state", "Circuit breaker state (0 closed, 1 half open, 2 open)", ("upstream",))
+BREAKER_TRANSITIONS = Counter("upstream_breaker_transitions_total", "Circuit breaker state changes", ("upstream", "state"))
+BREAKER_REJECTED = Counter("upstream_breaker_rejected_total", "Calls failed fast by an open breaker", ("upstream",))
+RETRIES = Counter("upstream_retries_total", "Upstream attempts retried after a failure", ("upstream",))
+HEDGES = Counter("upstream_hedges_total", "Hedged (duplicate) upstream attempts started", ("upstream",))
+HEDGE_WINS = Counter("upstream_hedge_wins_total", "Hedged attempts that finished first", ("upstream",))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class _Attempt:
+    """One run of fn: whether it is waiting for a local resource, and for how long it has waited."""
+
+    def __init__(self):
+        self.waiting = False
+        self.waited = 0.0
+        self.done = False
+
+    @property
+    def at_upstream(self) -> bool:
+        return not self.done and not self.waiting
+
+
+class _LocalFailure(Exception):
+    """fn failed while waiting for a local resource; carries the original error."""
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
+
+
+_current_attempt: contextvars.ContextVar[_Attempt | None] = contextvars.ContextVar("upstream_attempt", default=None)
+
+
+class local_wait:
+    """Mark a wait for a local resource inside an Upstream.call attempt (a no-op outside one).
+
+    Used as a context manager around the wait; end() stops it early, e.g. from
+    a callback that fires once the resource is obtained.
+    """
+
+    def __init__(self):
+        self._attempt = _current_attempt.get()
+        self._start = None
+
+    def __enter__(self):
+        if self._attempt is not None:
+            self._attempt.waiting = True
+            self._start = time.monotonic()
+        return self
+
+    def end(self):
+        if self._start is not None:
+            self._attempt.waiting = False
+            self._attempt.waited += time.monotonic() - self._start
+            self._start = None
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self._start is not None
+        self.end()
+        if local and isinstance(exc, Exception):
+            raise _LocalFailure(exc) from exc
+        return False
+
+
+class Upstream:
+    def __init__(
+        self,
+        name: str,
+        deadline: float,
+        retries: int,
+        retryable,
+        hedge: bool = False,
+        breaker_threshold: int = UPSTREAM_BREAKER_THRESHOLD,
+        breaker_reset: float = UPSTREAM_BREAKER_RESET,
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.retryable = retryable
+        self.hedge = hedge
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.state = CLOSED
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0
+        self.opened = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._latencies = deque(maxlen=UPSTREAM_LATENCY_WINDOW)
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], upstream=name)
+
+    # Circuit breaker
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"{self.name} circuit breaker {self.state} -> {state}")
+            self.state = state
+            BREAKER_STATE.set(STATE_VALUES[state], upstream=self.name)
+            BREAKER_TRANSITIONS.inc(upstream=self.name, state=state)
+
+    def _admit(self) -> bool:
+        """Raise CircuitOpen unless an attempt may go out; True if it is the half-open probe."""
+        if self.state == OPEN:
+            wait = self._opened_at + self.breaker_reset - time.monotonic()
+            if wait > 0:
+                self._reject(wait)
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self._reject(1.0)
+            self._probing = True
+            return True
+        return False
+
+    def _reject(self, retry_after: float):
+        self.rejected += 1
+        BREAKER_REJECTED.inc(upstream=self.name)
+        raise CircuitOpen(self.name, retry_after)
+
+    def _healthy(self):
+        self._consecutive_failures = 0
+        self._set_state(CLOSED)
+
+    def _unhealthy(self):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self.state == HALF_OPEN or self._consecutive_failures >= self.breaker_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    # Latency estimates
+
+    def _quantile(self, q: float) -> float | None:
+        if len(self._latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    # Calls
+
+    async def _timed(self, fn, attempts: list[_Attempt]):
+        attempt = _Attempt()
+        attempts.append(attempt)
+        _current_attempt.set(attempt)  # runs in its own task, so this stays within the attempt
+        start = time.monotonic()
+        try:
+            with observe_upstream(self.name, excluded=lambda: attempt.waited):
+                result = await fn()
+        finally:
+            attempt.done = True
+        self._latencies.append(time.monotonic() - start - attempt.waited)
+        return result
+
+    async def _attempt(self, fn, probe: bool, attempts: list[_Attempt]):
+        delay = None if probe or not self.hedge else self._quantile(UPSTREAM_HEDGE_QUANTILE)
+        primary = asyncio.create_task(self._timed(fn, attempts))
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    HEDGES.inc(upstream=self.name)
+                    tasks.append(asyncio.create_task(self._timed(fn, attempts)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                            HEDGE_WINS.inc(upstream=self.name)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def call(self, fn, deadline: float | None = None):
+        """Run ``fn()`` with this upstream's deadline, retries, breaker and hedging."""
+        self.calls += 1
+        end = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            probe = self._admit()
+            attempts = []
+            try:
+                async with asyncio.timeout(max(end - time.monotonic(), 0)) as timer:
+                    result = await self._attempt(fn, probe, attempts)
+            except _LocalFailure as e:
+                raise e.error from None  # e.g. no free session in time; the upstream was not reached
+            except Exception as e:
+                if isinstance(e, TimeoutError) and timer.expired():
+                    if any(attempt.at_upstream for attempt in attempts):
+                        self._unhealthy()
+                    raise DeadlineExceeded(f"{self.name} did not answer within {deadline or self.deadline}s") from None
+                # A TimeoutError raised by fn itself is an ordinary failed attempt
+                if not self.retryable(e):
+                    self._healthy()  # the upstream answered; the request itself was bad
+                    raise
+                self._unhealthy()
+                attempt += 1
+                backoff = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** (attempt - 1)))
+                typical = self._quantile(0.5) or 0.0
+                if attempt > self.retries or time.monotonic() + backoff + typical >= end or self.state == OPEN:
+                    raise
+                self.retried += 1
+                RETRIES.inc(upstream=self.name)
+                logger.info(f"Retrying {self.name} in {backoff:.2f}s after: {e}")
+                await asyncio.sleep(backoff)
+                continue
+            finally:
+                if probe:
+                    self._probing = False
+            self._healthy()
+            return result
+
+    def stats(self) -> dict:
+        p50, p95 = self._quantile(0.5), self._quantile(UPSTREAM_HEDGE_QUANTILE)
+        retry_after = self._opened_at + self.breaker_reset - time.monotonic() if self.state == OPEN else 0
+        return {
+            "state": self.state,
+            "retry_after": math.ceil(max(retry_after, 0)),
+            "deadline": self.deadline,
+            "hedging": self.hedge,
+            "calls": self.calls,
+            "failed_attempts": self.failures,
+            "retries": self.retried,
+            "rejected": self.rejected,
+            "opened": self.opened,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
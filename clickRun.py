@@ -1,7 +1,9 @@
+import argparse
 import subprocess
 import os
 import signal
 import sys
+import threading
 import time
 import shutil
 
@@ -35,12 +37,12 @@ def run_frontend():
     cmd = ["cmd", "/c", "npm", "run", "dev"] if os.name == "nt" else ["npm", "run", "dev"]
     
     try:
+        # Argument list without shell=True: with a shell, POSIX would run only "npm"
         process = subprocess.Popen(
             cmd,
             cwd=frontend_dir,
-            shell=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True
         )
         return process
@@ -48,8 +50,8 @@ def run_frontend():
         print(f"Failed to start frontend: {str(e)}")
         sys.exit(1)
 
-def run_backend():
-    """Run the backend FastAPI server (uvicorn main:app --reload)."""
+def run_backend(prod=False):
+    """Run the backend: uvicorn main:app --reload, or serve.py's worker processes with prod=True."""
     backend_dir = os.path.join(os.getcwd(), "backend")  # Adjust to 'backend/' if needed
     main_file = os.path.join(backend_dir, "main.py")
     if not os.path.exists(main_file):
@@ -61,21 +63,23 @@ def run_backend():
     if not os.path.exists(python_exe):
         python_exe = "python"
     
-    cmd = [python_exe, "-m", "uvicorn", "main:app", "--reload", "--port", "8000"]
+    if prod:
+        cmd = [python_exe, "serve.py", "--port", "8000"]
+    else:
+        cmd = [python_exe, "-m", "uvicorn", "main:app", "--reload", "--port", "8000"]
     
     try:
         process = subprocess.Popen(
             cmd,
             cwd=backend_dir,
-            shell=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True
         )
         # Check if process started
         time.sleep(1)
         if process.poll() is not None:
-            error_output = process.stderr.read()
+            error_output = process.stdout.read()
             print(f"Backend failed to start: {error_output}")
             sys.exit(1)
         return process
@@ -83,26 +87,25 @@ def run_backend():
         print(f"Failed to start backend: {str(e)}")
         sys.exit(1)
 
+def stream_output(process, name):
+    # stderr is merged into stdout, so one blocking read per process cannot
+    # stall on the other stream; each process has its own reader thread
+    for line in process.stdout:
+        print(f"[{name}] {line.rstrip()}", flush=True)
+
 def main():
+    parser = argparse.ArgumentParser(description="Start the frontend dev server and the backend")
+    parser.add_argument("--prod", action="store_true", help="run the backend with serve.py (multi-worker, no reload)")
+    args = parser.parse_args()
+
     print("Checking requirements...")
     check_requirements()
     print("Starting frontend and backend servers...")
     
     frontend_process = run_frontend()
-    backend_process = run_backend()
-    
-    def stream_output(process, name):
-        while process.poll() is None:
-            line = process.stdout.readline()
-            if line:
-                print(f"[{name}] {line.strip()}")
-            err_line = process.stderr.readline()
-            if err_line:
-                print(f"[{name} ERROR] {err_line.strip()}")
-            time.sleep(0.1)
+    backend_process = run_backend(prod=args.prod)
     
     try:
-        import threading
         threading.Thread(target=stream_output, args=(frontend_process, "Frontend"), daemon=True).start()
         threading.Thread(target=stream_output, args=(backend_process, "Backend"), daemon=True).start()
         
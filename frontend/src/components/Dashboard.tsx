@@ -1,5 +1,6 @@
-import React, { useState, useEffect } from 'react';
-import { getDashboard, updateHistory, deleteHistory } from '../utils/api';
+import React, { useState, useEffect, useRef } from 'react';
+import { getDashboard, updateHistory, deleteHistory, backendUrl } from '../utils/api';
+import type { DashboardFilters } from '../utils/api';
 
 interface HistoryItem {
   id: number;
@@ -9,12 +10,14 @@ interface HistoryItem {
   result: string;
   meta_data?: string;
   created_at: string;
+  thumbnail_url?: string | null;
 }
 
 const Dashboard: React.FC<{ token: string }> = ({ token }) => {
   const [history, setHistory] = useState<HistoryItem[]>([]);
-  const [filteredHistory, setFilteredHistory] = useState<HistoryItem[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | undefined>();
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [filters, setFilters] = useState({
     type: '',
@@ -27,52 +30,59 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
   const [hoveredItem, setHoveredItem] = useState<number | null>(null);
   const [imageLoadingStates, setImageLoadingStates] = useState<Record<number, boolean>>({});
 
-  // Load dashboard data
-  useEffect(() => {
-    setLoading(true);
-    setError(null);
-    getDashboard(token)
-      .then((res) => {
-        console.log('Dashboard data received:', res);
-        setHistory(res);
-        setFilteredHistory(res);
-      })
-      .catch((err) => {
-        console.error('Dashboard load error:', err);
-        setError('Dashboard load failed');
-      })
-      .finally(() => setLoading(false));
-  }, [token]);
-
-  // Apply filters
-  useEffect(() => {
-    let filtered = [...history];
-
-    if (filters.type) {
-      filtered = filtered.filter(item => item.type === filters.type);
-    }
+  // Bumped on every fresh load, so a page requested under older filters is dropped
+  const loadId = useRef(0);
 
-    if (filters.keyword) {
-      filtered = filtered.filter(item => 
-        item.query.toLowerCase().includes(filters.keyword.toLowerCase()) ||
-        item.result.toLowerCase().includes(filters.keyword.toLowerCase())
-      );
-    }
+  const serverFilters = (): DashboardFilters => ({
+    type: filters.type,
+    keyword: filters.keyword.trim(),
+    date_start: filters.dateStart,
+    date_end: filters.dateEnd && filters.dateEnd + 'T23:59:59'
+  });
 
-    if (filters.dateStart) {
-      filtered = filtered.filter(item => 
-        new Date(item.created_at) >= new Date(filters.dateStart)
-      );
-    }
+  // Load the first page; filters are applied by the server, so a change starts over
+  useEffect(() => {
+    const id = ++loadId.current;
+    const timer = setTimeout(() => {
+      setLoading(true);
+      setError(null);
+      getDashboard(token, serverFilters())
+        .then((page) => {
+          if (id !== loadId.current) return;
+          setHistory(page.items);
+          setNextCursor(page.nextCursor);
+        })
+        .catch((err) => {
+          if (id !== loadId.current) return;
+          console.error('Dashboard load error:', err);
+          setError('Dashboard load failed');
+        })
+        .finally(() => {
+          if (id === loadId.current) setLoading(false);
+        });
+    }, filters.keyword ? 300 : 0); // wait for typing to pause before searching
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [token, filters]);
 
-    if (filters.dateEnd) {
-      filtered = filtered.filter(item => 
-        new Date(item.created_at) <= new Date(filters.dateEnd + 'T23:59:59')
-      );
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    const id = loadId.current;
+    setLoadingMore(true);
+    try {
+      const page = await getDashboard(token, serverFilters(), nextCursor);
+      if (id !== loadId.current) return;
+      setHistory(prev => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      console.error('Dashboard load error:', err);
+      alert('Failed to load more items');
+    } finally {
+      setLoadingMore(false);
     }
+  };
 
-    setFilteredHistory(filtered);
-  }, [history, filters]);
+  const hasFilters = Boolean(filters.type || filters.keyword || filters.dateStart || filters.dateEnd);
 
   const handleEdit = (item: HistoryItem) => {
     setEditingItem(item.id);
@@ -208,7 +218,7 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
               Clear Filters
             </button>
             <span className="text-sm text-gray-600 dark:text-gray-400">
-              Showing {filteredHistory.length} of {history.length} items
+              Showing {history.length} items{nextCursor && ', more available'}
             </span>
           </div>
         </div>
@@ -233,7 +243,7 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
         )}
 
         {/* Empty State */}
-        {!loading && !error && filteredHistory.length === 0 && history.length === 0 && (
+        {!loading && !error && history.length === 0 && !hasFilters && (
           <div className="text-center py-16">
             <div className="text-6xl mb-4">📝</div>
             <p className="text-gray-500 dark:text-gray-400 text-lg">
@@ -243,7 +253,7 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
         )}
 
         {/* No Results State */}
-        {!loading && !error && filteredHistory.length === 0 && history.length > 0 && (
+        {!loading && !error && history.length === 0 && hasFilters && (
           <div className="text-center py-16">
             <div className="text-6xl mb-4">🔍</div>
             <p className="text-gray-500 dark:text-gray-400 text-lg">
@@ -254,7 +264,7 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
 
         {/* Results */}
         <div className="space-y-6">
-          {filteredHistory.map((item) => (
+          {history.map((item) => (
             <div
               key={item.id}
               className="group relative bg-gray-50 dark:bg-gray-700 rounded-xl shadow-sm hover:shadow-lg border border-gray-200 dark:border-gray-600 transition-all duration-300 overflow-hidden"
@@ -382,7 +392,7 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
                                 </div>
                               )}
                               <img 
-                                src={item.result} 
+                                src={item.thumbnail_url ? backendUrl(item.thumbnail_url) : item.result} 
                                 alt="Generated image" 
                                 className={`w-full max-w-md rounded-lg shadow-md transition-opacity duration-300 ${imageLoadingStates[item.id] !== false ? 'opacity-0' : 'opacity-100'}`}
                                 onLoad={() => setImageLoadingStates(prev => ({ ...prev, [item.id]: false }))}
@@ -406,12 +416,25 @@ const Dashboard: React.FC<{ token: string }> = ({ token }) => {
           ))}
         </div>
 
+        {/* Load More */}
+        {!loading && nextCursor && (
+          <div className="mt-8 text-center">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-6 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 disabled:opacity-50 transition-colors duration-200"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
+
         {/* Results Summary */}
-        {filteredHistory.length > 0 && (
+        {history.length > 0 && (
           <div className="mt-8 text-center">
             <p className="text-gray-500 dark:text-gray-400">
-              Displaying {filteredHistory.length} {filteredHistory.length === 1 ? 'item' : 'items'}
-              {filteredHistory.length !== history.length && ` of ${history.length} total`}
+              Displaying {history.length} {history.length === 1 ? 'item' : 'items'}
+              {nextCursor && ' (load more to see older ones)'}
             </p>
           </div>
         )}
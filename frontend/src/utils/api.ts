@@ -29,6 +29,7 @@ interface HistoryItem {
   result: string;
   meta_data?: string;
   created_at: string;
+  thumbnail_url?: string | null;
 }
 
 interface User {
@@ -55,6 +56,9 @@ interface AdminStats {
   }[];
 }
 
+// Backend-relative paths (e.g. stored image thumbnails) as absolute URLs
+export const backendUrl = (path: string): string => `${api.defaults.baseURL}${path}`;
+
 export const login = async (username: string, password: string): Promise<string> => {
   const params = new URLSearchParams();
   params.append('username', username);
@@ -102,22 +106,40 @@ export const generateImage = async (prompt: string, token: string): Promise<stri
   throw new Error(typeof response.data.detail === 'string' ? response.data.detail : 'Image generation failed');
 };
 
-export const getDashboard = async (token: string): Promise<HistoryItem[]> => {
+export interface DashboardFilters {
+  type?: string;
+  keyword?: string;
+  date_start?: string;
+  date_end?: string;
+}
+
+export interface DashboardPage {
+  items: HistoryItem[];
+  nextCursor?: string;
+}
+
+// One newest-first page; pass nextCursor back as cursor to get the page after it
+export const getDashboard = async (token: string, filters: DashboardFilters = {}, cursor?: string): Promise<DashboardPage> => {
   try {
-    const response = await api.get<HistoryItem[]>('/dashboard', { 
-      headers: { 
+    const params: Record<string, string> = {};
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value) params[key] = value;
+    });
+    if (cursor) params.cursor = cursor;
+
+    const response = await api.get<HistoryItem[]>('/dashboard', {
+      headers: {
         Authorization: `Bearer ${token}`,
         'Content-Type': 'application/json'
-      } 
+      },
+      params,
     });
-    
-    console.log('API Response:', response); // Add logging
 
     if (!response.data) {
       throw new Error('No data received from server');
     }
 
-    return response.data;
+    return { items: response.data, nextCursor: response.headers['x-next-cursor'] || undefined };
   } catch (error) {
     console.error('Dashboard API error:', error); // Add detailed error logging
     throw error instanceof Error ? error : new Error('Failed to fetch dashboard data');